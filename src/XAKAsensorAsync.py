@@ -0,0 +1,176 @@
+#!/usr/bin/python
+#-----------------------------------------------------------------------------
+# Name:        XAKAsensorAsync.py
+#
+# Purpose:     This module is the asyncio counterpart of the XAKAsensorComm module
+#              to read the data from the XAnKA people counting sensor in an event
+#              loop. The serial port is watched by the loop's reader callback (no
+#              thread per port), so one loop can service several sensors.
+#
+# Author:      Yuancheng Liu
+#
+# Created:     29/01/2022
+# version:     v_2.1
+# Copyright:   YC has not added.
+# License:     YC has not added.
+#-----------------------------------------------------------------------------
+
+import asyncio
+import XAKAsensorComm as xcomm
+
+POLL_INTERVAL = 0.05    # sec between 2 reads if the port can not be watched.
+QUEUE_SIZE = xcomm.QUEUE_SIZE
+
+#-----------------------------------------------------------------------------
+#-----------------------------------------------------------------------------
+class XAKAsensorAsyncClient(object):
+    """ Async sensor client, usage example:
+            client = XAKAsensorAsyncClient('/dev/ttyUSB0')
+            await client.connect()
+            async for frame in client.frames():
+                print(frame)
+        the <frame> is the same 37 values list as XAKAsensorComm.getData().
+    """
+    def __init__(self, commPort, simuMd=False, queueSize=QUEUE_SIZE) -> None:
+        self.serComm = None
+        self.serialPort = commPort  # the serial port name we are going to read.
+        self.simuMd = simuMd        # simulation mode flag
+        self.dataList = []          # current data.
+        self.decoder = xcomm.XAKAframeDecoder()
+        self.queueSize = queueSize
+        self.dropCount = 0          # number of frames dropped by queue full.
+        self.frameQueue = None
+        self.loop = None
+        self.fd = None              # port file descriptor watched by the loop.
+        self.pollTask = None        # task to poll the port which has no fd.
+
+#--XAKAsensorAsyncClient-------------------------------------------------------
+    async def connect(self):
+        """ Open the serial port (or the simulator) and start watching it."""
+        if self.serComm is not None: await self.close()
+        self.loop = asyncio.get_running_loop()
+        self.frameQueue = asyncio.Queue(maxsize=self.queueSize)
+        self.decoder.reset()
+        if self.simuMd:
+            # the simulator must not block the loop, it is polled by a task.
+            self.serComm = xcomm.XandarSimulator(fps=xcomm.SIMU_FPS, timeout=0)
+            self.serComm.setChunk(xcomm.FRAME_HEADER, xcomm.FRAME_SIZE)
+            self.pollTask = self.loop.create_task(self._pollLoop(POLL_INTERVAL))
+            return True
+        import serial   # loaded at the first port open, not at the startup.
+        # timeout=0 : non-blocking read() returns the bytes already received.
+        self.serComm = serial.Serial(self.serialPort, 115200, 8, 'N', 1, timeout=0)
+        try:
+            self.fd = self.serComm.fileno()
+            self.loop.add_reader(self.fd, self._onReadable)
+        except (AttributeError, NotImplementedError):
+            # Windows port or proactor loop: no fd can be watched, poll it.
+            self.fd = None
+            self.pollTask = self.loop.create_task(self._pollLoop(POLL_INTERVAL))
+        return True
+
+#--XAKAsensorAsyncClient-------------------------------------------------------
+    async def frames(self):
+        """ Async generator yields every decoded frame until the client closed.
+            With several consumers every frame is yielded to one of them.
+        """
+        if self.serComm is None: await self.connect()
+        frameQueue = self.frameQueue
+        while True:
+            item = await frameQueue.get()
+            if item is None: 
+                # client closed: pass the end mark on to the other consumers.
+                frameQueue.put_nowait(None)
+                return
+            if isinstance(item, Exception): raise item
+            yield item
+
+#--XAKAsensorAsyncClient-------------------------------------------------------
+    async def close(self):
+        """ Stop watching the port, close it and end all the frames() loops."""
+        if self.fd is not None:
+            self.loop.remove_reader(self.fd)
+            self.fd = None
+        if self.pollTask is not None:
+            self.pollTask.cancel()
+            try:
+                await self.pollTask
+            except asyncio.CancelledError:
+                pass
+            self.pollTask = None
+        if self.serComm is not None:
+            self.serComm.close()
+            self.serComm = None
+        if self.frameQueue is not None: self._putItem(None)
+
+#--XAKAsensorAsyncClient-------------------------------------------------------
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, excType, excVal, excTb):
+        await self.close()
+
+#--XAKAsensorAsyncClient-------------------------------------------------------
+    def _onReadable(self):
+        """ Loop reader callback: read all the bytes received and decode them."""
+        try:
+            data = self.serComm.read(self.serComm.in_waiting or 1)
+        except OSError as err:  # serial.SerialException is an OSError.
+            self.loop.remove_reader(self.fd)
+            self.fd = None
+            self._putItem(err)
+            return
+        self._decode(data)
+
+#--XAKAsensorAsyncClient-------------------------------------------------------
+    async def _pollLoop(self, interval):
+        """ Read the port every <interval> sec if it can not be watched."""
+        while True:
+            try:
+                data = self.serComm.read(xcomm.READ_SIZE)
+            except OSError as err:  # serial.SerialException is an OSError.
+                self._putItem(err)
+                return
+            self._decode(data)
+            await asyncio.sleep(interval)
+
+#--XAKAsensorAsyncClient-------------------------------------------------------
+    def _decode(self, data):
+        for frame in self.decoder.feed(data):
+            self.dataList = frame
+            self._putItem(frame)
+
+#--XAKAsensorAsyncClient-------------------------------------------------------
+    def _putItem(self, item):
+        """ Queue the item, drop the oldest frame if the consumer is too slow."""
+        if self.frameQueue.full():
+            self.dropCount += 1
+            self.frameQueue.get_nowait()
+        self.frameQueue.put_nowait(item)
+
+    def getData(self):
+        return self.dataList
+
+#-----------------------------------------------------------------------------
+#-----------------------------------------------------------------------------
+def testCase(mode=0):
+    async def readSensor(client, frameNum):
+        async with client:
+            async for frame in client.frames():
+                print("%s : %s" % (client.serialPort, str(frame[:5])))
+                frameNum -= 1
+                if frameNum == 0: break
+
+    if mode == 0:
+        # 2 simulated sensors serviced by one event loop.
+        clients = [XAKAsensorAsyncClient('SIMU%d' % i, simuMd=True) for i in range(2)]
+        async def main():
+            await asyncio.gather(*[readSensor(c, 5) for c in clients])
+        asyncio.run(main())
+    else:
+        print("Put your test code here:")
+
+#-----------------------------------------------------------------------------
+if __name__ == '__main__':
+    testCase(mode=0)
@@ -0,0 +1,240 @@
+#!/usr/bin/python
+#-----------------------------------------------------------------------------
+# Name:        XAKAsensorBench.py
+#
+# Purpose:     This module is the headless benchmark suite of the acquisition ->
+#              parse -> render pipeline: frame parsing microbenchmarks, decoder
+#              robustness with the fault-injecting Xandar simulator (frames/sec,
+#              frame-loss percentage, resync latency), a simulator driven end to
+#              end throughput run and the offscreen panels render timings. The
+#              results are saved in a JSON file to compare between versions:
+#                  python XAKAsensorBench.py --out bench.json
+#
+# Author:      Yuancheng Liu
+#
+# Created:     29/01/2022
+# version:     v_2.1
+# Copyright:   YC has not added.
+# License:     YC has not added.
+#-----------------------------------------------------------------------------
+
+import io
+import sys
+import json
+import time
+import platform
+import argparse
+from bisect import bisect_left
+from functools import partial
+from struct import Struct, unpack
+import XAKAsensorComm as xcomm
+
+SEQ_STRUCT = Struct('<f')   # '00: Sequence' float at payload offset 12.
+SEQ_OFFSET = 12
+FRAME_LEN = len(xcomm.FRAME_HEADER) + xcomm.FRAME_SIZE
+
+# Fault injection scenarios: {name: faultRates}
+SCENARIOS = {
+    'clean': {},
+    'split': {'split': 0.5},
+    'noisy': {'garbage': 0.05, 'spurious': 0.05, 'split': 0.3},
+    'harsh': {'truncate': 0.05, 'garbage': 0.1, 'spurious': 0.1, 'split': 0.3,
+              'burst': 0.05, 'stall': 0.05},
+}
+
+#-----------------------------------------------------------------------------
+def legacyParse(data):
+    """ The v2.1 per-read parse: split the read on the header and keep only the
+        first fragment which is exactly one frame payload long.
+    """
+    for item in data.split(xcomm.FRAME_HEADER):
+        if len(item) == xcomm.FRAME_SIZE: return [item]
+    return []
+
+#-----------------------------------------------------------------------------
+def legacyFieldParse(payload):
+    """ The v2.1 per-field parse of one frame payload (37 struct calls)."""
+    dataList = []
+    for idx, data in enumerate(iter(partial(io.BytesIO(payload).read, 4), b'')):
+        val = unpack('i', data) if idx == 0 or idx == 1 else unpack('<f', data)
+        dataList.append(val[0])
+    return dataList
+
+#-----------------------------------------------------------------------------
+def timeIt(func, repeat):
+    """ Return the best time (sec) of <repeat> calls of <func>."""
+    bestT = float('inf')
+    for _ in range(repeat):
+        startT = time.perf_counter()
+        func()
+        bestT = min(bestT, time.perf_counter() - startT)
+    return bestT
+
+#-----------------------------------------------------------------------------
+def benchParse(frameNum=10000, repeat=5, seed=0):
+    """ Microbenchmarks of the frame parsing: return frames/sec of each method."""
+    sim = xcomm.XandarSimulator(seed=seed)
+    sim.setChunk(xcomm.FRAME_HEADER, xcomm.FRAME_SIZE)
+    data = sim.read(frameNum * FRAME_LEN)
+    payloads = xcomm.XAKAframeDecoder().feedRaw(data) + [data[-xcomm.FRAME_SIZE:]]
+    methods = {
+        'legacyFieldParse': lambda: [legacyFieldParse(p) for p in payloads],
+        'structUnpack': lambda: [xcomm.FRAME_STRUCT.unpack(p) for p in payloads],
+        'streamDecoder': lambda: xcomm.XAKAframeDecoder().feed(data),
+        'numpyBatch': lambda: xcomm.parseFrameBatch(data),
+        'numpyBatchUnaligned': lambda: xcomm.parseFrameBatch(data[1:]),
+    }
+    return {name: round(frameNum / timeIt(func, repeat), 1) for name, func in methods.items()}
+
+#-----------------------------------------------------------------------------
+def benchDecoder(faultRates=None, frameNum=20000, readSize=xcomm.READ_SIZE,
+                 seed=0, legacy=False):
+    """ Decode <frameNum> simulated frames read <readSize> bytes each time and
+        return the result dict. If <legacy> is set the v2.1 parse is measured.
+    """
+    sim = xcomm.XandarFaultSimulator(faultRates=faultRates, seed=seed)
+    sim.setChunk(xcomm.FRAME_HEADER, xcomm.FRAME_SIZE)
+    decoder = xcomm.XAKAframeDecoder()
+    offsets, seqs = [], []
+    parseTime = 0.0
+    def parse(data):
+        startT = time.perf_counter()
+        payloads = legacyParse(data) if legacy else decoder.feedRaw(data, offsets)
+        return payloads, time.perf_counter() - startT
+    while sim.seqNum < frameNum:
+        payloads, useT = parse(sim.read(readSize))
+        parseTime += useT
+        seqs.extend(SEQ_STRUCT.unpack_from(p, SEQ_OFFSET)[0] for p in payloads)
+    # decode the bytes left in the simulator's stream buffer (without faults).
+    payloads, useT = parse(bytes(sim.stream))
+    sim.stream.clear()
+    if not legacy: payloads += decoder.flush()
+    parseTime += useT
+    seqs.extend(SEQ_STRUCT.unpack_from(p, SEQ_OFFSET)[0] for p in payloads)
+    # compare with the ground truth.
+    intactSet = set(sim.intactSeqs)
+    goodSet = set(int(seq) for seq in seqs if seq in intactSet)
+    result = {
+        'mode': 'legacy' if legacy else 'decoder',
+        'framesSent': len(intactSet),
+        'framesDecoded': len(seqs),
+        'framesCorrupt': sum(1 for seq in seqs if seq not in intactSet),
+        'framesPerSec': round(len(seqs) / parseTime, 1) if parseTime else 0.0,
+        'frameLossPct': round(100.0 * (1 - len(goodSet) / max(1, len(intactSet))), 3),
+        'faults': len(sim.faultLog),
+    }
+    if not legacy: result.update(resyncLatency(sim.faultLog, offsets))
+    return result
+
+#-----------------------------------------------------------------------------
+def resyncLatency(faultLog, offsets):
+    """ Return the mean/max bytes (and ms at the simulator sensor rate) from a
+        sync breaking fault to the next decoded frame.
+    """
+    latencies = []
+    for faultPos, faultType in faultLog:
+        if faultType not in ('truncate', 'garbage'): continue
+        idx = bisect_left(offsets, faultPos)
+        if idx < len(offsets): latencies.append(offsets[idx] - faultPos)
+    if not latencies: return {'resyncMeanBytes': 0, 'resyncMaxBytes': 0, 'resyncMeanMs': 0.0}
+    meanBytes = sum(latencies) / len(latencies)
+    return {
+        'resyncMeanBytes': round(meanBytes, 1),
+        'resyncMaxBytes': max(latencies),
+        'resyncMeanMs': round(1000.0 * meanBytes / (FRAME_LEN * xcomm.SIMU_FPS), 2),
+    }
+
+#-----------------------------------------------------------------------------
+def benchPipeline(duration=2.0, queueSize=4096, seed=0):
+    """ End to end throughput: the un-paced simulator is read by the sensor comm
+        reader thread and the queue is drained like the UI timer does.
+    """
+    serComm = xcomm.XAKAsensorComm('BENCH', simuMd=True)
+    serComm.serComm = xcomm.XandarSimulator(seed=seed) # no rate limit.
+    serComm.serComm.setChunk(xcomm.FRAME_HEADER, xcomm.FRAME_SIZE)
+    serComm.startReading(queueSize=queueSize)
+    frameNum, maxDepth = 0, 0
+    startT = time.perf_counter()
+    while time.perf_counter() - startT < duration:
+        maxDepth = max(maxDepth, serComm.frameQueue.qsize())
+        frameNum += len(serComm.getFrames())
+        time.sleep(0.01)
+    useT = time.perf_counter() - startT
+    serComm.close()
+    return {
+        'framesPerSec': round(frameNum / useT, 1),
+        'framesDropped': serComm.dropCount,
+        'maxQueueDepth': maxDepth,
+    }
+
+#-----------------------------------------------------------------------------
+def benchRender(repeat=50):
+    """ Offscreen render timings (ms per paint) of PanelChart and PanelMap 
+        drawn on a wx.MemoryDC, skipped if wxPython is not installed.
+    """
+    try:
+        import wx
+        import XAKAsensorPanel as xsp
+    except ImportError as err:
+        return {'skipped': str(err)}
+    app = wx.App(False)
+    frame = wx.Frame(None, -1, 'bench')
+    sim = xcomm.XandarSimulator(seed=0)
+    sim.setChunk(xcomm.FRAME_HEADER, xcomm.FRAME_SIZE)
+    chart = xsp.PanelChart(frame)
+    for frameData in xcomm.XAKAframeDecoder().feed(sim.read(200 * FRAME_LEN)):
+        chart.appendData([frameData[4], frameData[9], frameData[27]])
+    mapPanel = xsp.PanelMap(frame)
+    mapPanel.updatePPLNum(5)
+    result = {}
+    for name, panel in (('PanelChart', chart), ('PanelMap', mapPanel)):
+        w, h = panel.GetSize()
+        bitmap = wx.Bitmap(max(w, 1), max(h, 1))
+        dc = wx.MemoryDC(bitmap)
+        useT = timeIt(lambda: panel.drawPanel(dc), repeat)
+        dc.SelectObject(wx.NullBitmap)
+        result[name+'.OnPaint'] = round(useT * 1000, 3)
+    frame.Destroy()
+    app.Destroy()
+    return result
+
+#-----------------------------------------------------------------------------
+def runBenchSuite(frameNum=20000, duration=2.0, render=True):
+    """ Run all the benchmarks and return the results dict."""
+    return {
+        'meta': {
+            'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'python': sys.version.split()[0],
+            'platform': platform.platform(),
+            'machine': platform.machine(),
+        },
+        'parseFramesPerSec': benchParse(frameNum=frameNum//2),
+        'decoder': {name: benchDecoder(rates, frameNum=frameNum)
+                    for name, rates in SCENARIOS.items()},
+        'legacyDecoder': {name: benchDecoder(rates, frameNum=frameNum, legacy=True)
+                          for name, rates in SCENARIOS.items()},
+        'pipeline': benchPipeline(duration=duration),
+        'renderMs': benchRender() if render else {'skipped': 'disabled'},
+    }
+
+#-----------------------------------------------------------------------------
+#-----------------------------------------------------------------------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='XAKA sensor pipeline benchmark.')
+    parser.add_argument('--out', help='JSON file to save the results.')
+    parser.add_argument('--frames', type=int, default=20000, help='frames per decoder run.')
+    parser.add_argument('--duration', type=float, default=2.0, help='sec of the pipeline run.')
+    parser.add_argument('--no-render', action='store_true', help='skip the render timings.')
+    args = parser.parse_args(argv)
+    results = runBenchSuite(args.frames, args.duration, render=not args.no_render)
+    output = json.dumps(results, indent=2)
+    if args.out:
+        with open(args.out, 'w') as fh:
+            fh.write(output)
+        print("Benchmark results saved in %s" % args.out)
+    else:
+        print(output)
+
+#-----------------------------------------------------------------------------
+if __name__ == '__main__':
+    main()
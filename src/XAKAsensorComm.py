@@ -15,34 +15,331 @@
 #-----------------------------------------------------------------------------
 
 import io
+import os
 import sys
 import glob
-import serial
-import random
-from struct import pack, unpack
+import time
+import queue
+import threading
+import numpy as np
+from struct import Struct
 from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+import XAKAsensorMetrics as xmetrics
+
+FRAME_HEADER = b'XAKA'  # begin bytes of every sensor data frame.
+FIELD_NUM = 37          # 2 int32 header fields + 35 float32 parameters.
+FRAME_SIZE = 4*FIELD_NUM  # 148 bytes payload after the frame header.
+READ_SIZE = 500         # number of bytes read from the serial port each time.
+QUEUE_SIZE = 64         # max number of frames buffered by the reader thread.
+FAULT_TYPES = ('truncate', 'garbage', 'spurious', 'split', 'burst', 'stall')
+SIMU_FPS = 6            # frames per second sent by the simulated sensor.
+DROP_POLICIES = ('oldest', 'newest') # which frame to drop when the queue is full.
+FRAME_STRUCT = Struct('<2i35f')
+# Serial port discovery parameters.
+PROBE_TIMEOUT = 1.2     # sec to wait for a frame header on each probed port.
+PROBE_WORKERS = 32      # max number of ports probed at the same time.
+PORT_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'lastPort.txt')
+PORT_NONE, PORT_OPEN, PORT_SENSOR = 0, 1, 2 # port probe result.
+# numpy structured types of one frame's payload and one frame with the header.
+FRAME_DTYPE = np.dtype([('senId', '<i4'), ('paramNum', '<i4'), ('params', '<f4', (35,))])
+RAW_FRAME_DTYPE = np.dtype([('header', 'S4'), ('senId', '<i4'), ('paramNum', '<i4'),
+                            ('params', '<f4', (35,))])
 
 #-----------------------------------------------------------------------------
 #-----------------------------------------------------------------------------
-class XandarSimulator(object):
-    """ module used to simulate a Xandar COMM USB port interface."""
+class XAKAframeDecoder(object):
+    """ Stateful stream decoder to split the serial bytes stream into the sensor
+        data frames. The decoder keeps the un-processed tail bytes between two 
+        feed() calls so a frame straddling two reads can be reassembled. A 
+        frame is <FRAME_HEADER> + <FRAME_SIZE> bytes payload, when the stream is
+        out of sync (garbage or truncated frame) the decoder resynchronises on 
+        the next header and only accepts the candidate frame if it is followed 
+        by another header.
+    """
+    def __init__(self, maxBufSize=4096) -> None:
+        self.buffer = bytearray()
+        self.maxBufSize = maxBufSize    # max bytes kept while searching header.
+        self.synced = False     # flag whether the last frame ended at a header.
+        self.frameCount = 0     # total number of frames decoded.
+        self.dropBytes = 0      # total number of bytes discarded.
+        self.resyncCount = 0    # number of times the decoder lost the sync.
+        self.streamPos = 0      # stream offset of the first buffered byte.
+
+#--XAKAframeDecoder------------------------------------------------------------
+    def feedRaw(self, data, offsets=None):
+        """ Append the bytes to the buffer and return the list of the complete 
+            frames' payload bytes (without header) found in the buffer. If the 
+            <offsets> list is given, each frame's header offset in the whole 
+            stream is appended to it.
+        """
+        buf = self.buffer
+        buf += data
+        frames = []
+        hdLen, frmLen = len(FRAME_HEADER), len(FRAME_HEADER) + FRAME_SIZE
+        pos = 0
+        while True:
+            start = buf.find(FRAME_HEADER, pos)
+            if start < 0:
+                # keep the last bytes in case the header is split between reads.
+                keep = max(pos, len(buf) - hdLen + 1)
+                self._drop(keep - pos)
+                pos = keep
+                break
+            if start != pos: 
+                self._drop(start - pos)
+            pos = start
+            end = start + frmLen
+            if len(buf) < end: break # wait for more data.
+            tail = bytes(buf[end:end+hdLen])
+            if not FRAME_HEADER.startswith(tail):
+                # the next bytes are not a header: noise after a good frame is 
+                # accepted in sync, but not a frame cut by the next header.
+                if not self.synced or buf.find(FRAME_HEADER, start+hdLen, end+hdLen-1) >= 0:
+                    self._drop(1)
+                    pos += 1
+                    continue
+            elif len(tail) < hdLen and not self.synced: 
+                break # wait the next header to confirm the frame.
+            frames.append(bytes(buf[start+hdLen:end]))
+            if offsets is not None: offsets.append(self.streamPos + start)
+            self.synced = True
+            pos = end
+        del buf[:pos]
+        self.streamPos += pos
+        if len(buf) > self.maxBufSize:
+            trimNum = len(buf) - self.maxBufSize
+            self._drop(trimNum)
+            del buf[:trimNum]
+            self.streamPos += trimNum
+        self.frameCount += len(frames)
+        return frames
+
+#--XAKAframeDecoder------------------------------------------------------------
+    def feed(self, data):
+        """ Same as feedRaw() but return the frames as list of 37 values."""
+        return [list(FRAME_STRUCT.unpack(item)) for item in self.feedRaw(data)]
+
+#--XAKAframeDecoder------------------------------------------------------------
+    def flush(self):
+        """ Return the payload of the last complete frame in the buffer which is
+            still waiting for the next header to confirm it (end of stream).
+        """
+        frmLen = len(FRAME_HEADER) + FRAME_SIZE
+        if len(self.buffer) == frmLen and self.buffer.startswith(FRAME_HEADER):
+            payload = bytes(self.buffer[len(FRAME_HEADER):])
+            self.buffer = bytearray()
+            self.streamPos += frmLen
+            self.frameCount += 1
+            return [payload]
+        return []
+
+#--XAKAframeDecoder------------------------------------------------------------
+    def reset(self):
+        """ Clear the buffered bytes (call after the port is re-opened)."""
+        self.streamPos += len(self.buffer)
+        self.buffer = bytearray()
+        self.synced = False
+
+#--XAKAframeDecoder------------------------------------------------------------
+    def _drop(self, num):
+        """ Count the discarded bytes and mark the stream out of sync."""
+        if num <= 0: return
+        if self.synced: self.resyncCount += 1
+        self.synced = False
+        self.dropBytes += num
+
+#-----------------------------------------------------------------------------
+def parseFrameBatch(data):
+    """ Decode a whole buffer of frames in one pass and return a numpy structured
+        array with the fields (senId, paramNum, params[35]). The result always
+        has the same dtype: a strided view on <RAW_FRAME_DTYPE> records (itemsize
+        152 with the 4 header bytes skipped, not <FRAME_DTYPE>), use packFrames()
+        to get the compact <FRAME_DTYPE> array before serialising it. If the
+        buffer is a clean sequence of <header + payload> frames the result is a 
+        zero-copy view on the input buffer, otherwise the frames are located by
+        the stream decoder and copied once.
+    """
+    view = memoryview(data).cast('B')
+    if view.nbytes and view.nbytes % RAW_FRAME_DTYPE.itemsize == 0:
+        rawArr = np.frombuffer(view, dtype=RAW_FRAME_DTYPE)
+        if np.all(rawArr['header'] == FRAME_HEADER):
+            return rawArr[list(FRAME_DTYPE.names)]
+    decoder = XAKAframeDecoder(maxBufSize=max(4096, view.nbytes))
+    payloads = decoder.feedRaw(view) + decoder.flush()
+    rawArr = np.frombuffer(b''.join(FRAME_HEADER + item for item in payloads),
+                           dtype=RAW_FRAME_DTYPE)
+    return rawArr[list(FRAME_DTYPE.names)]
+
+def packFrames(frames):
+    """ Return the parseFrameBatch() result as a compact <FRAME_DTYPE> array
+        (148 bytes per frame, no header padding).
+    """
+    from numpy.lib.recfunctions import repack_fields   # pulls numpy.ma, load when used.
+    return repack_fields(frames)
+
+#-----------------------------------------------------------------------------
+def listSerialPorts():
+    """ Return the candidate serial port names on the current platform."""
+    try:
+        from serial.tools import list_ports
+        ports = [item.device for item in list_ports.comports()]
+        if ports: return ports
+    except ImportError:
+        pass
+    # look for the port on different platform:
+    if sys.platform.startswith('win'):
+        return ['COM%s' % (i + 1) for i in range(256)]
+    elif sys.platform.startswith('linux') or sys.platform.startswith('cygwin'):
+        # this excludes your current terminal "/dev/tty"
+        return glob.glob('/dev/tty[A-Za-z]*')
+    elif sys.platform.startswith('darwin'):
+        return glob.glob('/dev/tty.*')
+    raise EnvironmentError('Serial Port comm connection error: Unsupported platform.')
+
+#-----------------------------------------------------------------------------
+def probePort(port, timeout=PROBE_TIMEOUT):
+    """ Open the port and wait at most <timeout> sec for a frame header. Return
+        PORT_SENSOR if the header is received, PORT_OPEN if the port can only be 
+        opened and PORT_NONE if the port can not be opened.
+    """
+    import serial   # loaded at the first port open, not at the startup.
+    try:
+        s = serial.Serial(port, 115200, 8, 'N', 1, timeout=timeout)
+    except (OSError, ValueError, serial.SerialException):
+        return PORT_NONE
+    try:
+        # read_until() returns as soon as the header arrives.
+        data = s.read_until(FRAME_HEADER, len(FRAME_HEADER) + 2*FRAME_SIZE)
+    except (OSError, serial.SerialException):
+        data = b''
+    finally:
+        s.close()
+    return PORT_SENSOR if data.endswith(FRAME_HEADER) else PORT_OPEN
+
+#-----------------------------------------------------------------------------
+def searchSensorPorts(ports=None, timeout=PROBE_TIMEOUT, workers=PROBE_WORKERS):
+    """ Probe all the candidate ports concurrently, return 2 lists: the ports 
+        sending the sensor frames and the ports which can be opened.
+    """
+    if ports is None: ports = listSerialPorts()
+    if not ports: return [], []
+    with ThreadPoolExecutor(max_workers=min(workers, len(ports))) as pool:
+        results = list(pool.map(partial(probePort, timeout=timeout), ports))
+    sensorPorts = [p for p, r in zip(ports, results) if r == PORT_SENSOR]
+    openPorts = [p for p, r in zip(ports, results) if r != PORT_NONE]
+    return sensorPorts, openPorts
+
+#-----------------------------------------------------------------------------
+def loadPortCache(filePath=PORT_CACHE_PATH):
+    """ Return the list of last-known-good sensor ports saved in the cache file."""
+    try:
+        with open(filePath, 'r') as fh:
+            return [line.strip() for line in fh if line.strip()]
+    except OSError:
+        return []
+
+def savePortCache(ports, filePath=PORT_CACHE_PATH):
+    """ Save the sensor ports list in the cache file."""
+    try:
+        with open(filePath, 'w') as fh:
+            fh.write('\n'.join(ports))
+    except OSError as err:
+        print("COM connection: port cache file save error: %s" % str(err))
 
-    def __init__(self, preSavedData=None) -> None:
+#-----------------------------------------------------------------------------
+#-----------------------------------------------------------------------------
+class XandarSimulator(object):
+    """ module used to simulate a Xandar COMM USB port interface. The frames are 
+        pre-generated in batches (vectorised by numpy) from a seedable random 
+        generator, or replayed from a captured raw bytes stream (<preSavedData>
+        can be the bytes or the capture file path). If <fps> is set the bytes
+        are emitted at <fps> frames per second and read() blocks at most 
+        <timeout> sec like a real serial port, otherwise every read() call is 
+        filled immediately.
+    """
+    def __init__(self, preSavedData=None, fps=None, seed=None, timeout=1, 
+                 senId=0, batchSize=64) -> None:
         self.dataHeader = b''
-        self.chunkSize = 100
+        self.chunkSize = FRAME_SIZE
         self.savedData = preSavedData
+        self.fps = fps              # frames per second emitted, None: no limit.
+        self.timeout = timeout      # max sec a read() call blocks.
+        self.senId = senId          # sensor ID filled in the frames.
+        self.batchSize = batchSize  # number of frames generated each time.
+        self.rng = np.random.default_rng(seed)
+        self.seqNum = 0             # sequence number of the next frame.
+        self.stream = bytearray()   # generated bytes not read yet.
+        self.replayFile = None      # captured bytes stream file handle.
+        self.startTime = None       # time when the first byte was read.
+        self.readBytes = 0          # total bytes returned by read().
+
+#--XandarSimulator-------------------------------------------------------------
+    def _genBatch(self, num):
+        """ Generate <num> frames' bytes in one vectorised pass."""
+        if self.dataHeader:
+            arr = np.empty(num, dtype=RAW_FRAME_DTYPE)
+            arr['header'] = self.dataHeader
+        else:
+            arr = np.empty(num, dtype=FRAME_DTYPE)
+        arr['senId'] = self.senId
+        arr['paramNum'] = self.rng.integers(0, 16, num)
+        arr['params'] = self.rng.uniform(1.5, 7.0, (num, 35))
+        # params[1] is the '00: Sequence' field (frame index 3).
+        arr['params'][:, 1] = np.arange(self.seqNum, self.seqNum + num) % (1 << 24)
+        self.seqNum += num
+        return arr.tobytes()
+
+#--XandarSimulator-------------------------------------------------------------
+    def _replayChunk(self, num):
+        """ Return <num> bytes of the captured stream, restart at the end."""
+        if isinstance(self.savedData, (bytes, bytearray, memoryview)):
+            if not self.replayFile: self.replayFile = io.BytesIO(self.savedData)
+        elif self.replayFile is None:
+            self.replayFile = open(self.savedData, 'rb')
+        data = self.replayFile.read(num)
+        if len(data) < num:
+            self.replayFile.seek(0)
+            data += self.replayFile.read(num - len(data))
+        return data
+
+#--XandarSimulator-------------------------------------------------------------
+    def _fill(self, num):
+        """ Make sure there is at least <num> bytes in the stream buffer."""
+        while len(self.stream) < num:
+            if self.savedData:
+                chunk = self._replayChunk(max(num, self.batchSize * (len(self.dataHeader)+FRAME_SIZE)))
+                if not chunk: break # empty capture.
+                self.stream += chunk
+            else:
+                self.stream += self._genBatch(self.batchSize)
+
+#--XandarSimulator-------------------------------------------------------------
+    @property
+    def in_waiting(self):
+        """ Number of bytes can be read now (same as serial.Serial.in_waiting)."""
+        if not self.fps: return len(self.stream)
+        if self.startTime is None: self.startTime = time.time()
+        frameLen = len(self.dataHeader) + FRAME_SIZE
+        emitted = int((time.time() - self.startTime) * self.fps) * frameLen
+        return max(0, emitted - self.readBytes)
 
+#--XandarSimulator-------------------------------------------------------------
     def read(self, byteNum):
         """ return number of bytes simulate the serial read() function."""
-        iterN = max(1, byteNum//self.chunkSize)
-        dataByte = b''
-        for _ in range(iterN):
-            data = self.dataHeader + pack('i', 0) + pack('i', random.randint(0, 15))
-            for _ in range(35):
-                data += pack('f', random.uniform(1.5, 7.0))
-                #data += pack('f', float("{:.2f}".format(random.randint(0, 15))))
-            dataByte += data
-        #print('read: %s' %str(dataByte))
+        if self.fps:
+            deadline = time.time() + (self.timeout or 0)
+            while True:
+                avail = self.in_waiting
+                waitTime = deadline - time.time()
+                if avail >= byteNum or waitTime <= 0: break
+                frameLen = len(self.dataHeader) + FRAME_SIZE
+                time.sleep(min(waitTime, max(0.001, (byteNum-avail)/(frameLen*self.fps))))
+            byteNum = min(byteNum, avail)
+        self._fill(byteNum)
+        dataByte = bytes(self.stream[:byteNum])
+        del self.stream[:byteNum]
+        self.readBytes += len(dataByte)
         return dataByte
 
     def setChunk(self, header, chunkSize):
@@ -53,88 +350,307 @@ class XandarSimulator(object):
         self.savedData = byteData
 
     def close(self):
+        if self.replayFile: self.replayFile.close()
+        self.replayFile = None
         self.savedData = None
+        self.stream = bytearray()
+
+#-----------------------------------------------------------------------------
+#-----------------------------------------------------------------------------
+class XandarFaultSimulator(XandarSimulator):
+    """ Xandar simulator injecting the serial link faults at the configured rates
+        (probability 0.0~1.0 in the <faultRates> dict, keys in <FAULT_TYPES>):
+            'truncate' : a frame is cut before its end.
+            'garbage'  : random noise bytes are inserted before a frame.
+            'spurious' : a b'XAKA' is written inside a frame's float payload.
+            'split'    : a read() returns fewer bytes (header split across reads).
+            'burst'    : a read() returns up to 4 times the bytes requested.
+            'stall'    : a read() returns nothing.
+        The injected faults are logged as (stream offset, fault type) and the 
+        sequence numbers of the intact frames are kept as the ground truth.
+    """
+    def __init__(self, faultRates=None, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self.faultRates = dict.fromkeys(FAULT_TYPES, 0.0)
+        self.faultRates.update(faultRates or {})
+        self.faultLog = []      # [(stream offset, fault type)]
+        self.intactSeqs = []    # sequence number of the frames emitted intact.
+        self.genBytes = 0       # total bytes generated in the stream.
+
+#--XandarFaultSimulator--------------------------------------------------------
+    def _genBatch(self, num):
+        """ Generate the frames then inject the frame level faults."""
+        firstSeq = self.seqNum
+        rawData = super()._genBatch(num)
+        frameLen = len(rawData) // num
+        rates = self.faultRates
+        dataByte = bytearray()
+        for i in range(num):
+            frame = bytearray(rawData[i*frameLen:(i+1)*frameLen])
+            if self.rng.random() < rates['garbage']:
+                self.faultLog.append((self.genBytes + len(dataByte), 'garbage'))
+                dataByte += self.rng.bytes(int(self.rng.integers(1, 64)))
+            if self.rng.random() < rates['spurious']:
+                # keep the ID, count, presence and sequence fields (16 bytes).
+                pos = frameLen - FRAME_SIZE + 16 + int(self.rng.integers(0, FRAME_SIZE-20))
+                frame[pos:pos+4] = FRAME_HEADER
+                self.faultLog.append((self.genBytes + len(dataByte) + pos, 'spurious'))
+            if self.rng.random() < rates['truncate']:
+                frame = frame[:int(self.rng.integers(1, frameLen))]
+                self.faultLog.append((self.genBytes + len(dataByte) + len(frame), 'truncate'))
+            else:
+                self.intactSeqs.append((firstSeq + i) % (1 << 24))
+            dataByte += frame
+        self.genBytes += len(dataByte)
+        return bytes(dataByte)
+
+#--XandarFaultSimulator--------------------------------------------------------
+    def read(self, byteNum):
+        """ Read the stream with the delivery level faults."""
+        rates = self.faultRates
+        if self.rng.random() < rates['stall']:
+            if self.fps and self.timeout: time.sleep(self.timeout)
+            return b''
+        if self.rng.random() < rates['burst']:
+            byteNum *= int(self.rng.integers(2, 5))
+        elif self.rng.random() < rates['split']:
+            byteNum = int(self.rng.integers(1, byteNum+1))
+        return super().read(byteNum)
 
 #-----------------------------------------------------------------------------
 #-----------------------------------------------------------------------------
 class XAKAsensorComm(object):
 
-    def __init__(self, commPort, simuMd=False) -> None:
+    def __init__(self, commPort, simuMd=False, portCache=PORT_CACHE_PATH) -> None:
         self.serComm = None
         self.serialPort = commPort  # the serial port name we are going to read.
         self.simuMd = simuMd        # simulation mode flag
         self.dataList = []          # current data.
+        self.decoder = XAKAframeDecoder()
+        self.portCache = portCache  # file to save the last-known-good port.
+        self.recorder = None        # XAKArecorder to save all the raw frames.
+        self.replaySrc = None       # replay source used instead of the port.
+        # Background acquisition mode parameters.
+        self.readThread = None      # reader thread filling the frame queue.
+        self.frameQueue = None      # bounded queue of (timestamp, frame).
+        self.dropPolicy = DROP_POLICIES[0]
+        self.dropCount = 0          # number of frames dropped by queue full.
+        self.terminate = False      # reader thread stop flag.
+        self.metrics = None         # hot path metrics of the connected port.
+        self.lastDropBytes = 0      # decoder dropped bytes already counted.
 
 #-----------------------------------------------------------------------------
     def setSerialComm(self, searchFlag=False):
         """ Automatically search for the sensor and do the connection."""
-        if not self.serComm is None:
+        if not (self.serComm is None or self.serComm is self.replaySrc):
             self.serComm.close()  # close the exists opened port.
-            self.serComm = None 
+        self.serComm = None 
+        self.decoder.reset()
+        self._initMetrics()
+        if self.replaySrc:
+            print("Load the replay source of sensor %s." % str(self.serialPort))
+            self.serComm = self.replaySrc
+            return True
         if self.simuMd:
             print("Load the simulation Xandar sensor comm port.")
-            self.serComm = XandarSimulator()
-            self.serComm.setChunk(b'XAKA', 148)
+            self.serComm = XandarSimulator(fps=SIMU_FPS)
+            self.serComm.setChunk(FRAME_HEADER, FRAME_SIZE)
             return True
-        portList = []
-        if searchFlag and not self.simuMd:
-            # look for the port on different platform:
-            if sys.platform.startswith('win'):
-                ports = ['COM%s' % (i + 1) for i in range(256)]
-            elif sys.platform.startswith('linux') or sys.platform.startswith('cygwin'):
-                # this excludes your current terminal "/dev/tty"
-                ports = glob.glob('/dev/tty[A-Za-z]*')
-            elif sys.platform.startswith('darwin'):
-                ports = glob.glob('/dev/tty.*')
-            else:
-                raise EnvironmentError('Serial Port comm connection error: Unsupported platform.')
-            for port in ports:
-                # Check whether the port can be open.
-                try:
-                    s = serial.Serial(port)
-                    s.close()
-                    portList.append(port)
-                except (OSError, serial.SerialException):
-                    pass
-            print(('COM connection: the serial port can be used :%s' % str(portList)))
-        # normally the first comm prot is resoved by the system.
-        #if not self.serialPort in portList: self.serialPort = portList[-1]
+        if searchFlag:
+            port = self.searchSensorPort()
+            if port: 
+                self.serialPort = port
+                self._initMetrics()     # label the metrics by the port found.
+        import serial   # loaded at the first port open, not at the startup.
         try:
-            if not self.serialPort in portList: self.serialPort = portList[-1]
             self.serComm = serial.Serial(self.serialPort, 115200, 8, 'N', 1, timeout=1)
             return True
-        except:
+        except (OSError, ValueError, serial.SerialException):
             print("Serial connection: serial port open error.")
             return False
 
 #-----------------------------------------------------------------------------
-    def fetchSensorData(self):
-        """ Fetch data from the sensor and save the data."""
-        # load data from the sensor
+    def setReplaySource(self, replaySrc):
+        """ Read the sensor data from the replay source (XAKAsensorReplay) instead
+            of the serial port, the source is connected by setSerialComm().
+        """
+        self.replaySrc = replaySrc
+
+#-----------------------------------------------------------------------------
+    def searchSensorPort(self):
+        """ Find the port connected to the sensor: try the cached last-known-good
+            port first, then probe all the candidate ports concurrently.
+        """
+        cachedPorts, _ = searchSensorPorts(loadPortCache(self.portCache))
+        if cachedPorts:
+            port = self.serialPort if self.serialPort in cachedPorts else cachedPorts[0]
+            print("COM connection: use the cached sensor port %s" % port)
+            return port
+        sensorPorts, openPorts = searchSensorPorts()
+        print('COM connection: the serial port can be used :%s' % str(openPorts))
+        if sensorPorts:
+            port = self.serialPort if self.serialPort in sensorPorts else sensorPorts[0]
+            print("COM connection: sensor found on port %s" % port)
+            savePortCache([port], self.portCache)
+            return port
+        # No sensor data seen, fall back to the last port which can be opened.
+        return openPorts[-1] if openPorts and self.serialPort not in openPorts else None
+
+#-----------------------------------------------------------------------------
+    def fetchSensorFrames(self):
+        """ Read the bytes from the sensor and return the list of all the complete
+            frames decoded (each frame is a list of 37 values). 
+        """
         if self.serComm is None: 
             print ("Serial reading: The sensor is not connected.")
             return None
-        else:
-            output = self.serComm.read(500) # read 500 bytes and parse the data.
-            bset = output.split(b'XAKA')    # begine byte of the bytes set.
-            for item in bset:
-                # 4Bytes*37 = 148 paramters make sure the not data missing.
-                if len(item) == 148:
-                    self.dataList = []
-                    for idx, data in enumerate(iter(partial(io.BytesIO(item).read, 4), b'')):
-                        val = unpack('i', data) if idx == 0 or idx == 1 else unpack('<f', data)  # get the ID and parameter number
-                        self.dataList.append(val[0])
-                    break # only process the data once.
-            if len(self.dataList) == 0: 
-                print("Please check the sensor connection.")
-                return None
-            else:
-                return self.getData()
+        metrics = self.metrics or self._initMetrics()
+        startTime = time.perf_counter()
+        data = self.serComm.read(READ_SIZE)
+        readTime = time.perf_counter()
+        payloads = self.decoder.feedRaw(data)
+        recorder = self.recorder    # may be swapped by setRecording() in the UI thread.
+        if recorder and payloads: recorder.recordFrames(payloads)
+        frames = [list(FRAME_STRUCT.unpack(item)) for item in payloads]
+        if frames: self.dataList = frames[-1]
+        metrics['readTime'].observe(readTime - startTime)
+        metrics['readBytes'].inc(len(data))
+        if frames:
+            metrics['parseTime'].observe(time.perf_counter() - readTime)
+            metrics['frames'].inc(len(frames))
+        if self.decoder.dropBytes != self.lastDropBytes:
+            metrics['dropBytes'].inc(self.decoder.dropBytes - self.lastDropBytes)
+            self.lastDropBytes = self.decoder.dropBytes
+        return frames
+
+#-----------------------------------------------------------------------------
+    def fetchReplayFrames(self):
+        """ Read the due frames of the replay source and return the list of
+            (recorded time, frame), the replayed frames keep their record time.
+        """
+        metrics = self.metrics or self._initMetrics()
+        items = self.serComm.readFrames(READ_SIZE // (len(FRAME_HEADER) + FRAME_SIZE) + 1)
+        if items:
+            self.dataList = items[-1][1]
+            metrics['frames'].inc(len(items))
+        return items
+
+#-----------------------------------------------------------------------------
+    def _initMetrics(self):
+        """ Create the hot path metrics labeled by the sensor port."""
+        reg, port = xmetrics.REGISTRY, str(self.serialPort)
+        self.metrics = {
+            'readTime': reg.histogram('serial_read_seconds', 'Serial port read latency.', sensor=port),
+            'readBytes': reg.counter('serial_read_bytes_total', 'Bytes read from the serial port.', sensor=port),
+            'parseTime': reg.histogram('frame_parse_seconds', 'Frames decode and unpack time of a read.', sensor=port),
+            'frames': reg.counter('frames_decoded_total', 'Frames decoded.', sensor=port),
+            'dropBytes': reg.counter('decoder_dropped_bytes_total', 'Bytes discarded by the frame decoder.', sensor=port),
+            'dropFrames': reg.counter('frames_dropped_total', 'Frames dropped by the full reader queue.', sensor=port),
+            'queueDepth': reg.gauge('frame_queue_depth', 'Frames waiting in the reader queue.', sensor=port)}
+        return self.metrics
+
+#-----------------------------------------------------------------------------
+    def fetchSensorData(self):
+        """ Fetch data from the sensor and save the data."""
+        if self.fetchSensorFrames() is None: return None
+        if len(self.dataList) == 0: 
+            print("Please check the sensor connection.")
+            return None
+        return self.getData()
+
+#-----------------------------------------------------------------------------
+    def startReading(self, queueSize=QUEUE_SIZE, dropPolicy='oldest'):
+        """ Start the background acquisition mode: a reader thread keeps reading 
+            the port and puts the decoded frames in a bounded queue. When the 
+            queue is full the <dropPolicy> decides to drop the 'oldest' queued 
+            frame or the 'newest' incoming frame.
+        """
+        if dropPolicy not in DROP_POLICIES:
+            raise ValueError('Reader thread: unknown drop policy %s' % str(dropPolicy))
+        if self.isReading(): return
+        self.dropPolicy = dropPolicy
+        self.frameQueue = queue.Queue(maxsize=queueSize)
+        self.terminate = False
+        self.readThread = threading.Thread(target=self._readLoop, daemon=True,
+                                           name='XAKAreader-%s' % str(self.serialPort))
+        self.readThread.start()
+
+#-----------------------------------------------------------------------------
+    def stopReading(self, timeout=2):
+        """ Stop the background reader thread."""
+        self.terminate = True
+        if self.isReading() and self.readThread is not threading.current_thread():
+            self.readThread.join(timeout)
+        self.readThread = None
+
+#-----------------------------------------------------------------------------
+    def isReading(self):
+        return self.readThread is not None and self.readThread.is_alive()
+
+#-----------------------------------------------------------------------------
+    def _readLoop(self):
+        """ Reader thread main loop: read the port and queue all the frames."""
+        while not self.terminate:
+            if self.serComm is None:
+                time.sleep(1)   # wait the port be connected.
+                continue
+            try:
+                if self.serComm is self.replaySrc:
+                    items = self.fetchReplayFrames()
+                else:
+                    frames = self.fetchSensorFrames()
+                    crtTime = time.time()
+                    items = [(crtTime, frame) for frame in frames or []]
+            except OSError as err:  # serial.SerialException is an OSError.
+                print("Reader thread: serial read error: %s" % str(err))
+                time.sleep(1)
+                continue
+            for item in items:
+                self._putFrame(item)
+            if items: self.metrics['queueDepth'].set(self.frameQueue.qsize())
+
+#-----------------------------------------------------------------------------
+    def _putFrame(self, item):
+        """ Put the item in the frame queue follow the drop policy."""
+        try:
+            self.frameQueue.put_nowait(item)
+            return
+        except queue.Full:
+            self.dropCount += 1
+            self.metrics['dropFrames'].inc()
+            if self.dropPolicy == 'newest': return
+        try:
+            self.frameQueue.get_nowait()
+            self.frameQueue.put_nowait(item)
+        except (queue.Empty, queue.Full):
+            pass
+
+#-----------------------------------------------------------------------------
+    def getFrames(self, maxNum=None):
+        """ Drain the frame queue without blocking and return the list of 
+            (timestamp, frame) in arrival order, at most <maxNum> items.
+        """
+        frameList = []
+        if self.frameQueue is None: return frameList
+        while maxNum is None or len(frameList) < maxNum:
+            try:
+                frameList.append(self.frameQueue.get_nowait())
+            except queue.Empty:
+                break
+        return frameList
 
 #-----------------------------------------------------------------------------
     def getData(self):
         return self.dataList
 
+#-----------------------------------------------------------------------------
+    def close(self):
+        """ Stop the reader thread and close the port."""
+        self.stopReading()
+        if not self.serComm is None:
+            self.serComm.close()
+            self.serComm = None
+
 #-----------------------------------------------------------------------------
 #-----------------------------------------------------------------------------
 def testCase(mode=0):
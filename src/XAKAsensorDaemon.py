@@ -0,0 +1,203 @@
+#!/usr/bin/python
+#-----------------------------------------------------------------------------
+# Name:        XAKAsensorDaemon.py
+#
+# Purpose:     This module is the headless service entry point (no wxPython) of
+#              the XAKA people counting sensors reader for the gateways: it runs
+#              the multi-sensors acquisition, records all the frames and passes
+#              the new frames to the registered reporters (hub reporting hooks).
+#              The performance metrics can be dumped in the Prometheus text format.
+#                  python XAKAsensorDaemon.py --ports /dev/ttyUSB0 /dev/ttyUSB1
+#                  python XAKAsensorDaemon.py --simu --metrics /var/lib/node_exporter/xaka.prom
+#
+# Author:      Yuancheng Liu
+#
+# Created:     29/01/2022
+# version:     v_2.1
+# Copyright:   YC has not added.
+# License:     YC has not added.
+#-----------------------------------------------------------------------------
+
+import time
+import signal
+import argparse
+import XAKAsensorGlobal as gv
+import XAKAsensorMgr as xmgr
+import XAKAsensorUplink as xuplink
+import XAKAsensorHubClient as xclient
+import XAKAsensorStats as xstats
+import XAKAsensorMetrics as xmetrics
+
+PERIODIC = 0.5          # sec between 2 polls of the sensors' frame queues.
+STATUS_INTERVAL = 60    # sec between 2 status prints.
+METRICS_INTERVAL = 10   # sec between 2 metrics file dumps.
+
+#-----------------------------------------------------------------------------
+#-----------------------------------------------------------------------------
+class XAKAsensorDaemon(object):
+    """ Headless sensors reader service. A reporter is a callable which will be
+        called with (sensorIdx, sensorName, frameList) for every poll with new
+        frames, the frameList is the list of (timestamp, frame).
+    """
+    def __init__(self, commPorts, simuMd=False, recDir=None, replayPath=None,
+                 replaySpeed=1, interval=PERIODIC, metricsPath=None) -> None:
+        self.sensorMgr = xmgr.XAKAsensorMgr(commPorts, simuMd=simuMd, recDir=recDir,
+                                            replayPath=replayPath, replaySpeed=replaySpeed)
+        self.interval = interval
+        # rolling stats of the sensors' parameters, updated before the reporters.
+        self.statsEngine = xstats.XAKAstatsEngine(self.sensorMgr.getSensorNum())
+        self.reporters = [self.statsEngine.reportFrames]
+        self.frameCounts = [0] * self.sensorMgr.getSensorNum()
+        self.onlineStates = [False] * self.sensorMgr.getSensorNum()
+        self.terminate = False
+        self.lastStatus = 0
+        self.metricsPath = metricsPath  # Prometheus text file, None: no dump.
+        self.lastMetrics = 0
+        self.statsSources = {}  # name: getStats() of the components exported as gauges.
+        self.pollHist = xmetrics.REGISTRY.histogram(
+            'daemon_poll_seconds', 'Frames poll and reporters time of a daemon loop.')
+
+#--XAKAsensorDaemon------------------------------------------------------------
+    def addReporter(self, reporter):
+        self.reporters.append(reporter)
+
+    def removeReporter(self, reporter):
+        if reporter in self.reporters: self.reporters.remove(reporter)
+
+    def addStatsSource(self, name, getStats):
+        """ Export the numeric values of the component's getStats() dict as the
+            '<name>_<key>' gauges (such as the uplink's batches/spilled counts).
+        """
+        self.statsSources[name] = getStats
+
+#--XAKAsensorDaemon------------------------------------------------------------
+    def start(self, searchFlag=True):
+        self.sensorMgr.start(searchFlag=searchFlag)
+        self.lastStatus = time.time()
+
+#--XAKAsensorDaemon------------------------------------------------------------
+    def runOnce(self):
+        """ Drain the sensors' new frames and pass them to the reporters."""
+        startTime = time.perf_counter()
+        frameLists = self.sensorMgr.poll()
+        for idx in self.sensorMgr.popRewound(): self.statsEngine.resetSensor(idx)
+        for idx, frameList in enumerate(frameLists):
+            state = self.sensorMgr.isOnline(idx)
+            if state != self.onlineStates[idx]:
+                self.onlineStates[idx] = state
+                print("Daemon: sensor %s is %s." %(self.sensorMgr.getPort(idx),
+                                                   'online' if state else 'offline'))
+                if not state: self.statsEngine.removeSensor(idx)
+            if not frameList: continue
+            self.frameCounts[idx] += len(frameList)
+            for reporter in self.reporters:
+                try:
+                    reporter(idx, self.sensorMgr.getPort(idx), frameList)
+                except Exception as err:
+                    print("Daemon: reporter %s error: %s" %(str(reporter), str(err)))
+        self.pollHist.observe(time.perf_counter() - startTime)
+
+#--XAKAsensorDaemon------------------------------------------------------------
+    def run(self, duration=None):
+        """ Run the service until stop() is called (or for <duration> sec)."""
+        self.terminate = False
+        endTime = time.time() + duration if duration else None
+        while not self.terminate:
+            startT = time.time()
+            self.runOnce()
+            if startT - self.lastStatus > STATUS_INTERVAL:
+                self.printStatus()
+                self.lastStatus = startT
+            if self.metricsPath and startT - self.lastMetrics > METRICS_INTERVAL:
+                self.dumpMetrics()
+                self.lastMetrics = startT
+            if endTime and startT > endTime: break
+            time.sleep(max(0, self.interval - (time.time() - startT)))
+        self.close()
+
+#--XAKAsensorDaemon------------------------------------------------------------
+    def printStatus(self):
+        for idx, frameNum in enumerate(self.frameCounts):
+            print("Daemon: sensor %s online=%s frames=%d latest=%s" %(
+                self.sensorMgr.getPort(idx), self.onlineStates[idx], frameNum,
+                str(self.sensorMgr.getLatest(idx)[:5])))
+            print(" - final people num stats: %s" % str(self.statsEngine.summary(idx)[27]))
+
+#--XAKAsensorDaemon------------------------------------------------------------
+    def dumpMetrics(self, filePath=None):
+        """ Update the components' gauges and write the Prometheus text dump to
+            the file (default: <metricsPath>), return the dump text.
+        """
+        for name, getStats in self.statsSources.items():
+            for key, value in getStats().items():
+                if isinstance(value, (bool, int, float)):
+                    xmetrics.REGISTRY.gauge('%s_%s' %(name, key)).set(
+                        int(value) if isinstance(value, bool) else value)
+        filePath = filePath or self.metricsPath
+        if filePath: xmetrics.REGISTRY.writeText(filePath)
+        return xmetrics.REGISTRY.dumpText()
+
+#--XAKAsensorDaemon------------------------------------------------------------
+    def stop(self, *args):
+        """ Stop the run() loop (can be used as the signal handler)."""
+        self.terminate = True
+
+    def close(self):
+        self.sensorMgr.stop()
+
+#-----------------------------------------------------------------------------
+def parseServerAddr(server):
+    """ Return the (ip, port) of a <RG_SERVER_CHOICE> name or 'ip[:port]' str."""
+    if server in gv.RG_SERVER_CHOICE: return gv.RG_SERVER_CHOICE[server]
+    host, _, port = server.partition(':')
+    return (host, int(port) if port else gv.RGTCP_PORT)
+
+#-----------------------------------------------------------------------------
+#-----------------------------------------------------------------------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='XAKA sensor headless reader service.')
+    parser.add_argument('--ports', nargs='+', default=gv.SENSOR_COMMS,
+                        help='serial ports of the sensors.')
+    parser.add_argument('--simu', action='store_true', help='use the simulated sensors.')
+    parser.add_argument('--rec-dir', default=gv.REC_DIR, help='frames record folder.')
+    parser.add_argument('--no-record', action='store_true', help='do not record the frames.')
+    parser.add_argument('--replay', default=gv.gReplayPath, help='record path to replay.')
+    parser.add_argument('--speed', type=float, default=gv.gReplaySpeed, help='replay speed.')
+    parser.add_argument('--duration', type=float, help='sec to run, default: forever.')
+    parser.add_argument('--hub', help='hub server (ip[:port]) to report the data.')
+    parser.add_argument('--app-id', help='app ID reported to the hub, default: host name.')
+    parser.add_argument('--room', default=gv.HUB_ROOM, help='room of the sensors reported to the hub.')
+    parser.add_argument('--metrics', help='file to dump the Prometheus text metrics to.')
+    args = parser.parse_args(argv)
+    daemon = XAKAsensorDaemon(args.ports, simuMd=args.simu,
+                              recDir=None if args.no_record else args.rec_dir,
+                              replayPath=args.replay, replaySpeed=args.speed,
+                              metricsPath=args.metrics)
+    session = uplink = None
+    if args.hub:
+        session = xclient.XAKAhubSession(parseServerAddr(args.hub), args.app_id,
+                                         room=args.room)
+        session.start()
+        uplink = xuplink.XAKAuplink(session, batchSize=gv.UPLINK_BATCH_SIZE,
+                                    flushInterval=gv.UPLINK_FLUSH_INTERVAL,
+                                    spillDir=gv.UPLINK_SPILL_DIR,
+                                    statsEngine=daemon.statsEngine)
+        uplink.start()
+        daemon.addReporter(uplink.reportFrames)
+        daemon.addStatsSource('uplink', uplink.getStats)
+        daemon.addStatsSource('hub_session', session.getStats)
+    signal.signal(signal.SIGINT, daemon.stop)
+    signal.signal(signal.SIGTERM, daemon.stop)
+    daemon.start()
+    daemon.run(duration=args.duration)
+    daemon.printStatus()
+    if args.metrics: daemon.dumpMetrics()
+    if uplink:
+        uplink.close()
+        session.close()
+        print("Daemon: uplink %s" % str(uplink.getStats()))
+        print("Daemon: hub session %s" % str(session.getStats()))
+
+#-----------------------------------------------------------------------------
+if __name__ == '__main__':
+    main()
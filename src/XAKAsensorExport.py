@@ -0,0 +1,333 @@
+#!/usr/bin/python
+#-----------------------------------------------------------------------------
+# Name:        XAKAsensorExport.py
+#
+# Purpose:     This module exports the recorded sensor frames (XAKAsensorRecorder
+#              .xrec files) to column oriented files for the data analysis: one
+#              column per frame value (<DETAIL_LABEL_LIST>) plus the timestamp
+#              and the sensor name, written chunk by chunk (bounded memory) in
+#              a compressed .npz (numpy only) or a Parquet file (if pyarrow is
+#              installed). The time range and the sensors filters are pushed
+#              down to the record files (day files skipped, binary search in the
+#              mmap'ed records) so only the selected records are read.
+#                  python XAKAsensorExport.py --out may.parquet --start 2022-05-01 --end 2022-06-01
+#
+# Author:      Yuancheng Liu
+#
+# Created:     29/01/2022
+# version:     v_2.1
+# Copyright:   YC has not added.
+# License:     YC has not added.
+#-----------------------------------------------------------------------------
+
+import os
+import re
+import json
+import time
+import zipfile
+import argparse
+import numpy as np
+import XAKAsensorGlobal as gv
+import XAKAsensorRecorder as xrec
+
+EXPORT_FORMATS = ('auto', 'npz', 'parquet') # auto: parquet if pyarrow is installed.
+CHUNK_ROWS = 65536          # max records in one exported chunk (parquet row group).
+PARQUET_COMPRESSION = 'zstd'
+META_KEY = '__meta__'       # npz member of the export information (json).
+TIME_FORMATS = ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%d')
+
+#-----------------------------------------------------------------------------
+def fieldColumnName(idx, label):
+    """ Return the column name of the frame value <idx> from its label, such as
+        (27, '24: Final ppl num') => 'f27_final_ppl_num'.
+    """
+    name = re.sub(r'^\d+:\s*', '', label.strip())
+    return 'f%02d_%s' %(idx, re.sub(r'[^a-z0-9]+', '_', name.lower()).strip('_'))
+
+# frame values' columns (frame[i] is the column FIELD_COLUMNS[i]).
+FIELD_COLUMNS = [fieldColumnName(i, label) for i, label in enumerate(gv.DETAIL_LABEL_LIST)]
+COLUMNS = ['ts', 'sensor'] + FIELD_COLUMNS
+
+def columnDtype(column):
+    """ Return the numpy dtype of the exported column."""
+    if column == 'ts': return np.dtype('<f8')
+    if column == 'sensor': return np.dtype(np.uint8)
+    return np.dtype('<i4') if FIELD_COLUMNS.index(column) < 2 else np.dtype('<f4')
+
+#-----------------------------------------------------------------------------
+def hasParquet():
+    try:
+        import pyarrow.parquet
+        return True
+    except ImportError:
+        return False
+
+#-----------------------------------------------------------------------------
+def parseTime(timeStr):
+    """ Return the epoch sec of a 'YYYY-mm-dd[ HH:MM[:SS]]' local time or a
+        number str, None if <timeStr> is empty.
+    """
+    if not timeStr: return None
+    try:
+        return float(timeStr)
+    except ValueError:
+        pass
+    for timeFmt in TIME_FORMATS:
+        try:
+            return time.mktime(time.strptime(timeStr, timeFmt))
+        except ValueError:
+            continue
+    raise ValueError('Export: unknown time format %s' % timeStr)
+
+#-----------------------------------------------------------------------------
+def listSensorNames(recDir, sensors=None):
+    """ Return the names of the recorded sensors (only the <sensors> ports or
+        names if given).
+    """
+    names = sorted({xrec.parseRecFileName(f)[0] for f in xrec.listRecFiles(recDir)})
+    if sensors is None: return names
+    selected = {xrec.getSensorName(sensor) for sensor in sensors}
+    return [name for name in names if name in selected]
+
+#-----------------------------------------------------------------------------
+def iterRecordChunks(recDir, sensorNames, senIds=None, startTime=None, endTime=None,
+                     chunkRows=CHUNK_ROWS):
+    """ Yield the (sensor name, records) chunks (at most <chunkRows> REC_DTYPE
+        records) of the sensors in the time range, sensor by sensor in time
+        order. The chunks are views of the mmap'ed files except if filtered by
+        the sensor IDs <senIds> (frame[0]), so only one chunk is in memory.
+    """
+    for sensorName in sensorNames:
+        for filePath in xrec.listRecFilesInRange(recDir, sensorName, startTime, endTime):
+            reader = xrec.XAKArecReader(filePath)
+            records, chunk = reader.query(startTime, endTime), None
+            for idx in range(0, len(records), chunkRows):
+                chunk = records[idx:idx+chunkRows]
+                if senIds is not None: chunk = chunk[np.isin(chunk['senId'], senIds)]
+                if len(chunk): yield sensorName, chunk
+            del records, chunk   # release the views before unmapping the file.
+            reader.close()
+
+#-----------------------------------------------------------------------------
+def toColumns(sensorIdx, chunk, columns):
+    """ Return the {column name: array} of the selected columns of the records,
+        the 'sensor' column is the sensor name index (uint8).
+    """
+    result = {}
+    for column in columns:
+        if column == 'ts':
+            result[column] = np.ascontiguousarray(chunk['ts'])
+        elif column == 'sensor':
+            result[column] = np.full(len(chunk), sensorIdx, dtype=np.uint8)
+        else:
+            idx = FIELD_COLUMNS.index(column)
+            values = chunk['senId'] if idx == 0 else chunk['paramNum'] if idx == 1 \
+                else chunk['params'][:, idx-2]
+            result[column] = np.ascontiguousarray(values)
+    return result
+
+#-----------------------------------------------------------------------------
+#-----------------------------------------------------------------------------
+class XAKAnpzWriter(object):
+    """ Write the column chunks in a compressed .npz file: the chunk <n> of a
+        column is the member '<column>/<n:05d>', use loadExport() to read the
+        whole columns back.
+    """
+    def __init__(self, filePath, columns, meta) -> None:
+        self.zipFile = zipfile.ZipFile(filePath, 'w', compression=zipfile.ZIP_DEFLATED)
+        self.columns = columns
+        self.meta = meta
+        self.chunkCount = 0
+
+    def writeChunk(self, colDict):
+        for column in self.columns:
+            self._writeArray('%s/%05d' %(column, self.chunkCount), colDict[column])
+        self.chunkCount += 1
+
+    def _writeArray(self, name, array):
+        with self.zipFile.open(name + '.npy', 'w', force_zip64=True) as fh:
+            np.lib.format.write_array(fh, array, allow_pickle=False)
+
+    def close(self):
+        self.meta['chunks'] = self.chunkCount
+        self._writeArray(META_KEY, np.array(json.dumps(self.meta)))
+        self.zipFile.close()
+
+#-----------------------------------------------------------------------------
+#-----------------------------------------------------------------------------
+class XAKAparquetWriter(object):
+    """ Write the column chunks as the row groups of a Parquet file, the sensor
+        column is dictionary encoded with the sensor names.
+    """
+    def __init__(self, filePath, columns, meta) -> None:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        self.pa, self.pq = pa, pq
+        self.filePath = filePath
+        self.columns = columns
+        self.sensorNames = pa.array(meta['sensors'], type=pa.string())
+        self.meta = {b'xaka': json.dumps(meta).encode()}
+        self.writer = None  # created with the schema of the first chunk.
+
+    def writeChunk(self, colDict):
+        pa = self.pa
+        arrays = [pa.DictionaryArray.from_arrays(pa.array(colDict[c]), self.sensorNames)
+                  if c == 'sensor' else pa.array(colDict[c]) for c in self.columns]
+        table = pa.Table.from_arrays(arrays, names=self.columns)
+        if self.writer is None:
+            schema = table.schema.with_metadata(self.meta)
+            self.writer = self.pq.ParquetWriter(self.filePath, schema,
+                                                compression=PARQUET_COMPRESSION)
+        self.writer.write_table(table)
+
+    def close(self):
+        if self.writer is None:
+            # no record selected: write an empty file with the columns.
+            self.writeChunk({c: np.empty(0, dtype=columnDtype(c)) for c in self.columns})
+        self.writer.close()
+
+#-----------------------------------------------------------------------------
+def exportRecords(recDir, outPath, fmt='auto', sensors=None, senIds=None, startTime=None,
+                  endTime=None, columns=None, chunkRows=CHUNK_ROWS):
+    """ Export the records of the <sensors> (ports/names, default: all) in the
+        time range [startTime, endTime] (epoch sec) to the <outPath> file with
+        the selected <columns> (default: all <COLUMNS>), the sensor ID filter
+        <senIds> is applied on the frames' ID. Return the export stats dict.
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError('Export: unknown format %s' % str(fmt))
+    if fmt == 'auto': fmt = 'parquet' if hasParquet() else 'npz'
+    if fmt == 'parquet' and not hasParquet():
+        raise ImportError('Export: the Parquet format needs the pyarrow package.')
+    columns = list(columns or COLUMNS)
+    unknown = [c for c in columns if c not in COLUMNS]
+    if unknown: raise ValueError('Export: unknown columns %s' % str(unknown))
+    startT = time.time()
+    sensorNames = listSensorNames(recDir, sensors)
+    meta = {'sensors': sensorNames, 'columns': columns, 'startTime': startTime,
+            'endTime': endTime, 'senIds': list(senIds) if senIds is not None else None,
+            'labels': {c: gv.DETAIL_LABEL_LIST[FIELD_COLUMNS.index(c)] for c in columns
+                       if c in FIELD_COLUMNS}, 'created': startT}
+    # write a temporary file so a failed export never leaves a partial file.
+    tmpPath = outPath + '.tmp'
+    writerCls = XAKAparquetWriter if fmt == 'parquet' else XAKAnpzWriter
+    writer = writerCls(tmpPath, columns, meta)
+    rows = chunks = 0
+    try:
+        for sensorName, chunk in iterRecordChunks(recDir, sensorNames, senIds=senIds,
+                                                  startTime=startTime, endTime=endTime,
+                                                  chunkRows=chunkRows):
+            writer.writeChunk(toColumns(sensorNames.index(sensorName), chunk, columns))
+            rows += len(chunk)
+            chunks += 1
+        writer.close()
+        os.replace(tmpPath, outPath)
+    except BaseException:
+        if os.path.exists(tmpPath): os.remove(tmpPath)
+        raise
+    return {'format': fmt, 'rows': rows, 'chunks': chunks, 'sensors': len(sensorNames),
+            'bytes': os.path.getsize(outPath), 'sec': round(time.time() - startT, 2)}
+
+#-----------------------------------------------------------------------------
+def loadExport(filePath, columns=None):
+    """ Load the columns of an exported .npz file as {column: array} (the
+        'sensor' column as the sensor names), the information in '__meta__'.
+    """
+    with np.load(filePath, allow_pickle=False) as npz:
+        meta = json.loads(str(npz[META_KEY]))
+        result = {'__meta__': meta}
+        for column in columns or meta['columns']:
+            parts = [npz['%s/%05d' %(column, i)] for i in range(meta['chunks'])]
+            result[column] = np.concatenate(parts) if parts else np.empty(0, dtype=columnDtype(column))
+        if 'sensor' in result and meta['sensors']:
+            result['sensor'] = np.array(meta['sensors'])[result['sensor']]
+    return result
+
+#-----------------------------------------------------------------------------
+#-----------------------------------------------------------------------------
+def testCase(mode=0):
+    if mode == 0:
+        import tempfile
+        import tracemalloc
+        import XAKAsensorComm as xcomm
+        recDir = tempfile.mkdtemp()
+        startT = time.time() - 3*86400
+        # 4 sensors, 3 days of 1 frame per 2 sec.
+        for senIdx in range(4):
+            sim = xcomm.XandarSimulator(seed=senIdx, senId=senIdx)
+            sim.setChunk(xcomm.FRAME_HEADER, xcomm.FRAME_SIZE)
+            decoder = xcomm.XAKAframeDecoder()
+            recorder = xrec.XAKArecorder(recDir, 'COM%d' % senIdx)
+            payloads = decoder.feedRaw(sim.read(3*43200*(len(xcomm.FRAME_HEADER)+xcomm.FRAME_SIZE)))
+            for i, payload in enumerate(payloads): recorder.recordFrames([payload], startT + i*2)
+            recorder.close()
+        outPath = os.path.join(recDir, 'export.npz')
+        tracemalloc.start()
+        stats = exportRecords(recDir, outPath, fmt='npz', sensors=['COM1', 'COM2'],
+                              startTime=startT + 86400, endTime=startT + 2*86400,
+                              chunkRows=8192)
+        print("Export: %s, peak memory %.1f MB" %(str(stats), tracemalloc.get_traced_memory()[1]/1e6))
+        tracemalloc.stop()
+        data = loadExport(outPath, columns=['ts', 'sensor', 'f27_final_ppl_num'])
+        expected = xrec.queryRecords(recDir, 'COM1', startT + 86400, startT + 2*86400)
+        print("COM1 rows %d == %d" %((data['sensor'] == 'COM1').sum(), sum(len(a) for a in expected)))
+        print(FIELD_COLUMNS[:6])
+        # round trip: the exported columns are the records of the range, in order.
+        assert len(FIELD_COLUMNS) == xcomm.FIELD_NUM and len(set(FIELD_COLUMNS)) == len(FIELD_COLUMNS)
+        assert sorted(data) == [META_KEY, 'f27_final_ppl_num', 'sensor', 'ts']
+        assert data[META_KEY]['sensors'] == ['COM1', 'COM2']
+        assert stats['rows'] == len(data['ts']) and stats['sensors'] == 2
+        assert set(data['sensor'].tolist()) == {'COM1', 'COM2'}
+        for sensorName in ('COM1', 'COM2'):
+            records = np.concatenate(xrec.queryRecords(recDir, sensorName, startT + 86400,
+                                                       startT + 2*86400))
+            rows = data['sensor'] == sensorName
+            assert rows.sum() == len(records) == 43201
+            assert np.array_equal(data['ts'][rows], records['ts'])
+            assert np.array_equal(data['f27_final_ppl_num'][rows], records['params'][:, 25])
+        # all the columns of a sensor ID filtered export.
+        stats = exportRecords(recDir, outPath, fmt='npz', senIds=[3], startTime=startT,
+                              endTime=startT + 600)
+        data = loadExport(outPath)
+        records = xrec.queryRecords(recDir, 'COM3', startT, startT + 600)[0]
+        assert sorted(data) == sorted(COLUMNS + [META_KEY]) and stats['rows'] == len(records) == 301
+        assert set(data['sensor'].tolist()) == {'COM3'}
+        for idx, column in enumerate(FIELD_COLUMNS):
+            values = records['senId'] if idx == 0 else records['paramNum'] if idx == 1 \
+                else records['params'][:, idx-2]
+            assert data[column].dtype == columnDtype(column)
+            assert np.array_equal(data[column], values), column
+        try:
+            exportRecords(recDir, outPath, columns=['ts', 'nope'])
+            assert False, 'unknown column accepted'
+        except ValueError:
+            pass
+    else:
+        print("Put your test code here:")
+
+#-----------------------------------------------------------------------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Export the recorded XAKA sensor frames.')
+    parser.add_argument('--rec-dir', default=gv.REC_DIR, help='frames record folder.')
+    parser.add_argument('--out', required=True, help='output .npz/.parquet file.')
+    parser.add_argument('--format', choices=EXPORT_FORMATS, default='auto',
+                        help='output format, auto: from the file extension.')
+    parser.add_argument('--sensors', nargs='+', help='sensor ports/names, default: all.')
+    parser.add_argument('--sen-ids', nargs='+', type=int, help='sensor IDs (frame ID filter).')
+    parser.add_argument('--start', help='start time (YYYY-mm-dd[ HH:MM:SS] or epoch sec).')
+    parser.add_argument('--end', help='end time (YYYY-mm-dd[ HH:MM:SS] or epoch sec).')
+    parser.add_argument('--columns', nargs='+', help='columns to export, default: all.')
+    parser.add_argument('--chunk-rows', type=int, default=CHUNK_ROWS, help='records per chunk.')
+    args = parser.parse_args(argv)
+    fmt = args.format
+    if fmt == 'auto' and args.out.endswith(('.npz', '.parquet')):
+        fmt = 'parquet' if args.out.endswith('.parquet') else 'npz'
+    stats = exportRecords(args.rec_dir, args.out, fmt=fmt, sensors=args.sensors,
+                          senIds=args.sen_ids, startTime=parseTime(args.start),
+                          endTime=parseTime(args.end), columns=args.columns,
+                          chunkRows=args.chunk_rows)
+    print("Export %s: %s" %(args.out, str(stats)))
+
+#-----------------------------------------------------------------------------
+if __name__ == '__main__':
+    main()
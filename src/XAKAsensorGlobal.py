@@ -14,14 +14,14 @@
 import os
 import platform
 
-print("Current working directory is : %s" % str(os.getcwd()))
-dirpath = os.path.dirname(__file__)
-print("Current source code location : %s" % dirpath)
+dirpath = os.path.dirname(os.path.abspath(__file__))
 
 # Application name and version. setting
 APP_NAME = 'XAKA People Counting Sensor_v2.1'
 # User need to change below part if the sensor is plugged in different USB port.
 DE_COMM = 'COM3' if platform.system() == 'Windows' else '/dev/ttyUSB0'
+# Serial ports of all the sensors controlled by the app (max 4 sensors).
+SENSOR_COMMS = [DE_COMM]
 
 #------<IMAGES PATH>-------------------------------------------------------------
 IMG_FD = 'img'
@@ -35,6 +35,56 @@ RG_SERVER_CHOICE = {
     "Server_1 [192.168.0.100]": ('192.168.0.100', RGTCP_PORT),
 }
 BUFFER_SIZE = 4096
+HUB_ROOM = 'default'        # room (monitored area) name of the sensors reported to the hub.
+HUB_REG_TIMEOUT = 10        # sec to wait the sensor registration reply of the hub.
+UPLINK_BATCH_SIZE = 256     # max frames in one data report message to the hub.
+UPLINK_FLUSH_INTERVAL = 2.0 # max sec a frame waits before reported to the hub.
+UPLINK_SPILL_DIR = os.path.join(dirpath, 'uplinkSpill') # reports queued on disk.
+
+CHART_HIST_SIZE = 200000    # number of samples kept in each sensor's history chart.
+REC_DIR = os.path.join(dirpath, 'records') # folder of the sensor frames record files.
+PROF_DIR = os.path.join(dirpath, 'profiles') # folder of the profiler collapsed stacks files.
+
+# People counting sensor message labels (one per frame value: frame[i]).
+DETAIL_LABEL_LIST = [
+    'Seonsor ID: ',
+    'Parameter Count:',
+    'Presence Info:',
+    '00: Sequence',
+    '01: Idx People count',
+    '02: Reserved',
+    '03: Reserved',
+    '04: Human Presence',
+    '05: Program Version',
+    '06: ShortTerm avg',
+    '07: LongTerm avg',
+    '08: EnvMapping rm T',
+    '09: Radar Map rm T',
+    '10: Idx for radar mapping',
+    '11: Num of ppl for radar map',
+    '12: Device ID',
+    '13: Start Rng',
+    '14: End Rng',
+    '15: Reserved',
+    '16: LED on/off',
+    '17: Trans period',
+    '18: Calib factor',
+    '19: Tiled Angle',
+    '20: Radar Height',
+    '21: Avg size',
+    '22: Presence on/off',
+    '23: Reserved',
+    '24: Final ppl num',
+    '25: Radar MP val',
+    '26: Env MP val',
+    '27: serial num_1',
+    '28: serial num_2',
+    '29: serial dist1',
+    '30: serial dist2',
+    '31: Reserved',
+    '32: Reserved',
+    '33: Reserved'
+]
 
 #-----------------------------------------------------------------------------
 # Set the global reference here.
@@ -46,3 +96,8 @@ iMainFrame = None       # Program main frame
 #-----------------------------------------------------------------------------
 # Set the global paramter/flag here.
 gSimulationMode = True
+gRecordFlag = False     # record every sensor frame in <REC_DIR> (Setting page toggle).
+# Replay the record folder/.xrec file/raw capture file instead of the sensors:
+gReplayPath = None
+gReplaySpeed = 1        # replay speed 1x~100x.
+gUplinkFlag = False     # report the sensor data to the hub at start.
@@ -0,0 +1,228 @@
+#!/usr/bin/python
+#-----------------------------------------------------------------------------
+# Name:        XAKAsensorHist.py
+#
+# Purpose:     This module is used to store the sensor data history for the UI
+#              (such as the history line chart) in preallocated numpy arrays.
+#
+# Author:      Yuancheng Liu
+#
+# Created:     29/01/2022
+# version:     v_2.1
+# Copyright:   YC has not added.
+# License:     YC has not added.
+#-----------------------------------------------------------------------------
+
+import time
+import numpy as np
+
+HIST_SIZE = 200000  # default number of samples kept in the history.
+LOD_FACTOR = 8      # samples number ratio between 2 summary levels' buckets.
+
+#-----------------------------------------------------------------------------
+#-----------------------------------------------------------------------------
+class XAKAringBuffer(object):
+    """ Preallocated array-backed ring buffer with O(1) append. Every sample is
+        written twice (at slot i and i+capacity), so the latest N samples are
+        always one contiguous block and latest() returns a zero-copy view.
+    """
+    def __init__(self, capacity=HIST_SIZE, width=1, dtype=np.float32, fill=0) -> None:
+        self.capacity = capacity
+        self.width = width      # number of values of each sample.
+        self.data = np.full((2*capacity, width), fill, dtype=dtype)
+        self.times = np.zeros(2*capacity, dtype=np.float64) # sample timestamps.
+        self.head = 0           # next slot to write.
+        self.count = 0          # number of samples appended (max capacity).
+
+#--XAKAringBuffer--------------------------------------------------------------
+    def append(self, values, timestamp=None):
+        """ Append one sample (<width> values) with its timestamp."""
+        if timestamp is None: timestamp = time.time()
+        idx = self.head
+        self.data[idx] = self.data[idx+self.capacity] = values
+        self.times[idx] = self.times[idx+self.capacity] = timestamp
+        self.head = (idx + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+
+    def reset(self):
+        """ Remove all the samples."""
+        self.head = self.count = 0
+
+#--XAKAringBuffer--------------------------------------------------------------
+    def latest(self, num=None):
+        """ Return the view (oldest first) of the latest <num> samples. The view
+            is only valid until the next <capacity> appends.
+        """
+        end = self.head + self.capacity
+        return self.data[end - self._clip(num):end]
+
+    def latestTimes(self, num=None):
+        """ Return the view of the latest <num> samples' timestamps."""
+        end = self.head + self.capacity
+        return self.times[end - self._clip(num):end]
+
+#--XAKAringBuffer--------------------------------------------------------------
+    def _clip(self, num):
+        return self.capacity if num is None else max(0, min(num, self.capacity))
+
+    def __len__(self):
+        return self.count
+
+#-----------------------------------------------------------------------------
+#-----------------------------------------------------------------------------
+class XAKAsummaryLevel(object):
+    """ One resolution level of the min/max summary: every bucket keeps the min
+        and max values (and the start time) of <bucketSize> raw samples.
+    """
+    def __init__(self, bucketSize, capacity, width) -> None:
+        self.bucketSize = bucketSize
+        self.mins = XAKAringBuffer(capacity, width)
+        self.maxs = XAKAringBuffer(capacity, width)
+        self.crtMin = np.full(width, np.inf, dtype=np.float32) # current bucket.
+        self.crtMax = np.full(width, -np.inf, dtype=np.float32)
+        self.crtNum = 0         # raw samples number in the current bucket.
+        self.crtTime = None     # start time of the current bucket.
+
+#--XAKAsummaryLevel------------------------------------------------------------
+    def add(self, vMin, vMax, timestamp, num):
+        """ Add the summary of <num> raw samples starting at <timestamp> to the
+            current bucket. Return True if the bucket is full and closed.
+        """
+        if self.crtNum == 0: self.crtTime = timestamp
+        np.minimum(self.crtMin, vMin, out=self.crtMin)
+        np.maximum(self.crtMax, vMax, out=self.crtMax)
+        self.crtNum += num
+        if self.crtNum < self.bucketSize: return False
+        self.mins.append(self.crtMin, self.crtTime)
+        self.maxs.append(self.crtMax, self.crtTime)
+        return True
+
+    def resetBucket(self):
+        self.crtMin.fill(np.inf)
+        self.crtMax.fill(-np.inf)
+        self.crtNum = 0
+        self.crtTime = None
+
+#-----------------------------------------------------------------------------
+#-----------------------------------------------------------------------------
+class XAKAlodHistory(object):
+    """ Sensor data history with the multi-resolution min/max summaries. Level
+        k buckets summarise LOD_FACTOR^(k+1) samples and are updated incrementally
+        (a level is only touched when the level below closes a bucket), so the 
+        append is amortized O(1). getWindow() decimates any time range to a
+        fixed number of columns from the coarsest fitting level, the cost of
+        each repaint does not depend on the history length.
+    """
+    def __init__(self, capacity=HIST_SIZE, width=1, factor=LOD_FACTOR) -> None:
+        self.raw = XAKAringBuffer(capacity, width)
+        self.levels = []
+        bucketSize = factor
+        while bucketSize <= capacity:
+            self.levels.append(XAKAsummaryLevel(bucketSize, capacity//bucketSize + 1, width))
+            bucketSize *= factor
+
+#--XAKAlodHistory--------------------------------------------------------------
+    def append(self, values, timestamp=None):
+        """ Append one sample and update the summary levels."""
+        if timestamp is None: timestamp = time.time()
+        self.raw.append(values, timestamp)
+        vMin = vMax = np.asarray(values, dtype=np.float32)
+        num = 1
+        for level in self.levels:
+            if not level.add(vMin, vMax, timestamp, num): break
+            # cascade the closed bucket to the next level.
+            vMin, vMax = level.crtMin.copy(), level.crtMax.copy()
+            timestamp, num = level.crtTime, level.crtNum
+            level.resetBucket()
+
+    def reset(self):
+        """ Remove all the samples (such as the replay moved back in time, the
+            samples must be appended in time order).
+        """
+        self.raw.reset()
+        for level in self.levels:
+            level.mins.reset()
+            level.maxs.reset()
+            level.resetBucket()
+
+#--XAKAlodHistory--------------------------------------------------------------
+    def lastTime(self):
+        """ Return the timestamp of the latest sample (None if empty)."""
+        return float(self.raw.latestTimes(1)[0]) if len(self.raw) else None
+
+#--XAKAlodHistory--------------------------------------------------------------
+    def getWindow(self, startTime, endTime, columns):
+        """ Return (times, mins, maxs, decimated) of the samples in the time range.
+            If there are more samples than <columns>, they are min/max bucketed 
+            to at most <columns> columns (decimated=True), else the raw samples 
+            are returned (mins and maxs are the same view).
+        """
+        rawTimes = self.raw.latestTimes(len(self.raw))
+        startIdx = np.searchsorted(rawTimes, startTime)
+        endIdx = np.searchsorted(rawTimes, endTime, side='right')
+        sampleNum = endIdx - startIdx
+        if sampleNum <= columns:
+            values = self.raw.latest(len(self.raw))[startIdx:endIdx]
+            return rawTimes[startIdx:endIdx], values, values, False
+        # use the coarsest level which still gives enough columns.
+        levelIdx = -1
+        for idx, level in enumerate(self.levels):
+            if level.bucketSize * columns > sampleNum: break
+            levelIdx = idx
+        if levelIdx < 0:
+            times = rawTimes[startIdx:endIdx]
+            mins = maxs = self.raw.latest(len(self.raw))[startIdx:endIdx]
+        else:
+            times, mins, maxs = self._levelWindow(levelIdx, startTime, endTime)
+        # min/max bucket the selected samples/buckets to the columns.
+        groupSize = -(-len(times) // columns)
+        starts = np.arange(0, len(times), groupSize)
+        return (times[starts], np.minimum.reduceat(mins, starts),
+                np.maximum.reduceat(maxs, starts), True)
+
+#--XAKAlodHistory--------------------------------------------------------------
+    def _levelWindow(self, levelIdx, startTime, endTime):
+        """ Return the level's buckets in the time range plus the partial bucket
+            (samples not summarised in a closed bucket of the level yet).
+        """
+        level = self.levels[levelIdx]
+        bucketTimes = level.mins.latestTimes(len(level.mins))
+        startIdx = np.searchsorted(bucketTimes, startTime)
+        endIdx = np.searchsorted(bucketTimes, endTime, side='right')
+        times = bucketTimes[startIdx:endIdx]
+        mins = level.mins.latest(len(level.mins))[startIdx:endIdx]
+        maxs = level.maxs.latest(len(level.maxs))[startIdx:endIdx]
+        # the partial bucket is the union of the lower levels' current buckets.
+        partTimes = [lv.crtTime for lv in self.levels[:levelIdx+1] if lv.crtNum]
+        if partTimes and min(partTimes) <= endTime:
+            subLevels = self.levels[:levelIdx+1]
+            partMin = np.min([lv.crtMin for lv in subLevels], axis=0)
+            partMax = np.max([lv.crtMax for lv in subLevels], axis=0)
+            times = np.append(times, min(partTimes))
+            mins = np.vstack((mins, partMin))
+            maxs = np.vstack((maxs, partMax))
+        return times, mins, maxs
+
+#-----------------------------------------------------------------------------
+#-----------------------------------------------------------------------------
+def testCase(mode=0):
+    if mode == 0:
+        ringBuf = XAKAringBuffer(capacity=5, width=3)
+        for i in range(8):
+            ringBuf.append((i, i*2, i*3), timestamp=i)
+        print(ringBuf.latest(3))
+        print(ringBuf.latestTimes())
+        lodHist = XAKAlodHistory(capacity=100000, width=1)
+        for i in range(100000):
+            lodHist.append((i % 100,), timestamp=i)
+        times, mins, maxs, decimated = lodHist.getWindow(0, 100000, 300)
+        print(len(times), decimated, mins.min(), maxs.max(), times[-1])
+        lodHist.reset()
+        lodHist.append((5,), timestamp=10)
+        print(lodHist.getWindow(0, 100000, 300)[0], lodHist.lastTime())
+    else:
+        print("Put your test code here:")
+
+#-----------------------------------------------------------------------------
+if __name__ == '__main__':
+    testCase(mode=0)
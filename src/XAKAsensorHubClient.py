@@ -0,0 +1,298 @@
+#!/usr/bin/python
+#-----------------------------------------------------------------------------
+# Name:        XAKAsensorHubClient.py
+#
+# Purpose:     This module is the hub client of the sensor reader app: one long
+#              lived session per hub server handled by a worker thread (never
+#              the UI thread). The session does the connection request (CR) once,
+#              multiplexes the registration/data/logout messages on the same
+#              connection, sends the heart beats (HB) when idle and reconnects
+#              with an exponential backoff if the connection is lost.
+#
+# Author:      Yuancheng Liu
+#
+# Created:     29/01/2022
+# version:     v_2.1
+# Copyright:   YC has not added.
+# License:     YC has not added.
+#-----------------------------------------------------------------------------
+
+import time
+import random
+import socket
+import select
+import threading
+from collections import deque
+from concurrent.futures import Future, CancelledError
+import XAKAsensorHubMsg as xmsg
+
+HB_INTERVAL = 10        # sec between 2 heart beats of an idle session.
+HB_TIMEOUT = 30         # sec without any hub message to reset the connection.
+BACKOFF_BASE = 1        # sec of the first reconnection delay.
+BACKOFF_MAX = 60        # max sec of the reconnection delay.
+CONN_TIMEOUT = 5        # sec to connect the hub and get the CR reply.
+POLL_INTERVAL = 0.5     # max sec the worker waits for the hub messages each loop.
+RECV_SIZE = 4096
+
+#-----------------------------------------------------------------------------
+def backoffDelay(attempt, base=BACKOFF_BASE, maxDelay=BACKOFF_MAX):
+    """ Return the sec to wait before the <attempt>th reconnection (exponential
+        backoff with jitter so many apps do not reconnect at the same time).
+    """
+    delay = min(maxDelay, base * (2 ** min(attempt, 16)))
+    return delay * random.uniform(0.5, 1.0)
+
+#-----------------------------------------------------------------------------
+#-----------------------------------------------------------------------------
+class XAKAhubSession(object):
+    """ Persistent session to one hub server, usage example:
+            session = XAKAhubSession(('127.0.0.1', 5006), 'app0')
+            session.start()
+            future = session.request('RG', senId=1, callback=onReply)
+            reply = future.result(timeout=5)    # or wait the callback.
+            session.close()
+        A request returns a concurrent.futures.Future of the hub reply dict (the
+        HB message with the request's 'lAct'), the optional callback(reply, err)
+        is called in the worker thread (use wx.CallAfter to update the UI). The
+        requests sent but not answered when the connection is lost fail with a
+        ConnectionError, the ones not sent yet wait the reconnection.
+    """
+    def __init__(self, serverAddr, appId=None, room=None, sslContext=None,
+                 hbInterval=HB_INTERVAL, hbTimeout=HB_TIMEOUT) -> None:
+        self.serverAddr = serverAddr
+        self.appId = appId or socket.gethostname()
+        self.room = room    # room (monitored area) of the app's sensors, sent with the CR.
+        self.sslContext = sslContext    # TLS context, None: plain TCP.
+        self.hbInterval = hbInterval
+        self.hbTimeout = hbTimeout
+        self.sock = None
+        self.decoder = xmsg.XAKAmsgDecoder()
+        self.sendQueue = deque()    # (message bytes, action, future, sticky) to send.
+        self.pending = deque()      # (action, future) sent, waiting the reply.
+        self.stickyMsgs = {}        # sticky key: (message bytes, action) re-sent at reconnection.
+        self.lock = threading.Lock()
+        # wake up the worker waiting the hub messages when a message is queued.
+        self.wakeRecv, self.wakeSend = socket.socketpair()
+        self.wakeSend.setblocking(False)
+        self.connected = threading.Event()
+        self.terminate = threading.Event()
+        self.workThread = None
+        self.lastSend = self.lastRecv = 0
+        self.stats = dict.fromkeys(('connects', 'connectFails', 'msgsSent', 'replies',
+                                    'heartBeats', 'failedRequests'), 0)
+
+#--XAKAhubSession--------------------------------------------------------------
+    def start(self):
+        if self.workThread and self.workThread.is_alive(): return
+        self.terminate.clear()
+        self.workThread = threading.Thread(target=self._run, daemon=True,
+                                           name='XAKAhub-%s' % str(self.serverAddr))
+        self.workThread.start()
+
+    def isConnected(self):
+        return self.connected.is_set()
+
+#--XAKAhubSession--------------------------------------------------------------
+    def request(self, action, callback=None, sticky=False, binData=b'', **kwargs):
+        """ Queue the <action> message with the key-value arguments. If <sticky>
+            is set the message is re-sent after every reconnection (such as the
+            sensor registration), it replaces the sticky message of the same
+            action and senId.
+        """
+        msgByte = xmsg.dumpMsg(action, binData=binData, app=self.appId, **kwargs)
+        if sticky: sticky = (action, kwargs.get('senId'))
+        return self.sendMsg(msgByte, action, callback, sticky)
+
+    def sendMsg(self, msgByte, action, callback=None, sticky=False):
+        """ Queue the packed message, return the Future of the hub reply. The
+            <sticky> key (True: the action) identifies the sticky message.
+        """
+        future = Future()
+        if callback: future.add_done_callback(lambda f: callback(*futureResult(f)))
+        with self.lock:
+            self.sendQueue.append((msgByte, action, future, sticky))
+        self._wakeUp()
+        return future
+
+    def _wakeUp(self):
+        try:
+            self.wakeSend.send(b'\x00')
+        except OSError:
+            pass    # buffer full: the worker is already woken up.
+
+#--XAKAhubSession--------------------------------------------------------------
+    def _run(self):
+        """ Worker thread: keep the session connected and exchange the messages."""
+        attempt = 0
+        while not self.terminate.is_set():
+            if not self._connect():
+                self.stats['connectFails'] += 1
+                self.terminate.wait(backoffDelay(attempt))
+                attempt += 1
+                continue
+            attempt = 0
+            try:
+                self._serve()
+                error = ConnectionError('session closed')
+                self._sendNow(xmsg.dumpMsg('LO', app=self.appId))
+            except (OSError, ValueError) as err:
+                print("Hub session %s: connection lost: %s" %(str(self.serverAddr), str(err)))
+                error = ConnectionError(str(err))
+            self._disconnect(error)
+        # fail the requests never sent.
+        with self.lock:
+            while self.sendQueue:
+                self._failFuture(self.sendQueue.popleft()[2], ConnectionError('session closed'))
+
+#--XAKAhubSession--------------------------------------------------------------
+    def _connect(self):
+        """ Connect the hub, do the CR handshake and re-send the sticky messages."""
+        try:
+            sock = socket.create_connection(self.serverAddr, timeout=CONN_TIMEOUT)
+            if self.sslContext:
+                sock = self.sslContext.wrap_socket(sock, server_hostname=self.serverAddr[0])
+            self.sock = sock
+            self.decoder.reset()
+            self._sendNow(xmsg.dumpMsg('CR', app=self.appId, room=self.room))
+            reply = None
+            while reply is None:
+                data = self.sock.recv(RECV_SIZE)
+                if not data: raise ConnectionError('connection closed by the hub')
+                for msgDict, _ in self.decoder.feed(data):
+                    if msgDict.get('lAct') == 'CR': reply = msgDict
+            if not reply.get('state'): raise ValueError('connection request denied')
+        except (OSError, ValueError) as err:
+            print("Hub session %s: connect error: %s" %(str(self.serverAddr), str(err)))
+            self._disconnect(None)
+            return False
+        self.sock.settimeout(0)
+        self.lastRecv = time.time()
+        for msgByte, action in list(self.stickyMsgs.values()):
+            self._sendNow(msgByte)
+            self.pending.append((action, None))
+        self.stats['connects'] += 1
+        self.connected.set()
+        return True
+
+#--XAKAhubSession--------------------------------------------------------------
+    def _serve(self):
+        """ Send the queued messages/heart beats and handle the hub messages until
+            the session is closed, raise OSError/ValueError if connection lost.
+        """
+        while not self.terminate.is_set():
+            while True:
+                with self.lock:
+                    if not self.sendQueue: break
+                    msgByte, action, future, sticky = self.sendQueue.popleft()
+                if not future.set_running_or_notify_cancel(): continue
+                self.pending.append((action, future))
+                self._sendNow(msgByte)
+                if sticky: self.stickyMsgs[action if sticky is True else sticky] = (msgByte, action)
+                self.stats['msgsSent'] += 1
+            crtTime = time.time()
+            if crtTime - self.lastSend > self.hbInterval:
+                self._sendNow(xmsg.dumpMsg('HB', app=self.appId))
+                self.pending.append(('HB', None))
+                self.stats['heartBeats'] += 1
+            if crtTime - self.lastRecv > self.hbTimeout:
+                raise ValueError('no hub message in %s sec' % self.hbTimeout)
+            readList = [self.sock]
+            # (TLS socket may have buffered decrypted bytes select() cannot see)
+            if not (self.sslContext and self.sock.pending()):
+                readList, _, _ = select.select([self.sock, self.wakeRecv], [], [], POLL_INTERVAL)
+            if self.wakeRecv in readList: self.wakeRecv.recv(RECV_SIZE)
+            if self.sock not in readList: continue
+            try:
+                data = self.sock.recv(RECV_SIZE)
+            except (BlockingIOError, InterruptedError):
+                continue
+            if not data: raise ConnectionError('connection closed by the hub')
+            self.lastRecv = time.time()
+            for msgDict, _ in self.decoder.feed(data):
+                self._handleReply(msgDict)
+
+#--XAKAhubSession--------------------------------------------------------------
+    def _handleReply(self, msgDict):
+        """ Resolve the oldest pending request answered by the hub reply."""
+        lastAction = msgDict.get('lAct')
+        for idx, (action, future) in enumerate(self.pending):
+            if action != lastAction: continue
+            del self.pending[idx]
+            self.stats['replies'] += 1
+            if future: future.set_result(msgDict)
+            return
+
+#--XAKAhubSession--------------------------------------------------------------
+    def _sendNow(self, msgByte):
+        self.sock.sendall(msgByte)
+        self.lastSend = time.time()
+
+    def _disconnect(self, error):
+        """ Close the connection and fail the requests waiting the reply."""
+        self.connected.clear()
+        if self.sock:
+            try:
+                self.sock.close()
+            except OSError:
+                pass
+        self.sock = None
+        while self.pending:
+            _, future = self.pending.popleft()
+            if future: self._failFuture(future, error or ConnectionError('disconnected'))
+
+    def _failFuture(self, future, error):
+        if future.done(): return
+        if not (future.running() or future.set_running_or_notify_cancel()): return
+        self.stats['failedRequests'] += 1
+        future.set_exception(error)
+
+#--XAKAhubSession--------------------------------------------------------------
+    def getStats(self):
+        stats = dict(self.stats)
+        stats['connected'] = self.isConnected()
+        stats['queued'] = len(self.sendQueue)
+        return stats
+
+#--XAKAhubSession--------------------------------------------------------------
+    def close(self, timeout=2):
+        """ Logout (LO) and close the session."""
+        self.terminate.set()
+        self._wakeUp()
+        if self.workThread:
+            self.workThread.join(timeout)
+            self.workThread = None
+
+#-----------------------------------------------------------------------------
+def futureResult(future):
+    """ Return the (reply, error) of a done request Future."""
+    if future.cancelled(): return (None, CancelledError('request cancelled'))
+    error = future.exception()
+    return (None, error) if error else (future.result(), None)
+
+#-----------------------------------------------------------------------------
+#-----------------------------------------------------------------------------
+def testCase(mode=0):
+    if mode == 0:
+        import asyncio
+        import XAKAsensorHubServer as xhub
+        server = xhub.XAKAhubServer('127.0.0.1', 0)
+        loop = asyncio.new_event_loop()
+        port = loop.run_until_complete(server.start())
+        threading.Thread(target=loop.run_forever, daemon=True).start()
+        session = XAKAhubSession(('127.0.0.1', port), 'app0', hbInterval=0.2)
+        session.start()
+        future = session.request('RG', sticky=True, senId=1, senType='XKAK_PPL_COUNT',
+                                 callback=lambda reply, err: print("RG reply:", reply, err))
+        print(future.result(timeout=5))
+        session.request('RG', sticky=True, senId=1, senType='XKAK_PPL_COUNT').result(timeout=5)
+        print("sticky messages: %d" % len(session.stickyMsgs))
+        time.sleep(1)
+        print(session.getStats())
+        session.close()
+        asyncio.run_coroutine_threadsafe(server.stop(), loop).result()
+    else:
+        print("Put your test code here:")
+
+#-----------------------------------------------------------------------------
+if __name__ == '__main__':
+    testCase(mode=0)
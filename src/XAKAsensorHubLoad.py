@@ -0,0 +1,211 @@
+#!/usr/bin/python
+#-----------------------------------------------------------------------------
+# Name:        XAKAsensorHubLoad.py
+#
+# Purpose:     This module is the load generator to size the control hub: it
+#              spawns many simulated sensor reader apps (one coroutine each, all
+#              in one event loop) which connect the hub, register their sensors
+#              in a room and report the XandarSimulator frames in data messages
+#              like the telemetry uplink, then prints the acknowledgement latency.
+#                  python XAKAsensorHubLoad.py --hub 127.0.0.1:5006 --apps 2000
+#
+# Author:      Yuancheng Liu
+#
+# Created:     29/01/2022
+# version:     v_2.1
+# Copyright:   YC has not added.
+# License:     YC has not added.
+#-----------------------------------------------------------------------------
+
+import time
+import random
+import asyncio
+import argparse
+import numpy as np
+import XAKAsensorGlobal as gv
+import XAKAsensorComm as xcomm
+import XAKAsensorHubMsg as xmsg
+import XAKAsensorHubServer as xhub
+
+APP_NUM = 100           # number of simulated apps.
+ROOM_NUM = 10           # number of rooms the apps are spread in.
+SENSOR_NUM = 1          # sensors per app.
+SENSOR_FPS = 2          # frames per sec of every simulated sensor.
+REPORT_INTERVAL = 2.0   # sec between 2 data reports of an app.
+RAMP_TIME = 5           # sec to spread the apps' connections on.
+REPLY_TIMEOUT = 10      # sec to wait a hub reply.
+
+#-----------------------------------------------------------------------------
+#-----------------------------------------------------------------------------
+class XAKAsimuApp(object):
+    """ One simulated app: the connection/registration/data report messages are
+        the same as a real app's hub session and uplink, the frames are
+        generated by one XandarSimulator per sensor.
+    """
+    def __init__(self, appId, room, sensorNum=SENSOR_NUM, fps=SENSOR_FPS,
+                 interval=REPORT_INTERVAL, seed=None) -> None:
+        self.appId = appId
+        self.room = room
+        self.fps = fps
+        self.interval = interval
+        self.sensorIds = [seed * sensorNum + i if seed is not None else i
+                          for i in range(sensorNum)]
+        self.sensorNames = ['SIMU%d' % senId for senId in self.sensorIds]
+        self.sims = [xcomm.XandarSimulator(seed=senId, senId=senId) for senId in self.sensorIds]
+        for sim in self.sims: sim.setChunk(xcomm.FRAME_HEADER, xcomm.FRAME_SIZE)
+        self.reader = self.writer = None
+        self.decoder = xmsg.XAKAmsgDecoder()
+        self.replies = []       # hub replies received not handled yet.
+        self.seq = 0
+        self.latencies = []     # sec between a data report and its acknowledgement.
+        self.stats = dict.fromkeys(('batches', 'frames', 'errors'), 0)
+
+#--XAKAsimuApp-----------------------------------------------------------------
+    async def request(self, msgByte, action):
+        """ Send the message and return the hub reply of the <action>."""
+        self.writer.write(msgByte)
+        await self.writer.drain()
+        while True:
+            for idx, msgDict in enumerate(self.replies):
+                if msgDict.get('lAct') == action: return self.replies.pop(idx)
+            data = await asyncio.wait_for(self.reader.read(xhub.READ_SIZE), REPLY_TIMEOUT)
+            if not data: raise ConnectionError('connection closed by the hub')
+            self.replies += [msgDict for msgDict, _ in self.decoder.feed(data)]
+
+#--XAKAsimuApp-----------------------------------------------------------------
+    def genRecords(self, frameNum):
+        """ Return the <frameNum> frames of every sensor as a DATA_DTYPE array."""
+        records = np.zeros(frameNum * len(self.sims), dtype=xmsg.DATA_DTYPE)
+        crtTime = time.time()
+        for idx, sim in enumerate(self.sims):
+            frames = xcomm.parseFrameBatch(sim.read(frameNum * (len(xcomm.FRAME_HEADER)+xcomm.FRAME_SIZE)))
+            rows = records[idx*frameNum:(idx+1)*frameNum]
+            rows['sensor'] = idx
+            rows['ts'] = crtTime - np.arange(frameNum)[::-1] / self.fps
+            for field in xcomm.FRAME_DTYPE.names: rows[field] = frames[field]
+        return records
+
+#--XAKAsimuApp-----------------------------------------------------------------
+    async def run(self, serverAddr, duration, startDelay=0):
+        """ Connect, register the sensors and report the data for <duration> sec."""
+        await asyncio.sleep(startDelay)
+        endTime = time.time() + duration
+        try:
+            self.reader, self.writer = await asyncio.open_connection(*serverAddr)
+            reply = await self.request(xmsg.dumpMsg('CR', app=self.appId, room=self.room), 'CR')
+            if not reply.get('state'): raise ValueError('connection request denied')
+            for senId in self.sensorIds:
+                await self.request(xmsg.dumpMsg('RG', app=self.appId, senId=senId,
+                                                senType='XKAK_PPL_COUNT', room=self.room), 'RG')
+            frameNum = max(1, int(self.fps * self.interval))
+            # spread the reports of the apps in the interval.
+            await asyncio.sleep(random.uniform(0, self.interval))
+            while time.time() < endTime:
+                records = self.genRecords(frameNum)
+                msgByte = xmsg.dumpDataMsg(self.appId, self.seq, self.sensorNames, records)
+                sendTime = time.time()
+                reply = await self.request(msgByte, 'DT')
+                if reply.get('seq') == self.seq:
+                    self.latencies.append(time.time() - sendTime)
+                    self.stats['batches'] += 1
+                    self.stats['frames'] += len(records)
+                self.seq += 1
+                await asyncio.sleep(max(0, self.interval - (time.time() - sendTime)))
+            await self.request(xmsg.dumpMsg('LO', app=self.appId), 'LO')
+        except (OSError, ValueError, asyncio.TimeoutError) as err:
+            print("Simu app %s error: %s" %(self.appId, str(err) or type(err).__name__))
+            self.stats['errors'] += 1
+        finally:
+            if self.writer: self.writer.close()
+
+#-----------------------------------------------------------------------------
+async def runLoad(serverAddr, appNum=APP_NUM, roomNum=ROOM_NUM, sensorNum=SENSOR_NUM,
+                  fps=SENSOR_FPS, interval=REPORT_INTERVAL, duration=30, rampTime=RAMP_TIME):
+    """ Run <appNum> simulated apps (spread in <roomNum> rooms) against the hub
+        and return the load test result dict.
+    """
+    apps = [XAKAsimuApp('SIMU_APP_%05d' % i, 'Room_%d' % (i % roomNum), sensorNum=sensorNum,
+                        fps=fps, interval=interval, seed=i) for i in range(appNum)]
+    startTime = time.time()
+    await asyncio.gather(*[app.run(serverAddr, duration, rampTime * i / appNum)
+                           for i, app in enumerate(apps)])
+    latencies = np.array([t for app in apps for t in app.latencies]) * 1000
+    result = {'apps': appNum, 'sensors': appNum * sensorNum,
+              'errors': sum(app.stats['errors'] for app in apps),
+              'batches': sum(app.stats['batches'] for app in apps),
+              'frames': sum(app.stats['frames'] for app in apps),
+              'sec': round(time.time() - startTime, 2)}
+    if len(latencies):
+        result.update({'ackP50Ms': round(float(np.percentile(latencies, 50)), 2),
+                       'ackP99Ms': round(float(np.percentile(latencies, 99)), 2),
+                       'ackMaxMs': round(float(latencies.max()), 2)})
+    return result
+
+#-----------------------------------------------------------------------------
+#-----------------------------------------------------------------------------
+def testCase(mode=0):
+    if mode == 0:
+        async def test():
+            server = xhub.XAKAhubServer('127.0.0.1', 0)
+            port = await server.start()
+            load = asyncio.ensure_future(runLoad(('127.0.0.1', port), appNum=200, roomNum=4,
+                                                 interval=0.5, duration=3, rampTime=1))
+            await asyncio.sleep(2)
+            print(server.getStats())
+            occupancy = server.getOccupancy()
+            print(occupancy)
+            result = await load
+            print(result)
+            assert sorted(occupancy) == ['Room_%d' % i for i in range(4)]
+            assert all(sensorNum == 50 for _, sensorNum in occupancy.values())
+            assert result['errors'] == 0 and result['batches'] >= 200
+            assert result['frames'] == result['batches'] * int(SENSOR_FPS * 0.5)
+            assert server.getOccupancy() == {}  # all the apps logged out.
+            # a count older than the sensor's newest one is ignored.
+            app = XAKAsimuApp('CHECK_APP', 'Room_X')
+            app.reader, app.writer = await asyncio.open_connection('127.0.0.1', port)
+            await app.request(xmsg.dumpMsg('CR', app=app.appId, room=app.room), 'CR')
+            records = np.zeros(1, dtype=xmsg.DATA_DTYPE)
+            for timestamp, count in ((100.0, 5), (50.0, 2)):
+                records['ts'], records['params'][:, xhub.COUNT_IDX] = timestamp, count
+                reply = await app.request(xmsg.dumpDataMsg(app.appId, 0, ['SIMU0'], records), 'DT')
+                assert reply['count'] == 1
+            assert server.getOccupancy() == {'Room_X': (5.0, 1)}
+            # a malformed message closes its connection only.
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            writer.write(xmsg.MSG_HEADER.pack(2, 0) + b'ab')
+            assert await asyncio.wait_for(reader.read(xhub.READ_SIZE), REPLY_TIMEOUT) == b''
+            writer.close()
+            assert (await app.request(xmsg.dumpMsg('HB', app=app.appId), 'HB'))['state']
+            app.writer.close()
+            await server.stop()
+        asyncio.run(test())
+    else:
+        print("Put your test code here:")
+
+#-----------------------------------------------------------------------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='XAKA sensor hub load generator.')
+    parser.add_argument('--hub', default='127.0.0.1:%d' % gv.RGTCP_PORT,
+                        help='hub server ip[:port].')
+    parser.add_argument('--apps', type=int, default=APP_NUM, help='number of simulated apps.')
+    parser.add_argument('--rooms', type=int, default=ROOM_NUM, help='number of rooms.')
+    parser.add_argument('--sensors', type=int, default=SENSOR_NUM, help='sensors per app.')
+    parser.add_argument('--fps', type=float, default=SENSOR_FPS, help='frames per sec of a sensor.')
+    parser.add_argument('--interval', type=float, default=REPORT_INTERVAL,
+                        help='sec between 2 data reports of an app.')
+    parser.add_argument('--ramp', type=float, default=RAMP_TIME,
+                        help='sec to spread the apps connections on.')
+    parser.add_argument('--duration', type=float, default=30, help='sec to report the data.')
+    args = parser.parse_args(argv)
+    host, _, port = args.hub.partition(':')
+    xhub.raiseFileLimit()
+    result = asyncio.run(runLoad((host, int(port or gv.RGTCP_PORT)), appNum=args.apps,
+                                 roomNum=args.rooms, sensorNum=args.sensors, fps=args.fps,
+                                 interval=args.interval, duration=args.duration,
+                                 rampTime=args.ramp))
+    print("Hub load test: %s" % str(result))
+
+#-----------------------------------------------------------------------------
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,179 @@
+#!/usr/bin/python
+#-----------------------------------------------------------------------------
+# Name:        XAKAsensorHubMsg.py
+#
+# Purpose:     This module defines the message format between the sensor reader
+#              apps and the control hub. Every message is length prefixed:
+#                  [body length uint32][flags uint8][body]
+#              body: [json length uint32][json dict][binary data]
+#              The json dict has the 'act' key (CR: connection request, RG: sensor
+#              registration, LO: logout, HB: heart beat/response, DT: data report)
+#              and the binary data carries the sensor frames of a data report.
+#              The body is zlib compressed if the FLAG_ZLIB is set.
+#
+# Author:      Yuancheng Liu
+#
+# Created:     29/01/2022
+# version:     v_2.1
+# Copyright:   YC has not added.
+# License:     YC has not added.
+#-----------------------------------------------------------------------------
+
+import json
+import zlib
+from struct import Struct, error as StructError
+import numpy as np
+import XAKAsensorComm as xcomm
+
+MSG_HEADER = Struct('>IB')  # body length, flags.
+JSON_LEN = Struct('>I')
+FLAG_ZLIB = 0x01            # the body is zlib compressed.
+ZLIB_LEVEL = 6
+MIN_ZLIB_SIZE = 256         # bodies smaller than this are not compressed.
+MAX_MSG_SIZE = 16*1024*1024 # max body size accepted (also after the decompression).
+MSG_ACTIONS = ('CR', 'RG', 'LO', 'HB', 'DT')
+# Record of the frames in a data report: sensor index in the message 'sensors'
+# list, receive timestamp and the frame fields.
+DATA_DTYPE = np.dtype([('sensor', '<u2'), ('ts', '<f8')] + xcomm.FRAME_DTYPE.descr)
+
+#-----------------------------------------------------------------------------
+def packMsg(msgDict, binData=b'', compress=True):
+    """ Return the length prefixed message bytes of the dict and binary data."""
+    jsonByte = json.dumps(msgDict, separators=(',', ':')).encode('utf-8')
+    body = JSON_LEN.pack(len(jsonByte)) + jsonByte + bytes(binData)
+    flags = 0
+    if compress and len(body) >= MIN_ZLIB_SIZE:
+        body, flags = zlib.compress(body, ZLIB_LEVEL), FLAG_ZLIB
+    return MSG_HEADER.pack(len(body), flags) + body
+
+#-----------------------------------------------------------------------------
+def unpackBody(body, flags, maxSize=MAX_MSG_SIZE):
+    """ Return the (msgDict, binData) of a message body. Raise ValueError if the
+        body decompressed is bigger than <maxSize> or the json is not a dict.
+    """
+    if flags & FLAG_ZLIB:
+        decompressor = zlib.decompressobj()
+        body = decompressor.decompress(body, maxSize)
+        if decompressor.unconsumed_tail:
+            raise ValueError('decompressed body bigger than %d bytes' % maxSize)
+    jsonLen = JSON_LEN.unpack_from(body)[0]
+    start = JSON_LEN.size
+    msgDict = json.loads(body[start:start+jsonLen].decode('utf-8'))
+    if not isinstance(msgDict, dict): raise ValueError('json message is not a dict')
+    return msgDict, body[start+jsonLen:]
+
+#-----------------------------------------------------------------------------
+#-----------------------------------------------------------------------------
+class XAKAmsgDecoder(object):
+    """ Stateful decoder of the length prefixed messages received from a stream
+        socket, feed() the received bytes and get the complete messages.
+    """
+    def __init__(self, maxSize=MAX_MSG_SIZE) -> None:
+        self.buf = bytearray()
+        self.maxSize = maxSize
+
+#--XAKAmsgDecoder--------------------------------------------------------------
+    def feed(self, data):
+        """ Add the received bytes and return the list of (msgDict, binData).
+            Raise ValueError if a message is bigger than <maxSize> or invalid.
+        """
+        self.buf += data
+        msgList = []
+        while len(self.buf) >= MSG_HEADER.size:
+            bodyLen, flags = MSG_HEADER.unpack_from(self.buf)
+            if bodyLen > self.maxSize:
+                raise ValueError('Message decoder: message size %d too big.' % bodyLen)
+            end = MSG_HEADER.size + bodyLen
+            if len(self.buf) < end: break
+            body = bytes(self.buf[MSG_HEADER.size:end])
+            del self.buf[:end]
+            try:
+                msgList.append(unpackBody(body, flags, self.maxSize))
+            except (zlib.error, StructError, ValueError, UnicodeDecodeError) as err:
+                raise ValueError('Message decoder: invalid message: %s' % str(err))
+        return msgList
+
+    def reset(self):
+        self.buf = bytearray()
+
+#-----------------------------------------------------------------------------
+def dumpMsg(action, compress=True, binData=b'', **kwargs):
+    """ Build the message of the <action> with the key-value arguments, such as
+        dumpMsg('RG', senId=1, senType='XKAK_PPL_COUNT')
+    """
+    if action not in MSG_ACTIONS:
+        raise ValueError('Hub message: unknown action %s' % str(action))
+    msgDict = {'act': action}
+    msgDict.update(kwargs)
+    return packMsg(msgDict, binData, compress)
+
+def dumpReply(lastAction, state=True, **kwargs):
+    """ Build the hub reply (HB message) of the <lastAction> request."""
+    return dumpMsg('HB', lAct=lastAction, state=state, **kwargs)
+
+#-----------------------------------------------------------------------------
+def dumpDataMsg(appId, seq, sensorNames, records, compress=True, **kwargs):
+    """ Build the data report message of the <records> (DATA_DTYPE array), the
+        key-value arguments (such as the sensors' rolling 'stats') are added in
+        the json dict.
+    """
+    return dumpMsg('DT', compress=compress, binData=records.tobytes(), app=appId,
+                   seq=seq, sensors=list(sensorNames), count=len(records), **kwargs)
+
+def loadDataRecords(binData):
+    """ Return the frames of a data report as a DATA_DTYPE array."""
+    return np.frombuffer(binData, dtype=DATA_DTYPE)
+
+#-----------------------------------------------------------------------------
+#-----------------------------------------------------------------------------
+def testCase(mode=0):
+    if mode == 0:
+        records = np.zeros(256, dtype=DATA_DTYPE)
+        records['ts'] = np.arange(256) * 0.5
+        records['params'][:, 22] = 3
+        msgByte = dumpDataMsg('app0', 1, ['ttyUSB0'], records)
+        print("Data message %d bytes (raw %d bytes)" %(len(msgByte), records.nbytes))
+        decoder = XAKAmsgDecoder()
+        data = dumpMsg('CR', app='app0') + msgByte + dumpReply('CR')
+        msgList = []
+        for i in range(0, len(data), 100):
+            msgList += decoder.feed(data[i:i+100])
+        for msgDict, binData in msgList:
+            print(msgDict, len(loadDataRecords(binData)))
+        # round trip of the messages split at any byte.
+        assert [m['act'] for m, _ in msgList] == ['CR', 'DT', 'HB']
+        assert msgList[1][0] == {'act': 'DT', 'app': 'app0', 'seq': 1,
+                                 'sensors': ['ttyUSB0'], 'count': 256}
+        assert np.array_equal(loadDataRecords(msgList[1][1]), records)
+        assert msgList[2][0] == {'act': 'HB', 'lAct': 'CR', 'state': True}
+        assert len(msgByte) < records.nbytes and decoder.buf == bytearray()
+        assert XAKAmsgDecoder().feed(packMsg({'act': 'HB'}, b'\x01', compress=False)) == [({'act': 'HB'}, b'\x01')]
+        # the malformed messages raise ValueError.
+        bomb = zlib.compress(bytes(4096))
+        badList = [MSG_HEADER.pack(2, 0) + b'ab',                   # short body.
+                   packMsg([], compress=False),                      # not a dict.
+                   MSG_HEADER.pack(8, 0) + JSON_LEN.pack(4) + b'{x:1',  # bad json.
+                   MSG_HEADER.pack(5, FLAG_ZLIB) + b'12345',         # bad zlib data.
+                   MSG_HEADER.pack(MAX_MSG_SIZE + 1, 0)]             # too big.
+        for badMsg in badList:
+            try:
+                XAKAmsgDecoder().feed(badMsg)
+                assert False, 'malformed message accepted: %r' % badMsg[:16]
+            except ValueError:
+                pass
+        try:
+            XAKAmsgDecoder(maxSize=1024).feed(MSG_HEADER.pack(len(bomb), FLAG_ZLIB) + bomb)
+            assert False, 'decompressed body bigger than the max size accepted'
+        except ValueError:
+            pass
+        try:
+            dumpMsg('XX')
+            assert False, 'unknown action accepted'
+        except ValueError:
+            pass
+    else:
+        print("Put your test code here:")
+
+#-----------------------------------------------------------------------------
+if __name__ == '__main__':
+    testCase(mode=0)
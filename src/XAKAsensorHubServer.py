@@ -0,0 +1,296 @@
+#!/usr/bin/python
+#-----------------------------------------------------------------------------
+# Name:        XAKAsensorHubServer.py
+#
+# Purpose:     This module is the reference control hub (asyncio TCP server on
+#              the <RGTCP_PORT>): it answers the connection request/registration/
+#              heart beat/logout messages, acknowledges the data reports of the
+#              telemetry uplinks and aggregates the people count of every room
+#              in memory. All the app connections are served by one event loop
+#              so one process can serve thousands of apps (XAKAsensorHubLoad.py
+#              is the load generator to size the hub).
+#                  python XAKAsensorHubServer.py --port 5006
+#
+# Author:      Yuancheng Liu
+#
+# Created:     29/01/2022
+# version:     v_2.1
+# Copyright:   YC has not added.
+# License:     YC has not added.
+#-----------------------------------------------------------------------------
+
+import time
+import asyncio
+import argparse
+import numpy as np
+import XAKAsensorGlobal as gv
+import XAKAsensorHubMsg as xmsg
+
+READ_SIZE = 65536       # max bytes read from a connection each time.
+STATS_INTERVAL = 10     # sec between 2 stats prints.
+LISTEN_BACKLOG = 4096   # pending connections queue (many apps reconnect at once).
+IDLE_TIMEOUT = 90       # sec without any message to close an app connection.
+DEFAULT_ROOM = 'default'
+COUNT_IDX = 25          # 'params' index of the final people count (frame index 27).
+
+#-----------------------------------------------------------------------------
+#-----------------------------------------------------------------------------
+class XAKAhubServer(object):
+    """ Reference hub server, each connection is served by one coroutine. The
+        hub keeps the latest people count of every (app, sensor ID) reported and
+        the occupancy (sum of the sensors' counts) of every room. The room of a
+        sensor is the 'room' of its registration (RG) or of the app's connection
+        request (CR).
+    """
+    def __init__(self, host='0.0.0.0', port=gv.RGTCP_PORT, sslContext=None,
+                 idleTimeout=IDLE_TIMEOUT) -> None:
+        self.host = host
+        self.port = port
+        self.sslContext = sslContext
+        self.idleTimeout = idleTimeout
+        self.server = None
+        self.clients = {}       # client task: (stream writer, session dict).
+        self.apps = {}          # appId: app state dict.
+        self.sensors = {}       # (appId, senId): [room, people count, timestamp].
+        self.rooms = {}         # room: [occupancy, sensor number].
+        self.countTimes = {}    # (appId, senId): newest count time (kept when offline).
+        self.stats = dict.fromkeys(('connections', 'messages', 'batches', 'frames',
+                                    'bytesRecv', 'idleClosed'), 0)
+
+#--XAKAhubServer---------------------------------------------------------------
+    async def start(self):
+        """ Start listening, return the port (useful if the <port> is 0)."""
+        self.server = await asyncio.start_server(self.handleClient, self.host, self.port,
+                                                 ssl=self.sslContext, backlog=LISTEN_BACKLOG)
+        self.port = self.server.sockets[0].getsockname()[1]
+        print("Hub server: listening on port %d" % self.port)
+        return self.port
+
+#--XAKAhubServer---------------------------------------------------------------
+    async def serve(self, duration=None, statsInterval=STATS_INTERVAL):
+        """ Serve (for <duration> sec or until cancelled) and print the stats."""
+        if self.server is None: await self.start()
+        endTime = time.time() + duration if duration else None
+        lastStats = time.time()
+        try:
+            while endTime is None or time.time() < endTime:
+                await asyncio.sleep(min(1, endTime - time.time()) if endTime else 1)
+                self.closeIdleClients()
+                if time.time() - lastStats >= statsInterval:
+                    lastStats = time.time()
+                    print("Hub server: %s" % str(self.getStats()))
+        finally:
+            await self.stop()
+
+    async def stop(self):
+        """ Stop listening and close all the app connections."""
+        if self.server: self.server.close()
+        for writer, _ in self.clients.values(): writer.close()
+        await asyncio.gather(*self.clients.keys(), return_exceptions=True)
+        if self.server: await self.server.wait_closed()
+        self.server = None
+
+#--XAKAhubServer---------------------------------------------------------------
+    def closeIdleClients(self):
+        """ Close the connections which did not send any message (not even a heart
+            beat) in <idleTimeout> sec, called every sec by serve().
+        """
+        deadline = time.time() - self.idleTimeout
+        for writer, session in list(self.clients.values()):
+            if session['lastRecv'] < deadline and not writer.is_closing():
+                self.stats['idleClosed'] += 1
+                writer.close()
+
+#--XAKAhubServer---------------------------------------------------------------
+    async def handleClient(self, reader, writer):
+        """ Serve one app connection."""
+        session = {'app': None, 'peer': writer.get_extra_info('peername'),
+                   'lastRecv': time.time()}
+        decoder = xmsg.XAKAmsgDecoder()
+        task = asyncio.current_task()
+        self.clients[task] = (writer, session)
+        self.stats['connections'] += 1
+        try:
+            while True:
+                data = await reader.read(READ_SIZE)
+                if not data: break
+                session['lastRecv'] = time.time()
+                self.stats['bytesRecv'] += len(data)
+                closeFlag = False
+                for msgDict, binData in decoder.feed(data):
+                    reply, closeFlag = self.handleMsg(session, msgDict, binData)
+                    if reply: writer.write(reply)
+                    if closeFlag: break
+                await writer.drain()
+                if closeFlag: break
+        except (ConnectionError, ValueError) as err:
+            print("Hub server: connection %s error: %s" %(str(session['peer']), str(err)))
+        finally:
+            self.clients.pop(task, None)
+            self.stats['connections'] -= 1
+            if session['app'] in self.apps: self.setAppOffline(session['app'])
+            writer.close()
+
+#--XAKAhubServer---------------------------------------------------------------
+    def handleMsg(self, session, msgDict, binData):
+        """ Handle one message, return the (reply bytes, close connection flag)."""
+        self.stats['messages'] += 1
+        action = msgDict.get('act')
+        if action == 'CR':
+            if session['app']: return xmsg.dumpReply('CR'), False
+            session['app'] = appId = msgDict.get('app') or str(session['peer'])
+            app = self.apps.setdefault(appId, {'batches': 0, 'frames': 0, 'sensors': {},
+                                               'reporting': set(), 'conns': 0})
+            app['conns'] += 1   # the old connection may not be closed yet at reconnection.
+            app.update({'online': True, 'lastSeen': time.time(),
+                        'room': msgDict.get('room') or DEFAULT_ROOM})
+            return xmsg.dumpReply('CR'), False
+        if session['app'] is None:
+            return xmsg.dumpReply(action, state=False, error='no connection request'), False
+        self.apps[session['app']]['lastSeen'] = time.time()
+        if action == 'DT':
+            return self.onData(session, msgDict, binData), False
+        if action == 'RG':
+            return self.onRegister(session, msgDict), False
+        if action == 'HB':
+            return xmsg.dumpReply('HB', time=time.time()), False
+        if action == 'LO':
+            return xmsg.dumpReply('LO'), True
+        return xmsg.dumpReply(str(action), state=False, error='unknown action'), False
+
+#--XAKAhubServer---------------------------------------------------------------
+    def onRegister(self, session, msgDict):
+        """ Register the app's sensor (and its room)."""
+        try:
+            senId = int(msgDict.get('senId'))
+        except (TypeError, ValueError):
+            return xmsg.dumpReply('RG', state=False, error='invalid sensor ID')
+        app = self.apps[session['app']]
+        app['sensors'][senId] = msgDict
+        sensor = self.sensors.get((session['app'], senId))
+        if sensor and msgDict.get('room') and msgDict['room'] != sensor[0]:
+            # the sensor moved to another room.
+            self.updateCount(session['app'], senId, sensor[1], sensor[2], msgDict['room'])
+        return xmsg.dumpReply('RG')
+
+#--XAKAhubServer---------------------------------------------------------------
+    def onData(self, session, msgDict, binData):
+        """ Update the reported sensors' latest people count and acknowledge the
+            batch.
+        """
+        records = xmsg.loadDataRecords(binData)
+        if len(records):
+            # index of the last record of every sensor ID in the batch.
+            senIds, revIdx = np.unique(records['senId'][::-1], return_index=True)
+            for senId, idx in zip(senIds.tolist(), (len(records) - 1 - revIdx).tolist()):
+                self.updateCount(session['app'], senId, float(records['params'][idx, COUNT_IDX]),
+                                 float(records['ts'][idx]))
+        app = self.apps[session['app']]
+        if 'stats' in msgDict: app['stats'] = msgDict['stats']  # sensors' rolling stats.
+        app['batches'] += 1
+        app['frames'] += len(records)
+        self.stats['batches'] += 1
+        self.stats['frames'] += len(records)
+        return xmsg.dumpReply('DT', seq=msgDict.get('seq'), count=len(records))
+
+#--XAKAhubServer---------------------------------------------------------------
+    def updateCount(self, appId, senId, count, timestamp, room=None):
+        """ Set the sensor's people count and update its room's occupancy. The
+            count older than the sensor's newest one (such as the uplink resends
+            its spilled batches after the reconnection) is ignored.
+        """
+        key = (appId, senId)
+        if timestamp < self.countTimes.get(key, timestamp): return
+        self.countTimes[key] = timestamp
+        sensor = self.sensors.get(key)
+        if room is None:
+            if sensor:
+                room = sensor[0]
+            else:
+                app = self.apps[appId]
+                room = app['sensors'].get(senId, {}).get('room') or app['room']
+        if sensor:
+            oldRoom = self.rooms[sensor[0]]
+            oldRoom[0] -= sensor[1]
+            if sensor[0] != room:
+                oldRoom[1] -= 1
+                if oldRoom[1] == 0: del self.rooms[sensor[0]]
+        if not sensor or sensor[0] != room:
+            self.rooms.setdefault(room, [0.0, 0])[1] += 1
+        self.rooms[room][0] += count
+        self.sensors[key] = [room, count, timestamp]
+        self.apps[appId]['reporting'].add(senId)
+
+    def setAppOffline(self, appId):
+        """ Remove the disconnected app's sensors from the rooms' occupancy (when
+            its last connection is closed).
+        """
+        app = self.apps[appId]
+        app['conns'] -= 1
+        if app['conns'] > 0: return
+        app['online'] = False
+        for senId in app['reporting']:
+            self.removeSensor(appId, senId)
+        app['reporting'] = set()
+
+    def removeSensor(self, appId, senId):
+        sensor = self.sensors.pop((appId, senId))
+        room = self.rooms[sensor[0]]
+        room[0] -= sensor[1]
+        room[1] -= 1
+        if room[1] == 0: del self.rooms[sensor[0]]
+
+#--XAKAhubServer---------------------------------------------------------------
+    def getOccupancy(self):
+        """ Return {room: (people count, number of sensors reporting)}."""
+        return {room: (round(max(0.0, val[0]), 2), val[1]) for room, val in self.rooms.items()}
+
+    def getStats(self):
+        stats = dict(self.stats)
+        stats['apps'] = len(self.apps)
+        stats['online'] = len(self.clients)
+        stats['sensors'] = len(self.sensors)
+        stats['rooms'] = len(self.rooms)
+        return stats
+
+#-----------------------------------------------------------------------------
+def raiseFileLimit():
+    """ Raise the process' open files limit to the max (every app connection is
+        a file descriptor), return the new limit or None if not supported.
+    """
+    try:
+        import resource     # not available on Windows.
+    except ImportError:
+        return None
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard != resource.RLIM_INFINITY and soft < hard:
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+            soft = hard
+        except (ValueError, OSError) as err:
+            print("Raise the open files limit error: %s" % str(err))
+    return soft
+
+#-----------------------------------------------------------------------------
+#-----------------------------------------------------------------------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='XAKA sensor stand-in hub server.')
+    parser.add_argument('--host', default='0.0.0.0', help='listening address.')
+    parser.add_argument('--port', type=int, default=gv.RGTCP_PORT, help='listening port.')
+    parser.add_argument('--duration', type=float, help='sec to run, default: forever.')
+    parser.add_argument('--idle-timeout', type=float, default=IDLE_TIMEOUT,
+                        help='sec without message to close an app connection.')
+    args = parser.parse_args(argv)
+    print("Hub server: open files limit %s" % str(raiseFileLimit()))
+    server = XAKAhubServer(args.host, args.port, idleTimeout=args.idle_timeout)
+    try:
+        asyncio.run(server.serve(duration=args.duration))
+    except KeyboardInterrupt:
+        pass
+    print("Hub server: %s" % str(server.getStats()))
+    for room, (count, sensorNum) in sorted(server.getOccupancy().items()):
+        print(" - %s: %s people (%d sensors)" %(room, count, sensorNum))
+
+#-----------------------------------------------------------------------------
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,229 @@
+#!/usr/bin/python
+#-----------------------------------------------------------------------------
+# Name:        XAKAsensorMetrics.py
+#
+# Purpose:     This module is the built-in performance instrumentation of the
+#              sensor reader: counters, gauges and fixed-bucket histograms cheap
+#              enough to stay on in production (one list index increment per
+#              sample, no lock on the update path), kept in a process wide
+#              registry which can be shown in the UI diagnostics page or dumped
+#              in the Prometheus text format by the headless daemon.
+#
+# Author:      Yuancheng Liu
+#
+# Created:     29/01/2022
+# version:     v_2.1
+# Copyright:   YC has not added.
+# License:     YC has not added.
+#-----------------------------------------------------------------------------
+
+import os
+import time
+import threading
+from bisect import bisect_left
+
+# histogram buckets upper bounds (sec): 1-2.5-5 steps from 10us to 10s.
+TIME_BUCKETS = tuple(round(m * 10.0**e, 6) for e in range(-5, 1) for m in (1, 2.5, 5)) + (10.0,)
+METRIC_PREFIX = 'xaka_'
+TYPE_COUNTER, TYPE_GAUGE, TYPE_HISTOGRAM = 'counter', 'gauge', 'histogram'
+
+#-----------------------------------------------------------------------------
+def fmtLabels(labels, extra=None):
+    """ Return the Prometheus label string '{k="v",...}' of the labels tuple."""
+    items = list(labels) + ([extra] if extra else [])
+    if not items: return ''
+    return '{%s}' % ','.join('%s="%s"' % (key, str(val).replace('\\', '\\\\').replace('"', '\\"'))
+                             for key, val in items)
+
+#-----------------------------------------------------------------------------
+#-----------------------------------------------------------------------------
+class XAKAcounter(object):
+    """ Monotonic counter. The update is not locked: every labeled counter must
+        have one writer thread (such as the sensor's reader thread).
+    """
+    def __init__(self, labels=()) -> None:
+        self.labels = labels
+        self.value = 0
+
+    def inc(self, num=1):
+        self.value += num
+
+#-----------------------------------------------------------------------------
+#-----------------------------------------------------------------------------
+class XAKAgauge(object):
+    """ Value which can go up and down (such as a queue depth)."""
+    def __init__(self, labels=()) -> None:
+        self.labels = labels
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+#-----------------------------------------------------------------------------
+#-----------------------------------------------------------------------------
+class XAKAhistogram(object):
+    """ Fixed-bucket histogram of the observed values (sec for the timings):
+        observe() is a bisect plus 3 additions, the quantiles are estimated by
+        the linear interpolation inside the bucket. One writer thread only.
+    """
+    def __init__(self, labels=(), buckets=TIME_BUCKETS) -> None:
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)    # last one: +Inf bucket.
+        self.sum = 0.0
+        self.count = 0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+        if value > self.max: self.max = value
+
+#--XAKAhistogram---------------------------------------------------------------
+    def mean(self):
+        return self.sum / self.count if self.count else None
+
+    def quantile(self, q):
+        """ Return the estimated <q> (0~1) quantile, None if no sample."""
+        counts, total = list(self.counts), self.count
+        if not total: return None
+        rank, cumulative = q * total, 0
+        for idx, num in enumerate(counts):
+            if num and cumulative + num >= rank:
+                if idx == len(self.buckets): return self.max
+                lower = self.buckets[idx-1] if idx else 0.0
+                upper = min(self.buckets[idx], self.max)
+                return lower + (upper - lower) * max(0.0, rank - cumulative) / num
+            cumulative += num
+        return self.max
+
+#-----------------------------------------------------------------------------
+#-----------------------------------------------------------------------------
+class XAKAmetricsRegistry(object):
+    """ Registry of the named metrics, usage example:
+            readTime = REGISTRY.histogram('serial_read_seconds', 'Serial read latency.',
+                                          sensor='COM3')
+            readTime.observe(0.002)     # hot path: keep the metric object.
+            print(REGISTRY.dumpText())
+        The metrics are created once (locked) and then updated without lock.
+    """
+    def __init__(self, prefix=METRIC_PREFIX) -> None:
+        self.prefix = prefix
+        self.families = {}  # name: [type, help, {labels tuple: metric}]
+        self.lock = threading.Lock()
+        self.startTime = time.time()
+
+#--XAKAmetricsRegistry---------------------------------------------------------
+    def _getMetric(self, metricType, name, helpStr, labels, **kwargs):
+        """ Return the metric of the name and labels, create it if not exist."""
+        name = self.prefix + name
+        key = tuple(sorted(labels.items()))
+        family = self.families.get(name)
+        if family and key in family[2]: return family[2][key]
+        with self.lock:
+            family = self.families.setdefault(name, [metricType, helpStr, {}])
+            if family[0] != metricType:
+                raise ValueError('Metrics: %s is a %s not a %s' %(name, family[0], metricType))
+            if key not in family[2]:
+                metricCls = {TYPE_COUNTER: XAKAcounter, TYPE_GAUGE: XAKAgauge,
+                             TYPE_HISTOGRAM: XAKAhistogram}[metricType]
+                # copy-on-write so the readers iterate without the lock.
+                metrics = dict(family[2])
+                metrics[key] = metricCls(key, **kwargs)
+                family[2] = metrics
+            return family[2][key]
+
+    def counter(self, name, helpStr='', **labels):
+        return self._getMetric(TYPE_COUNTER, name, helpStr, labels)
+
+    def gauge(self, name, helpStr='', **labels):
+        return self._getMetric(TYPE_GAUGE, name, helpStr, labels)
+
+    def histogram(self, name, helpStr='', buckets=TIME_BUCKETS, **labels):
+        return self._getMetric(TYPE_HISTOGRAM, name, helpStr, labels, buckets=buckets)
+
+#--XAKAmetricsRegistry---------------------------------------------------------
+    def dumpText(self):
+        """ Return all the metrics in the Prometheus text exposition format."""
+        lines = []
+        for name, (metricType, helpStr, metrics) in sorted(self.families.items()):
+            if helpStr: lines.append('# HELP %s %s' %(name, helpStr))
+            lines.append('# TYPE %s %s' %(name, metricType))
+            for labels, metric in sorted(metrics.items()):
+                if metricType != TYPE_HISTOGRAM:
+                    lines.append('%s%s %s' %(name, fmtLabels(labels), repr(metric.value)))
+                    continue
+                counts, cumulative = list(metric.counts), 0
+                for bound, num in zip(metric.buckets + ('+Inf',), counts):
+                    cumulative += num
+                    lines.append('%s_bucket%s %d' %(name, fmtLabels(labels, ('le', bound)), cumulative))
+                lines.append('%s_sum%s %r' %(name, fmtLabels(labels), metric.sum))
+                lines.append('%s_count%s %d' %(name, fmtLabels(labels), cumulative))
+        return '\n'.join(lines) + '\n'
+
+    def writeText(self, filePath):
+        """ Write the Prometheus dump to the file (atomic replace, so a scraper
+            such as the node exporter textfile collector never reads half a file).
+        """
+        tmpPath = filePath + '.tmp'
+        try:
+            with open(tmpPath, 'w') as fh:
+                fh.write(self.dumpText())
+            os.replace(tmpPath, filePath)
+            return True
+        except OSError as err:
+            print("Metrics: write file %s error: %s" %(filePath, str(err)))
+            return False
+
+#--XAKAmetricsRegistry---------------------------------------------------------
+    def summaryLines(self):
+        """ Return the human readable lines of all the metrics (the timings in ms)
+            for the UI diagnostics page.
+        """
+        lines = ['Uptime: %d sec' % (time.time() - self.startTime)]
+        for name, (metricType, _, metrics) in sorted(self.families.items()):
+            shortName = name[len(self.prefix):] if name.startswith(self.prefix) else name
+            for labels, metric in sorted(metrics.items()):
+                title = shortName + fmtLabels(labels)
+                if metricType != TYPE_HISTOGRAM:
+                    value = metric.value
+                    lines.append('%-48s %s' %(title, '%.3f' % value if isinstance(value, float) else value))
+                elif metric.count:
+                    scale = 1000 if shortName.endswith('_seconds') else 1
+                    lines.append('%-48s n=%-8d avg=%.3f p50=%.3f p99=%.3f max=%.3f%s' %(
+                        title, metric.count, metric.mean()*scale, metric.quantile(0.5)*scale,
+                        metric.quantile(0.99)*scale, metric.max*scale, ' ms' if scale != 1 else ''))
+                else:
+                    lines.append('%-48s n=0' % title)
+        return lines
+
+# process wide registry used by all the modules.
+REGISTRY = XAKAmetricsRegistry()
+
+#-----------------------------------------------------------------------------
+#-----------------------------------------------------------------------------
+def testCase(mode=0):
+    if mode == 0:
+        import random
+        registry = XAKAmetricsRegistry()
+        readTime = registry.histogram('serial_read_seconds', 'Serial read latency.', sensor='COM3')
+        readBytes = registry.counter('serial_read_bytes_total', 'Bytes read.', sensor='COM3')
+        depth = registry.gauge('frame_queue_depth', 'Frames queued.', sensor='COM3')
+        startTime = time.perf_counter()
+        for _ in range(100000):
+            readTime.observe(random.expovariate(500))
+            readBytes.inc(500)
+        cost = (time.perf_counter() - startTime) / 100000
+        depth.set(12)
+        print("observe + inc cost: %.2f us" % (cost * 1e6))
+        print("p50 %.3f ms (exact 1.386), p99 %.3f ms (exact 9.210)" %(
+            readTime.quantile(0.5)*1000, readTime.quantile(0.99)*1000))
+        print('\n'.join(registry.summaryLines()))
+        print(registry.dumpText()[:600])
+    else:
+        print("Put your test code here:")
+
+#-----------------------------------------------------------------------------
+if __name__ == '__main__':
+    testCase(mode=0)
@@ -0,0 +1,233 @@
+#!/usr/bin/python
+#-----------------------------------------------------------------------------
+# Name:        XAKAsensorMgr.py
+#
+# Purpose:     This module is the multi-sensors acquisition manager. It runs N
+#              XAKAsensorComm (one background reader thread per port) at the
+#              same time and publishes every sensor's new frames and its
+#              online/offline state to the UI (or the headless service).
+#
+# Author:      Yuancheng Liu
+#
+# Created:     29/01/2022
+# version:     v_2.1
+# Copyright:   YC has not added.
+# License:     YC has not added.
+#-----------------------------------------------------------------------------
+
+import time
+import threading
+import XAKAsensorComm as xcomm
+import XAKAsensorRecorder as xrec
+import XAKAsensorReplay as xreplay
+
+MAX_SENSOR_NUM = 4      # one app can control max 4 sensors.
+OFFLINE_TIMEOUT = 3     # sec without any frame to mark a sensor offline.
+
+#-----------------------------------------------------------------------------
+#-----------------------------------------------------------------------------
+class XAKAsensorMgr(object):
+    """ Manage the acquisition of max <MAX_SENSOR_NUM> sensors. Each sensor is
+        read by its own reader thread, so the poll() call (from the UI timer)
+        only drains the queues and never blocks whatever the sensor number.
+        If the <replayPath> is set, the sensors recorded in the path are replayed
+        (at <replaySpeed>) instead of reading the <commPorts>.
+    """
+    def __init__(self, commPorts, simuMd=False, maxNum=MAX_SENSOR_NUM, recDir=None,
+                 replayPath=None, replaySpeed=xreplay.MIN_SPEED) -> None:
+        replaySources = {}
+        if replayPath:
+            replaySources = xreplay.findReplaySources(replayPath)
+            if not replaySources: print("Sensor manager: no record in %s" % replayPath)
+            commPorts, simuMd, recDir = list(replaySources.keys()), False, None
+        if len(commPorts) > maxNum:
+            print("Sensor manager: only the first %d sensors are used." % maxNum)
+        self.simuMd = simuMd
+        self.recDir = recDir    # folder to record all the frames, None: no record.
+        self.sensorList = [xcomm.XAKAsensorComm(port, simuMd=simuMd)
+                           for port in commPorts[:maxNum]]
+        self.latestList = [None] * len(self.sensorList) # last (timestamp, frame)
+        self.lastRecv = [None] * len(self.sensorList)   # wall time of the last frames.
+        self.rewound = set()    # sensors whose frames time moved back (replay seek/loop).
+        self.replayList = []    # replay sources, sensor index aligned.
+        self.lock = threading.Lock() # start() may run in a background thread.
+        self.stopFlag = False
+        for sensor in self.sensorList if replaySources else []:
+            replaySrc = xreplay.openReplaySource(replaySources[sensor.serialPort], speed=replaySpeed)
+            sensor.setReplaySource(replaySrc)
+            self.replayList.append(replaySrc)
+        if self.replayList: self.seekReplay(self.getReplayRange()[0])
+
+#--XAKAsensorMgr---------------------------------------------------------------
+    def start(self, searchFlag=False):
+        """ Connect all the sensors and start their reader threads. If the
+            <searchFlag> is set, the sensor ports are found by one concurrent
+            probe of all the candidate ports. It can be called in a background
+            thread, the stop() called meanwhile waits for it to finish.
+        """
+        with self.lock:
+            if self.stopFlag: return
+            if searchFlag and not (self.simuMd or self.replayList): self.searchPorts()
+            for sensor in self.sensorList:
+                if self.recDir and sensor.recorder is None: self._openRecorder(sensor)
+                sensor.setSerialComm()
+                sensor.startReading()
+
+#--XAKAsensorMgr---------------------------------------------------------------
+    def _openRecorder(self, sensor):
+        sensorName = ('SIMU_' if self.simuMd else '') + str(sensor.serialPort)
+        sensor.recorder = xrec.XAKArecorder(self.recDir, sensorName)
+
+    def setRecording(self, recDir):
+        """ Start recording all the sensors' frames in <recDir> (None: stop).
+            The replayed frames are never recorded.
+        """
+        if self.replayList: return False
+        with self.lock:
+            self.recDir = recDir
+            for sensor in self.sensorList:
+                recorder, sensor.recorder = sensor.recorder, None
+                # close() waits a write of the reader thread (the recorder's lock)
+                # and the later recordFrames() calls on it are ignored.
+                if recorder: recorder.close()
+                if recDir: self._openRecorder(sensor)
+        return True
+
+    def isRecording(self):
+        return self.recDir is not None
+
+#--XAKAsensorMgr---------------------------------------------------------------
+    def searchPorts(self):
+        """ Assign the detected sensor ports to the sensors: the configured port
+            is kept if it is a sensor port, the others get the free ones.
+        """
+        # the cached ports are probed concurrently: a stale cache costs one
+        # probe timeout whatever the number of cached ports.
+        sensorPorts, _ = xcomm.searchSensorPorts(xcomm.loadPortCache())
+        if len(sensorPorts) < len(self.sensorList):
+            sensorPorts, _ = xcomm.searchSensorPorts()
+        print("Sensor manager: sensor ports found: %s" % str(sensorPorts))
+        if not sensorPorts: return
+        xcomm.savePortCache(sensorPorts)
+        freePorts = [p for p in sensorPorts
+                     if p not in [s.serialPort for s in self.sensorList]]
+        for sensor in self.sensorList:
+            if sensor.serialPort not in sensorPorts and freePorts:
+                sensor.serialPort = freePorts.pop(0)
+
+#--XAKAsensorMgr---------------------------------------------------------------
+    def poll(self):
+        """ Drain all the sensors' frame queues without blocking. Return a list
+            (sensor index aligned) of each sensor's new [(timestamp, frame)].
+        """
+        result = []
+        for idx, sensor in enumerate(self.sensorList):
+            frameList = self._cutRewind(idx, sensor.getFrames())
+            if frameList:
+                self.latestList[idx] = frameList[-1]
+                # the replayed frames have their record time, not the receive time.
+                self.lastRecv[idx] = time.time()
+            result.append(frameList)
+        return result
+
+    def _cutRewind(self, idx, frameList):
+        """ Return the frames from the last one earlier than its previous frame
+            (the replay moved back in time: the frames before it are of the old
+            timeline), the sensor is marked in <rewound>.
+        """
+        lastTime = self.latestList[idx][0] if self.latestList[idx] else None
+        startIdx = 0
+        for frameIdx, (timestamp, _) in enumerate(frameList):
+            if lastTime is not None and timestamp < lastTime:
+                startIdx = frameIdx
+                self.rewound.add(idx)
+            lastTime = timestamp
+        return frameList[startIdx:] if startIdx else frameList
+
+    def popRewound(self):
+        """ Return the indexes of the sensors whose frames time moved back since
+            the last call, their history/stats must be cleared before adding the
+            frames of the last poll() (the consumers need the time order).
+        """
+        rewound, self.rewound = self.rewound, set()
+        return sorted(rewound)
+
+#--XAKAsensorMgr---------------------------------------------------------------
+    def isOnline(self, idx):
+        """ Return True if the sensor sent a frame in the last <OFFLINE_TIMEOUT>."""
+        lastRecv = self.lastRecv[idx]
+        return lastRecv is not None and time.time() - lastRecv < OFFLINE_TIMEOUT
+
+    def getOnlineStates(self):
+        return [self.isOnline(idx) for idx in range(len(self.sensorList))]
+
+#--XAKAsensorMgr---------------------------------------------------------------
+    def getLatest(self, idx):
+        """ Return the last frame received from the sensor (or an empty list)."""
+        latest = self.latestList[idx]
+        return latest[1] if latest else []
+
+    def getPort(self, idx):
+        return self.sensorList[idx].serialPort
+
+    def getSensorNum(self):
+        return len(self.sensorList)
+
+#--XAKAsensorMgr---------------------------------------------------------------
+    def isReplay(self):
+        return bool(self.replayList)
+
+    def getReplayRange(self):
+        """ Return the (start, end) recorded time of all the replayed sensors."""
+        if not self.replayList: return None
+        return (min(src.startTime for src in self.replayList),
+                max(src.endTime for src in self.replayList))
+
+    def getReplayTime(self):
+        return self.replayList[0].replayTime() if self.replayList else None
+
+#--XAKAsensorMgr---------------------------------------------------------------
+    def setReplaySpeed(self, speed):
+        for replaySrc in self.replayList: replaySrc.setSpeed(speed)
+
+    def pauseReplay(self, pauseFlag=True):
+        for replaySrc in self.replayList: replaySrc.pause(pauseFlag)
+
+    def seekReplay(self, timestamp):
+        """ Move all the replayed sensors to the same recorded time so they stay
+            synchronized.
+        """
+        startTime, endTime = self.getReplayRange()
+        timestamp = max(startTime, min(endTime, timestamp))
+        for replaySrc in self.replayList: replaySrc.seek(timestamp)
+
+#--XAKAsensorMgr---------------------------------------------------------------
+    def stop(self):
+        """ Stop all the reader threads and close the ports."""
+        self.stopFlag = True
+        with self.lock:
+            for sensor in self.sensorList:
+                try:
+                    sensor.close()
+                except OSError as err:  # serial.SerialException is an OSError.
+                    print("Sensor manager: close port %s error: %s" %(sensor.serialPort, str(err)))
+                if sensor.recorder: sensor.recorder.close()
+
+#-----------------------------------------------------------------------------
+#-----------------------------------------------------------------------------
+def testCase(mode=0):
+    if mode == 0:
+        sensorMgr = XAKAsensorMgr(['SIMU0', 'SIMU1', 'SIMU2'], simuMd=True)
+        sensorMgr.start()
+        for _ in range(3):
+            time.sleep(1)
+            for idx, frameList in enumerate(sensorMgr.poll()):
+                print("Sensor %d: online=%s, new frames=%d" %(
+                    idx, sensorMgr.isOnline(idx), len(frameList)))
+        sensorMgr.stop()
+    else:
+        print("Put your test code here:")
+
+#-----------------------------------------------------------------------------
+if __name__ == '__main__':
+    testCase(mode=0)
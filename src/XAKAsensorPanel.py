@@ -12,52 +12,26 @@
 # License:     YC @ NUS
 #-----------------------------------------------------------------------------
 import wx
-import wx.grid
+import time
 import random
+import numpy as np
 import XAKAsensorGlobal as gv 
+import XAKAsensorHist as xhist
+import XAKAsensorReplay as xreplay
+import XAKAsensorSched as xsched
+import XAKAsensorMetrics as xmetrics
+import XAKAsensorProf as xprof
 
-PERIODIC = 500  # how many ms the periodic call back
-
-# People counting sensor message labels
-DETAIL_LABEL_LIST = [
-    'Seonsor ID: ',
-    'Parameter Count:',
-    'Presence Info:',
-    '00: Sequence',
-    '01: Idx People count',
-    '02: Reserved',
-    '03: Reserved',
-    '04: Human Presence',
-    '05: Program Version',
-    '06: ShortTerm avg',
-    '07: LongTerm avg',
-    '08: EnvMapping rm T',
-    '09: Radar Map rm T',
-    '10: Idx for radar mapping',
-    '11: Num of ppl for radar map',
-    '12: Device ID',
-    '13: Start Rng',
-    '14: End Rng',
-    '15: Reserved',
-    '16: LED on/off',
-    '17: Trans period',
-    '18: Calib factor',
-    '19: Tiled Angle',
-    '20: Radar Height',
-    '21: Avg size',
-    '22: Presence on/off',
-    '23: Reserved',
-    '24: Final ppl num',
-    '25: Radar MP val',
-    '26: Env MP val',
-    '27: serial num_1',
-    '28: serial num_2',
-    '29: serial dist1',
-    '30: serial dist2',
-    '31: Reserved',
-    '32: Reserved',
-    '33: Reserved'
-]
+# History chart zoomable time ranges in seconds (30s ~ 24h).
+CHART_RANGES = (30, 60, 300, 900, 1800, 3600, 3*3600, 6*3600, 12*3600, 24*3600)
+CHART_W, CHART_H = 300, 200 # chart plot area size in pixels.
+CHART_ORG = (40, 240)       # chart axis origin position on the panel.
+PROF_WINDOWS = (10, 30, 60, 120, 300)  # profiling window choices in sec.
+# History chart lines' (Label, color)
+CHART_ITEMS = (('Crt_N', '#0AB1FF'), ('Avg_N', '#CE8349'), ('Fnl_N', '#A5CDAA'))
+
+# People counting sensor message labels (defined in the global config).
+DETAIL_LABEL_LIST = gv.DETAIL_LABEL_LIST
 # Basic information label.
 CHART_LABEL_LIST = [
     'Sensor ID:',   # int
@@ -77,18 +51,74 @@ class PanelPlaceHolder(wx.Panel):
         self.SetBackgroundColour(wx.Colour(200, 210, 200))
         wx.StaticText(self, -1, "Place Holder: Add more sensor here", (20, 20))
 
+#-----------------------------------------------------------------------------
+#-----------------------------------------------------------------------------
+class PanelLazyPage(wx.Panel):
+    """ Notebook page holder which builds its content panel by calling the 
+        <builder>(parent) the first time the page is shown.
+    """
+    def __init__(self, parent, builder):
+        wx.Panel.__init__(self, parent)
+        self.SetBackgroundColour(wx.Colour(200, 210, 200))
+        self.builder = builder
+        self.panel = None       # content panel, None before the page is shown.
+
+#--PanelLazyPage---------------------------------------------------------------
+    def buildPanel(self):
+        """ Build the content panel (if not built) and return it."""
+        if self.panel is None:
+            self.panel = self.builder(self)
+            sizer = wx.BoxSizer(wx.VERTICAL)
+            sizer.Add(self.panel, 1, wx.EXPAND)
+            self.SetSizer(sizer)
+            self.Layout()
+        return self.panel
+
+#-----------------------------------------------------------------------------
+#-----------------------------------------------------------------------------
+def fmtValue(value, floatFmt):
+    """ Return the display text of a value ('--' if None)."""
+    if value is None: return '--'
+    return floatFmt.format(value) if isinstance(value, float) else str(value)
+
+#-----------------------------------------------------------------------------
+#-----------------------------------------------------------------------------
+class LabelUpdater(object):
+    """ Change-only update of a group of wx.StaticText: the new texts are diffed
+        with the displayed ones and only the changed labels are set (SetLabel()
+        re-layouts the parent), in one Freeze()/Thaw() of the <parent>.
+    """
+    def __init__(self, parent, labels) -> None:
+        self.parent = parent
+        self.labels = labels
+        self.texts = [label.GetLabel() for label in labels]
+
+    def update(self, texts):
+        """ Set the changed labels, return the number of labels changed."""
+        changed = [(i, text) for i, text in enumerate(texts) if text != self.texts[i]]
+        if not changed: return 0
+        self.parent.Freeze()
+        for i, text in changed:
+            self.labels[i].SetLabel(text)
+            self.texts[i] = text
+        self.parent.Thaw()
+        return len(changed)
+
 #-----------------------------------------------------------------------------
 #-----------------------------------------------------------------------------
 class PanelBaseInfo(wx.Panel):
     """ Panel to display the basic sensor information and pop up the detail sensor
         information window if the user clicked the <detail> button.
     """
-    def __init__(self, parent):
+    def __init__(self, parent, senIdx=0, chartPanel=None):
         wx.Panel.__init__(self, parent, size=(100, 300))
         self.SetBackgroundColour(wx.Colour(200, 210, 200))
+        self.senIdx = senIdx    # index of the sensor shown on the panel.
+        self.chartPanel = chartPanel # history chart panel of the same sensor.
         self.valueDispList = [] # Follow the sequence in <CHART_LABEL_LIST>
         self.infoWindow = None  # window to show the detail information.
         self.SetSizer(self._buildUISizer())
+        self.labelUpdater = LabelUpdater(self, self.valueDispList)
         self.Show(True)
 
 #--PanelBaseInfo---------------------------------------------------------------
@@ -124,12 +154,13 @@ class PanelBaseInfo(wx.Panel):
     def pauseUpdate(self, event):
         """ Start/Pause the update of the history chart display."""
         buttonLb = event.GetEventObject().GetLabel()
+        chartPanel = self.chartPanel or gv.iChartPanel
         if 'Pause' in buttonLb:
             self.pauseBt.SetLabel('Start >|'.rjust(10))
-            if gv.iChartPanel: gv.iChartPanel.updateDisplay(updateFlag=False)
+            if chartPanel: chartPanel.updateDisplay(updateFlag=False)
         elif 'Start' in buttonLb:
             self.pauseBt.SetLabel('Pause ||'.rjust(10))
-            if gv.iChartPanel: gv.iChartPanel.updateDisplay(updateFlag=True)
+            if chartPanel: chartPanel.updateDisplay(updateFlag=True)
 
 #--PanelBaseInfo---------------------------------------------------------------
     def showDetail(self, event):
@@ -137,10 +168,10 @@ class PanelBaseInfo(wx.Panel):
         if self.infoWindow is None and gv.iDetailPanel is None:
             posF = gv.iMainFrame.GetPosition()
             self.infoWindow = wx.MiniFrame(gv.iMainFrame, -1,
-                'Detail Sensor Informaion', pos=(posF[0]+486, posF[1]),
-                size=(350, 700),
+                'Detail Sensor Informaion [Sensor-%d]' %(self.senIdx+1), 
+                pos=(posF[0]+486, posF[1]), size=(350, 700),
                 style=wx.DEFAULT_FRAME_STYLE)
-            gv.iDetailPanel = PanelDetailInfo(self.infoWindow)
+            gv.iDetailPanel = PanelDetailInfo(self.infoWindow, senIdx=self.senIdx)
             self.infoWindow.Bind(wx.EVT_CLOSE, self.infoWinClose)
             self.infoWindow.Show()
 
@@ -152,10 +183,7 @@ class PanelBaseInfo(wx.Panel):
         if len(dataList) != len(CHART_LABEL_LIST):
             print("PanelBaseInfo: input dataList element missing.")
             return
-        for i, value in enumerate(dataList):
-            dataStr = "{0:.2f}".format(value) if isinstance(
-                value, float) else str(value)
-            self.valueDispList[i].SetLabel("> "+dataStr)
+        self.labelUpdater.update(["> "+fmtValue(value, "{0:.2f}") for value in dataList])
 
 #-----------------------------------------------------------------------------
 #-----------------------------------------------------------------------------
@@ -163,36 +191,78 @@ class PanelChart(wx.Panel):
     """ This function is used to provide lineChart wxPanel to show the history 
         of the people counting sensor's data.
         example: http://manwhocodes.blogspot.com/2013/04/graphics-device-interface-in-wxpython.html
+        Scroll the mouse wheel on the chart to zoom the time range (30s ~ 24h),
+        long ranges are min/max decimated to the chart's pixel width.
     """
-    def __init__(self, parent, recNum=60):
-        """ Init the panel."""
+    def __init__(self, parent, rangeIdx=0, histSize=gv.CHART_HIST_SIZE, metricLabel='chart'):
+        """ Init the panel, <metricLabel> is the panel's paint time metric label."""
         wx.Panel.__init__(self, parent, size=(350, 300))
         self.SetBackgroundColour(wx.Colour(200, 210, 200))
-        self.recNum = recNum
         self.updateFlag = True  # flag whether we update the diaplay area
-        # [(current num, average num, final num)]*60
-        self.data = [(0, 0, 0)] * self.recNum
-        self.times = ('-30s', '-25s', '-20s', '-15s', '-10s', '-5s', '0s')
+        # history of [(current num, average num, final num)] with LOD summaries.
+        self.data = xhist.XAKAlodHistory(capacity=histSize, width=3)
+        self.rangeIdx = rangeIdx # index of the time range in <CHART_RANGES>.
+        self.times = []         # X-axis labels: the samples' clock time of the grids.
+        self.paintTime = 0.0    # sec spent in the paints (read by the refresh scheduler).
+        self.paintHist = xmetrics.REGISTRY.histogram(
+            'ui_paint_seconds', 'Panel paint time.', panel=metricLabel)
+        self.bgBitmap = None    # cached static background layer.
+        # the plot area and the time axis labels are the dynamic parts to redraw.
+        self.plotRect = wx.Rect(CHART_ORG[0]-25, CHART_ORG[1]-CHART_H-3, CHART_W+50, CHART_H+20)
+        self.SetBackgroundStyle(wx.BG_STYLE_PAINT) # no erase, paint is buffered.
         self.Bind(wx.EVT_PAINT, self.OnPaint)
+        self.Bind(wx.EVT_SIZE, self.OnSize)
+        self.Bind(wx.EVT_MOUSEWHEEL, self.OnWheel)
 
 #--PanelChart--------------------------------------------------------------------
-    def appendData(self, numsList):
-        """ Append the data into the data hist list.
+    def appendData(self, numsList, timestamp=None):
+        """ Append the data (received at <timestamp>) into the data history.
             numsList Fmt: [(current num, average num, final num)]
         """
-        self.data.append([min(n, 20)for n in numsList])
-        self.data.pop(0) # remove the first oldest recode in the list.
-    
+        self.data.append(numsList, timestamp)
+
+    def clearData(self):
+        """ Clear the data history (the data time moved back)."""
+        self.data.reset()
+        self.updateDisplay()
+
+#--PanelChart--------------------------------------------------------------------
+    def setTimeRange(self, rangeIdx):
+        """ Set the chart time range to CHART_RANGES[rangeIdx]."""
+        self.rangeIdx = max(0, min(rangeIdx, len(CHART_RANGES)-1))
+        self.bgBitmap = None    # the title changed.
+        self.Refresh(False)
+
+#--PanelChart--------------------------------------------------------------------
+    def _getRangeLabel(self, timeRange):
+        """ Return the time range label, such as '30s', '15m', '3h'."""
+        if timeRange >= 3600: return '%gh' % round(timeRange/3600, 1)
+        if timeRange >= 60: return '%gm' % round(timeRange/60, 1)
+        return '%ds' % timeRange
+
+    def _getTimeLabels(self, endTime, timeRange):
+        """ Return the 7 X-axis labels: the clock time of the grid lines in the
+            range ending at the latest sample's timestamp <endTime>.
+        """
+        fmt = '%H:%M' if timeRange >= 3600 else '%H:%M:%S'
+        return [time.strftime(fmt, time.localtime(endTime - timeRange*i/6))
+                for i in range(6, -1, -1)]
+
+#--PanelChart--------------------------------------------------------------------
+    def OnWheel(self, event):
+        """ Zoom out/in the time range by scrolling the mouse wheel."""
+        self.setTimeRange(self.rangeIdx + (1 if event.GetWheelRotation() < 0 else -1))
+
 #--PanelChart--------------------------------------------------------------------
     def drawBG(self, dc):
-        """ Draw the line chart background."""
+        """ Draw the line chart background (title, axis, grids and legend)."""
         dc.SetPen(wx.Pen('WHITE'))
-        dc.DrawRectangle(1, 1, 300, 200)
+        dc.DrawRectangle(1, 1, CHART_W, CHART_H)
         # DrawTitle:
         font = dc.GetFont()
         font.SetPointSize(8)
         dc.SetFont(font)
-        dc.DrawText('XAKA sensor data', 2, 235)
+        dc.DrawText('XAKA sensor data [%s]' % self._getRangeLabel(CHART_RANGES[self.rangeIdx]), 2, 235)
         # Draw Axis and Grids:(Y-people count X-time)
         dc.SetPen(wx.Pen('#D5D5D5')) #dc.SetPen(wx.Pen('#0AB1FF'))
         dc.DrawLine(1, 1, 300, 1)
@@ -201,24 +271,60 @@ class PanelChart(wx.Panel):
             dc.DrawLine(2, i*10, 300, i*10) # Y-Grid
             dc.DrawLine(2, i*10, -5, i*10)  # Y-Axis
             dc.DrawText(str(i).zfill(2), -25, i*10+5)  # format to ## int, such as 02
-        for i in range(len(self.times)): 
+        for i in range(7):
             dc.DrawLine(i*50, 2, i*50, 200) # X-Grid
             dc.DrawLine(i*50, 2, i*50, -5)  # X-Axis
-            dc.DrawText(self.times[i], i*50-10, -5)
-        
+        # Draw the lines legend.
+        for idx, (label, color) in enumerate(CHART_ITEMS):
+            dc.SetPen(wx.Pen(color, width=2, style=wx.PENSTYLE_SOLID))
+            dc.DrawText(label, idx*60+115, 220)
+            dc.DrawLine(100+idx*60, 212, 100+idx*60+8, 212)
+
+#--PanelChart--------------------------------------------------------------------
+    def getBGBitmap(self):
+        """ Return the cached background layer, render it if it is invalid."""
+        if self.bgBitmap is None:
+            w, h = self.GetClientSize()
+            self.bgBitmap = wx.Bitmap(max(w, 1), max(h, 1))
+            dc = wx.MemoryDC(self.bgBitmap)
+            dc.SetBackground(wx.Brush(self.GetBackgroundColour()))
+            dc.Clear()
+            dc.SetDeviceOrigin(*CHART_ORG)
+            dc.SetAxisOrientation(True, True)
+            self.drawBG(dc)
+            dc.SelectObject(wx.NullBitmap)
+        return self.bgBitmap
+
 #--PanelChart--------------------------------------------------------------------
     def drawFG(self, dc):
         """ Draw the front ground data chart line."""
-        # draw item (Label, color)
-        item = (('Crt_N', '#0AB1FF'), ('Avg_N', '#CE8349'), ('Fnl_N', '#A5CDAA'))
-        for idx in range(3):
-            (label, color) = item[idx]
-            # Draw the line sample.
+        # Get the samples in the time range (decimated to one column per pixel)
+        timeRange = CHART_RANGES[self.rangeIdx]
+        endTime = self.data.lastTime() or time.time()
+        # X-axis labels from the samples' timestamps.
+        self.times = self._getTimeLabels(endTime, timeRange)
+        font = dc.GetFont()
+        font.SetPointSize(7)
+        dc.SetFont(font)
+        for i, label in enumerate(self.times):
+            dc.DrawText(label, i*50-20, -5)
+        times, mins, maxs, decimated = self.data.getWindow(
+            endTime - timeRange, endTime, CHART_W)
+        xList = (times - (endTime - timeRange)) * (CHART_W / timeRange)
+        # clamp the values to the Y-axis range.
+        mins = np.minimum(mins, 20)*10
+        maxs = np.minimum(maxs, 20)*10 if decimated else mins
+        if len(xList) < 3: return
+        for idx, (_, color) in enumerate(CHART_ITEMS):
             dc.SetPen(wx.Pen(color, width=2, style=wx.PENSTYLE_SOLID))
-            dc.DrawText(label, idx*60+115, 220)
-            dc.DrawLine(100+idx*60, 212, 100+idx*60+8, 212)
-            # Create the point list and draw.
-            dc.DrawSpline([(i*5, self.data[i][idx]*10) for i in range(self.recNum)])
+            if decimated:
+                # Draw the min/max envelope of each column as one zigzag line.
+                points = np.empty((len(xList)*2, 2))
+                points[:, 0] = np.repeat(xList, 2)
+                points[0::2, 1], points[1::2, 1] = mins[:, idx], maxs[:, idx]
+                dc.DrawLines(points.tolist())
+            else:
+                dc.DrawSpline(np.column_stack((xList, mins[:, idx])).tolist())
 
 #--PanelChart--------------------------------------------------------------------
     def updateDisplay(self, updateFlag=None):
@@ -227,32 +333,50 @@ class PanelChart(wx.Panel):
             will set the self update flag.
         """
         if updateFlag is None and self.updateFlag: 
-            self.Refresh(True)
-            self.Update()
+            # only invalidate the plot area, the paint is done by the event loop.
+            self.RefreshRect(self.plotRect, eraseBackground=False)
         else:
             self.updateFlag = updateFlag
 
 #--PanelChart--------------------------------------------------------------------
+    def OnSize(self, event):
+        """ Re-render the cached background when the panel is resized."""
+        self.bgBitmap = None
+        self.Refresh(False)
+        event.Skip()
+
+#--PanelChart--------------------------------------------------------------------
+    @xprof.profiled('paintChart')
     def OnPaint(self, event):
-        """ Main panel drawing function."""
-        dc = wx.PaintDC(self)
+        """ Main panel drawing function (double buffered)."""
+        startTime = time.perf_counter()
+        self.drawPanel(wx.AutoBufferedPaintDC(self))
+        paintTime = time.perf_counter() - startTime
+        self.paintTime += paintTime
+        self.paintHist.observe(paintTime)
+
+#--PanelChart--------------------------------------------------------------------
+    def drawPanel(self, dc):
+        """ Draw the whole chart on the dc (paint dc or offscreen memory dc)."""
+        dc.DrawBitmap(self.getBGBitmap(), 0, 0)
         # set the axis orientation area and fmt to up + right direction.
-        dc.SetDeviceOrigin(40, 240)
+        dc.SetDeviceOrigin(*CHART_ORG)
         dc.SetAxisOrientation(True, True)
-        self.drawBG(dc)
         self.drawFG(dc)
 
 #-----------------------------------------------------------------------------
 #-----------------------------------------------------------------------------
 class PanelDetailInfo(wx.Panel):
     """ Panel to show all 35 detail parameters' value read from the sensor."""
-    def __init__(self, parent):
+    def __init__(self, parent, senIdx=0):
         """ Init the panel."""
         wx.Panel.__init__(self, parent, size=(350, 700))
         self.SetBackgroundColour(wx.Colour(200, 200, 200))
         self.parent = parent
+        self.senIdx = senIdx        # index of the sensor shown on the panel.
         self.valueDispList = []     # Label list will display on UI.
         self.SetSizer(self._buildUISizer())
+        self.labelUpdater = LabelUpdater(self, self.valueDispList)
 
 #--PanelDetailInfo----------------------------------------------------------------
     def _buildUISizer(self):
@@ -281,8 +405,7 @@ class PanelDetailInfo(wx.Panel):
         if len(dataList) != len(DETAIL_LABEL_LIST):
             print("PanelDetailInfo: The input data list element missing %d", len(dataList))
             return
-        for i, value in enumerate(dataList): 
-            self.valueDispList[i].SetLabel("{:.3f}".format(value))
+        self.labelUpdater.update(["{:.3f}".format(value) for value in dataList])
 
 #-----------------------------------------------------------------------------
 #-----------------------------------------------------------------------------
@@ -297,13 +420,20 @@ class PanelMap(wx.Panel):
         self.SetBackgroundColour(wx.Colour(200, 210, 200))
         self.bitmap = wx.Bitmap(gv.BGPNG_PATH)
         self.bitmapSZ = self.bitmap.GetSize()
-        self.toggle = True      # Display toggle flag.     
-        self.pplNum = 0         # Number of peopel.  
+        self.toggle = True      # Display toggle flag.
+        self.paintTime = 0.0    # sec spent in the paints (read by the refresh scheduler).     
+        self.paintHist = xmetrics.REGISTRY.histogram(
+            'ui_paint_seconds', 'Panel paint time.', panel='map')
+        self.pplNums = [None]*4 # Number of peopel of each sensor's area.
         # Set high light area position:  
         # |(0, 0) idx=0| (1, 0) idx=1|
         # |(0, 1) idx=2| (1, 1) idx=3|
         self.highLightPos = (0, 0) 
+        self.mapBitmap = None   # cached background + map layer.
+        self.areaBitmap = None  # cached translucent people number areas layer.
+        self.SetBackgroundStyle(wx.BG_STYLE_PAINT) # no erase, paint is buffered.
         self.Bind(wx.EVT_PAINT, self.OnPaint)
+        self.Bind(wx.EVT_SIZE, self.OnSize)
         self.Bind(wx.EVT_LEFT_DOWN, self.OnClick)
         
 #--PanelMap--------------------------------------------------------------------
@@ -331,37 +461,91 @@ class PanelMap(wx.Panel):
         self.Parent.markSensorRow(idx)
 
 #--PanelMap--------------------------------------------------------------------
+    def OnSize(self, event):
+        """ Re-render the cached layers when the panel is resized."""
+        self.mapBitmap = self.areaBitmap = None
+        self.Refresh(False)
+        event.Skip()
+
+#--PanelMap--------------------------------------------------------------------
+    @xprof.profiled('paintMap')
     def OnPaint(self, event):
-        """ Draw the whole panel. """
-        dc = wx.PaintDC(self)
-        dc.DrawBitmap(self.bitmap, 1, 1)
+        """ Draw the whole panel (double buffered). """
+        startTime = time.perf_counter()
+        self.drawPanel(wx.AutoBufferedPaintDC(self))
+        paintTime = time.perf_counter() - startTime
+        self.paintTime += paintTime
+        self.paintHist.observe(paintTime)
+
+#--PanelMap--------------------------------------------------------------------
+    def getMapBitmap(self):
+        """ Return the cached background + map layer (only re-rendered when the
+            panel is resized).
+        """
+        if self.mapBitmap is None:
+            w, h = self.GetClientSize()
+            self.mapBitmap = wx.Bitmap(max(w, 1), max(h, 1))
+            dc = wx.MemoryDC(self.mapBitmap)
+            dc.SetBackground(wx.Brush(self.GetBackgroundColour()))
+            dc.Clear()
+            dc.DrawBitmap(self.bitmap, 1, 1)
+            dc.SelectObject(wx.NullBitmap)
+        return self.mapBitmap
+
+#--PanelMap--------------------------------------------------------------------
+    def getAreaBitmap(self):
+        """ Return the cached transparent layer of the translucent rectangles
+            representing how many people in each area (drawn over the sensors'
+            marks as before), re-rendered when a people number changes.
+        """
+        if self.areaBitmap is None:
+            w, h = self.GetClientSize()
+            self.areaBitmap = wx.Bitmap.FromRGBA(max(w, 1), max(h, 1), 0, 0, 0, 0)
+            dc = wx.MemoryDC(self.areaBitmap)
+            gdc = wx.GCDC(dc)
+            w, h = self.bitmapSZ[0]//2, self.bitmapSZ[1]//2
+            for idx, pplNum in enumerate(self.pplNums):
+                if pplNum is None: continue
+                r, g, b, alph = min(120+pplNum*7, 255), 120, 120, 128 # half transparent alph
+                gdc.SetBrush(wx.Brush(wx.Colour(r, g, b, alph)))
+                gdc.DrawRectangle(1+(idx % 2)*w, 1+(idx//2)*h, w, h)
+            del gdc
+            dc.SelectObject(wx.NullBitmap)
+        return self.areaBitmap
+
+#--PanelMap--------------------------------------------------------------------
+    def drawPanel(self, dc):
+        """ Draw the map on the dc (paint dc or offscreen memory dc)."""
+        dc.DrawBitmap(self.getMapBitmap(), 0, 0)
         # Dc Draw the detection area.
         toggleColor = 'BLUE' if self.toggle else 'RED'
         dc.SetPen(wx.Pen(toggleColor, width=2, style=wx.PENSTYLE_LONG_DASH))
         w, h = self.bitmapSZ[0]//2, self.bitmapSZ[1]//2
         # High Light the user selected area.
         self.drawHighLight(dc, w, h)
-        # Draw the sensor position(a flash rectangle)
+        # Draw the sensor position(a flash rectangle) of each connected sensor.
         dc.SetPen(wx.Pen('BLUE', width=1, style=wx.PENSTYLE_SOLID))
         dc.SetBrush(wx.Brush(wx.Colour(toggleColor)))
-        dc.DrawRectangle(112, 60, 12, 12)
-        # Draw the transparent rectangle to represent how many people in the area.
-        gdc = wx.GCDC(dc)
-        r, g, b, alph = min(120+self.pplNum*7, 255), 120, 120, 128 # half transparent alph
-        gdc.SetBrush(wx.Brush(wx.Colour(r, g, b, alph)))  
-        gdc.DrawRectangle(1, 1, w, h)
+        for idx, pplNum in enumerate(self.pplNums):
+            if pplNum is None: continue
+            x_offset, y_offset = (idx % 2)*w, (idx//2)*h
+            dc.DrawRectangle(112+x_offset, 60+y_offset, 12, 12)
+        # Draw the transparent rectangles to represent how many people in the area.
+        dc.DrawBitmap(self.getAreaBitmap(), 0, 0)
         self.toggle = not self.toggle # set the toggle display flag.
 
 #--PanelMap--------------------------------------------------------------------
     def updateDisplay(self, updateFlag=None):
-        """ Refresh the panel."""
-        self.Refresh(True)
-        self.Update()
+        """ Refresh the panel (the paint is done by the event loop)."""
+        self.Refresh(False)
 
 #--PanelMap--------------------------------------------------------------------
-    def updatePPLNum(self, number):
-        """ Udpate the self people number."""
-        self.pplNum = int(number)
+    def updatePPLNum(self, number, idx=0):
+        """ Udpate the people number of the sensor[idx]'s area."""
+        number = int(number)
+        if self.pplNums[idx] != number:
+            self.pplNums[idx] = number
+            self.areaBitmap = None  # the area layer need to be re-rendered.
 
 #------------------------------------------------------------------------------
 #------------------------------------------------------------------------------
@@ -370,20 +554,21 @@ class PanelMultInfo(wx.Panel):
         situation on the office top-view map, sensor connection status and a 
         wx.Grid to show all the sensors' basic detection data.
     """
-    def __init__(self, parent):
+    def __init__(self, parent, sensorCount=1):
         """ Init the panel."""
         wx.Panel.__init__(self, parent, size=(350, 300))
         self.SetBackgroundColour(wx.Colour(200, 210, 200))
         self.mapPanel = None
-        self.sensorCount = 1    # total sensor count.
-        #self.totPllNum = 0      # total current number of people detected
-        #self.totPllAvg = 0      # total avg number of people detected 
+        self.sensorCount = sensorCount    # total sensor count.
         self.senIndList = []    # sensor indicator list.
+        self.cellTexts = {}     # (row, col): text displayed in the grid.
+        self.pendingCells = {}  # (row, col): text to set at the next refreshGrid().
         self.SetSizer(self.buidUISizer())
 
 #--PanelMultInfo---------------------------------------------------------------
     def buidUISizer(self):
         """ Build the UI with 2 columns.left: Map, right: sensor data Grid."""
+        import wx.grid  # only imported when the page is shown the first time.
         sizer = wx.BoxSizer(wx.HORIZONTAL)
         flagsT, flagsR = wx.RIGHT, wx.RIGHT | wx.CENTER
         sizer.AddSpacer(5)
@@ -403,7 +588,6 @@ class PanelMultInfo(wx.Panel):
             self.senIndList.append(senInd)
             hbox.Add(senInd, flag=flagsR, border=2)
             hbox.AddSpacer(5)
-        self.updateSensorIndicator(0, 1) # update the indicator.
         vsizer.Add(hbox, flag=flagsR, border=2)
         vsizer.AddSpacer(10)
         # Column dix = 1, row idx = 1: Sensor information display Grid.
@@ -432,26 +616,33 @@ class PanelMultInfo(wx.Panel):
         """ Update the sensor indictor's status Green:online, Gray:Offline."""
         color = wx.Colour("GREEN") if state else wx.Colour(120, 120, 120)
         self.senIndList[idx].SetBackgroundColour(color)
+        self.senIndList[idx].Refresh()
 
 #--PanelMultInfo---------------------------------------------------------------
-    def updateSensorGrid(self, idx, dataList):
-        """ Update the sensor Grid's display based on the sensor index. """
-        if len(dataList) != 3:
+    def updateSensorGrid(self, idx, dataList, totList):
+        """ Queue the changes of the sensor Grid's row of the sensor index and of
+            the total row, they are displayed by refreshGrid().
+            dataList Fmt: (sensor ID, current num, average num)
+            totList Fmt: (sensor count, all sensors' current num, average num)
+        """
+        if len(dataList) != 3 or len(totList) != 3:
             print("PanelMultInfo: Sensor Grid fill in data element missing.")
             return
-        # Udpate the grid cells' data.
-        totPllNum = totPllAvg = 0
-        for i, item in enumerate(dataList):
-            dataStr = "{0:.4f}".format(item) if isinstance(
-                item, float) else str(item)
-            self.grid.SetCellValue(idx, i, dataStr)
-            if i == 1: totPllNum += item
-            if i == 2: totPllAvg += item
-        # update the total numbers. 
-        self.grid.SetCellValue(4, 0, str(self.sensorCount))
-        self.grid.SetCellValue(4, 1, "{0:.4f}".format(totPllNum))
-        self.grid.SetCellValue(4, 2, "{0:.4f}".format(totPllAvg))
-        self.grid.ForceRefresh()  # refresh all the grid's cell at one time ?
+        for row, values in ((idx, dataList), (4, totList)):
+            for col, item in enumerate(values):
+                dataStr = fmtValue(item, "{0:.4f}")
+                if self.cellTexts.get((row, col)) != dataStr:
+                    self.pendingCells[(row, col)] = dataStr
+
+    def refreshGrid(self):
+        """ Set all the changed cells in one grid batch (one repaint)."""
+        if not self.pendingCells: return
+        self.grid.BeginBatch()
+        for (row, col), dataStr in self.pendingCells.items():
+            self.grid.SetCellValue(row, col, dataStr)
+        self.grid.EndBatch()    # the grid is refreshed once here.
+        self.cellTexts.update(self.pendingCells)
+        self.pendingCells = {}
         
 #--PanelMultInfo---------------------------------------------------------------
     def markSensorRow(self, idx):
@@ -470,9 +661,10 @@ class PanelMultInfo(wx.Panel):
 #-----------------------------------------------------------------------------
 class PanelSetup(wx.Panel):
     """ Panel to handle the program setup."""
-    def __init__(self, parent):
-        """ Init the panel."""
+    def __init__(self, parent, replayFlag=False):
+        """ Init the panel, the replay controls are enabled in the replay mode."""
         wx.Panel.__init__(self, parent, size=(350, 300))
+        self.seekingFlag = False    # user is dragging the replay position.
         self.SetBackgroundColour(wx.Colour(200, 210, 200))
         flagsT, flagsR = wx.RIGHT, wx.RIGHT | wx.CENTER
         vsizer = wx.BoxSizer(wx.VERTICAL)
@@ -498,7 +690,59 @@ class PanelSetup(wx.Panel):
         hbox1.Add(self.sgSimuBt, flag=flagsR, border=2)
         vsizer.Add(hbox1, flag=flagsR, border=2)
         # Row idx =2: Sensor setting/sensor data send back to server part.
-        pass 
+        vsizer.AddSpacer(5)
+        self.uplinkCB = wx.CheckBox(self, label='Report the sensor data to the server.')
+        self.uplinkCB.SetValue(gv.gUplinkFlag)
+        self.uplinkCB.Bind(wx.EVT_CHECKBOX, self.setUplink)
+        vsizer.Add(self.uplinkCB, flag=flagsT, border=2)
+        vsizer.AddSpacer(5)
+        self.recordCB = wx.CheckBox(self, label='Record the sensor frames (for replay/export).')
+        self.recordCB.SetValue(gv.gRecordFlag and not replayFlag)
+        self.recordCB.Bind(wx.EVT_CHECKBOX, self.setRecording)
+        self.recordCB.Enable(not replayFlag)
+        vsizer.Add(self.recordCB, flag=flagsT, border=2)
+        # Row idx =3: Offline replay of the recorded sensor data.
+        vsizer.AddSpacer(15)
+        vsizer.Add(wx.StaticText(self, label='Offline Replay Setting:'),
+                   flag=flagsT, border=2)
+        vsizer.AddSpacer(10)
+        hbox3 = wx.BoxSizer(wx.HORIZONTAL)
+        self.speedChoice = wx.Choice(self, -1, size=(70, 23), 
+                                     choices=['%dx' % s for s in xreplay.REPLAY_SPEEDS])
+        speedIdx = [s for s in xreplay.REPLAY_SPEEDS if s <= gv.gReplaySpeed]
+        self.speedChoice.SetSelection(max(0, len(speedIdx)-1))
+        self.speedChoice.Bind(wx.EVT_CHOICE, self.setReplaySpeed)
+        hbox3.Add(self.speedChoice, flag=flagsR, border=2)
+        hbox3.AddSpacer(5)
+        self.pauseBt = wx.Button(self, label='Pause', size=(70, 23))
+        self.pauseBt.Bind(wx.EVT_BUTTON, self.pauseReplay)
+        hbox3.Add(self.pauseBt, flag=flagsR, border=2)
+        hbox3.AddSpacer(5)
+        self.replayLb = wx.StaticText(self, label='Replay: -')
+        hbox3.Add(self.replayLb, flag=flagsR, border=2)
+        vsizer.Add(hbox3, flag=flagsR, border=2)
+        vsizer.AddSpacer(5)
+        self.replaySlider = wx.Slider(self, value=0, minValue=0, maxValue=1000, size=(460, 23))
+        self.replaySlider.Bind(wx.EVT_SCROLL_THUMBTRACK, self.onSeekTrack)
+        self.replaySlider.Bind(wx.EVT_SCROLL_CHANGED, self.seekReplay)
+        vsizer.Add(self.replaySlider, flag=flagsR, border=2)
+        for ctrl in (self.speedChoice, self.pauseBt, self.replaySlider):
+            ctrl.Enable(replayFlag)
+        # Row idx =4: Profile the UI handlers (flame graph collapsed stacks).
+        vsizer.AddSpacer(15)
+        vsizer.Add(wx.StaticText(self, label='Performance Profiling:'), flag=flagsT, border=2)
+        vsizer.AddSpacer(10)
+        hbox4 = wx.BoxSizer(wx.HORIZONTAL)
+        self.profChoice = wx.Choice(self, -1, size=(70, 23),
+                                    choices=['%ds' % s for s in PROF_WINDOWS])
+        self.profChoice.SetSelection(PROF_WINDOWS.index(xprof.PROF_WINDOW))
+        hbox4.Add(self.profChoice, flag=flagsR, border=2)
+        hbox4.AddSpacer(5)
+        self.profBt = wx.Button(self, label='Start profiling.', size=(150, 23))
+        self.profBt.Bind(wx.EVT_BUTTON, self.startProfiling)
+        hbox4.Add(self.profBt, flag=flagsR, border=2)
+        vsizer.Add(hbox4, flag=flagsR, border=2)
+        self.setProfilingState(xprof.PROFILER.running)
         self.SetSizer(vsizer)
 
 #--PanelSetup------------------------------------------------------------------
@@ -512,6 +756,110 @@ class PanelSetup(wx.Panel):
         """Call the mainFrame's <sigaSimuInput> fill in the simulation siguature."""
         if gv.iMainFrame: gv.iMainFrame.sigaSimuInput(event)
 
+#--PanelSetup------------------------------------------------------------------
+    def setUplink(self, event):
+        """ Start/stop reporting the sensor data to the selected server."""
+        ServerName = self.serverchoice.GetString(self.serverchoice.GetSelection())
+        if gv.iMainFrame: gv.iMainFrame.setUplink(ServerName, self.uplinkCB.GetValue())
+
+#--PanelSetup------------------------------------------------------------------
+    def setRecording(self, event):
+        """ Start/stop recording all the sensors' frames."""
+        if gv.iMainFrame: gv.iMainFrame.setRecording(self.recordCB.GetValue())
+
+#--PanelSetup------------------------------------------------------------------
+    def setReplaySpeed(self, event):
+        speed = xreplay.REPLAY_SPEEDS[self.speedChoice.GetSelection()]
+        if gv.iMainFrame: gv.iMainFrame.sensorMgr.setReplaySpeed(speed)
+
+    def pauseReplay(self, event):
+        """ Pause/resume the replay of all the sensors."""
+        pauseFlag = self.pauseBt.GetLabel() == 'Pause'
+        if gv.iMainFrame: gv.iMainFrame.sensorMgr.pauseReplay(pauseFlag)
+        self.pauseBt.SetLabel('Resume' if pauseFlag else 'Pause')
+
+#--PanelSetup------------------------------------------------------------------
+    def onSeekTrack(self, event):
+        self.seekingFlag = True
+
+    def seekReplay(self, event):
+        """ Move the replay to the slider position in the recorded time range."""
+        self.seekingFlag = False
+        if not gv.iMainFrame: return
+        sensorMgr = gv.iMainFrame.sensorMgr
+        startTime, endTime = sensorMgr.getReplayRange()
+        pos = self.replaySlider.GetValue() / self.replaySlider.GetMax()
+        sensorMgr.seekReplay(startTime + pos*(endTime - startTime))
+
+#--PanelSetup------------------------------------------------------------------
+    def startProfiling(self, event):
+        """ Profile the UI handlers for the selected time window."""
+        window = PROF_WINDOWS[self.profChoice.GetSelection()]
+        if gv.iMainFrame and gv.iMainFrame.startProfiling(window):
+            self.setProfilingState(True)
+
+    def setProfilingState(self, running):
+        self.profBt.SetLabel('Profiling ...' if running else 'Start profiling.')
+        self.profBt.Enable(not running)
+        self.profChoice.Enable(not running)
+
+#--PanelSetup------------------------------------------------------------------
+    def updateReplayState(self, crtTime, startTime, endTime):
+        """ Show the replayed time and position (not moved while dragging)."""
+        crtTime = max(startTime, min(endTime, crtTime))
+        def fmtTime(sec): return '%d:%02d:%02d' %(sec//3600, sec//60 % 60, sec % 60)
+        self.replayLb.SetLabel('Replay: %s / %s' %(fmtTime(int(crtTime - startTime)),
+                                                  fmtTime(int(endTime - startTime))))
+        if self.seekingFlag or endTime <= startTime: return
+        pos = (crtTime - startTime) / (endTime - startTime)
+        self.replaySlider.SetValue(int(pos * self.replaySlider.GetMax()))
+
+#-----------------------------------------------------------------------------
+#-----------------------------------------------------------------------------
+class PanelDiagnostics(wx.Panel):
+    """ Panel to show the performance metrics (serial read, decode, queues, UI
+        update/paint time) and export them in the Prometheus text format.
+    """
+    def __init__(self, parent):
+        """ Init the panel."""
+        wx.Panel.__init__(self, parent, size=(350, 300))
+        self.SetBackgroundColour(wx.Colour(200, 210, 200))
+        self.lastText = None    # text shown, the control is only set if changed.
+        vsizer = wx.BoxSizer(wx.VERTICAL)
+        vsizer.AddSpacer(5)
+        hbox = wx.BoxSizer(wx.HORIZONTAL)
+        hbox.Add(wx.StaticText(self, label='Performance Metrics (timings in ms):'),
+                 flag=wx.RIGHT | wx.CENTER, border=2)
+        hbox.AddSpacer(10)
+        self.exportBt = wx.Button(self, label='Export metrics.', size=(120, 23))
+        self.exportBt.Bind(wx.EVT_BUTTON, self.exportMetrics)
+        hbox.Add(self.exportBt, flag=wx.RIGHT | wx.CENTER, border=2)
+        vsizer.Add(hbox, flag=wx.RIGHT, border=2)
+        vsizer.AddSpacer(5)
+        self.metricsTxt = wx.TextCtrl(self, style=wx.TE_MULTILINE | wx.TE_READONLY | wx.HSCROLL)
+        self.metricsTxt.SetFont(wx.Font(9, wx.FONTFAMILY_TELETYPE, wx.FONTSTYLE_NORMAL,
+                                        wx.FONTWEIGHT_NORMAL))
+        vsizer.Add(self.metricsTxt, 1, flag=wx.EXPAND)
+        self.SetSizer(vsizer)
+
+#--PanelDiagnostics------------------------------------------------------------
+    def updateDisplay(self, lines=None):
+        """ Show the metrics summary lines (default: the process registry's)."""
+        text = '\n'.join(xmetrics.REGISTRY.summaryLines() if lines is None else lines)
+        if text == self.lastText: return
+        self.lastText = text
+        self.metricsTxt.ChangeValue(text)
+
+#--PanelDiagnostics------------------------------------------------------------
+    def exportMetrics(self, event):
+        """ Save the metrics Prometheus text dump to the file selected."""
+        dlg = wx.FileDialog(self, 'Export the metrics', defaultFile='xaka_metrics.prom',
+                            wildcard='Prometheus text (*.prom)|*.prom|All files (*.*)|*.*',
+                            style=wx.FD_SAVE | wx.FD_OVERWRITE_PROMPT)
+        if dlg.ShowModal() == wx.ID_OK:
+            xmetrics.REGISTRY.writeText(dlg.GetPath())
+        dlg.Destroy()
+
 #-----------------------------------------------------------------------------
 #-----------------------------------------------------------------------------
 class LineChartExample(wx.Frame):
@@ -521,20 +869,30 @@ class LineChartExample(wx.Frame):
         panel = wx.Panel(self, -1)
         panel.SetBackgroundColour('WHITE')
         hbox = wx.BoxSizer(wx.HORIZONTAL)
-        self.linechart = PanelChart(panel, recNum=60)
+        self.linechart = PanelChart(panel)
         hbox.Add(self.linechart)
         panel.SetSizer(hbox)
         self.Centre()
         self.Show(True)
-        self.timer = wx.Timer(self)
-        self.Bind(wx.EVT_TIMER, self.periodic)
-        self.timer.Start(PERIODIC)  # every 500 ms
+        # the samples are added at the poll rate, the chart repainted at the
+        # scheduler's rate.
+        self.scheduler = xsched.XAKArefreshScheduler()
+        self.dataTimer = wx.Timer(self)
+        self.Bind(wx.EVT_TIMER, self.periodic, self.dataTimer)
+        self.dataTimer.Start(int(xsched.POLL_INTERVAL*1000))
+        self.refreshTimer = wx.Timer(self)
+        self.Bind(wx.EVT_TIMER, self.onRefresh, self.refreshTimer)
+        self.refreshTimer.StartOnce(int(self.scheduler.nextDelay()*1000))
 
     def periodic(self, event):
-        num = random.randint(0, 20)
-        self.linechart.addData(
+        self.linechart.appendData(
             (random.randint(0, 20), random.randint(0, 20), random.randint(0, 20)))
-        self.linechart.Refresh(True)
+
+    def onRefresh(self, event):
+        cost, self.linechart.paintTime = self.linechart.paintTime, 0.0
+        self.linechart.updateDisplay()
+        delay = self.scheduler.nextDelay(cost, visible=not self.IsIconized())
+        self.refreshTimer.StartOnce(int(delay*1000))
 
 #app = wx.App()
 #LineChartExample(None, -1, 'A line chart')
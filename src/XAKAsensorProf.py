@@ -0,0 +1,208 @@
+#!/usr/bin/python
+#-----------------------------------------------------------------------------
+# Name:        XAKAsensorProf.py
+#
+# Purpose:     This module is the opt-in sampling profiler of the UI handlers:
+#              the handlers decorated by profiled() (the poll/refresh timer call
+#              backs, the panels' OnPaint) are sampled by a background thread for
+#              a bounded window and the stacks are saved in the collapsed
+#              format read by the flame graph tools (flamegraph.pl, speedscope):
+#                  periodic;XAKAsensorRd.py:periodic;XAKAsensorMgr.py:poll 42
+#              When the profiler is off a decorated handler only costs one flag
+#              check. Start it from the Setting page or by the environment:
+#                  XAKA_PROFILE=30 python XAKAsensorRd.py
+#
+# Author:      Yuancheng Liu
+#
+# Created:     29/01/2022
+# version:     v_2.1
+# Copyright:   YC has not added.
+# License:     YC has not added.
+#-----------------------------------------------------------------------------
+
+import os
+import sys
+import time
+import threading
+from functools import wraps
+
+PROF_ENV = 'XAKA_PROFILE'   # environment variable: sec of profiling at start.
+PROF_WINDOW = 30            # default sec of a profiling window.
+MAX_WINDOW = 600            # max sec of a profiling window.
+SAMPLE_INTERVAL = 0.005     # sec between 2 stack samples.
+MAX_DEPTH = 64              # max frames kept in a sampled stack.
+
+#-----------------------------------------------------------------------------
+def envWindow(environ=os.environ):
+    """ Return the profiling window (sec) set by the <PROF_ENV> environment
+        variable ('1'/'on': the default window), None if not set.
+    """
+    value = environ.get(PROF_ENV, '').strip().lower()
+    if value in ('', '0', 'off', 'no', 'false'): return None
+    if value in ('1', 'on', 'yes', 'true'): return PROF_WINDOW
+    try:
+        return min(MAX_WINDOW, max(1.0, float(value)))
+    except ValueError:
+        print("Profiler: invalid %s value %s" %(PROF_ENV, value))
+        return None
+
+#-----------------------------------------------------------------------------
+def frameName(frame):
+    """ Return the collapsed stack name 'file:function' of the frame."""
+    code = frame.f_code
+    return '%s:%s' %(os.path.basename(code.co_filename), code.co_name)
+
+#-----------------------------------------------------------------------------
+#-----------------------------------------------------------------------------
+class XAKAsampleProfiler(object):
+    """ Sampling profiler of the marked sections, usage example:
+            @profiled('periodic')
+            def periodic(self, event): ...
+            PROFILER.start(30, outDir, callback=onDone)   # or PROFILER.stop()
+        The sampler thread reads the stack of the thread running a section
+        every <interval> sec and counts the stacks from the section's root.
+    """
+    def __init__(self, interval=SAMPLE_INTERVAL) -> None:
+        self.interval = interval
+        self.running = False    # read by the decorated handlers (the only cost when off).
+        self.active = None      # (section name, thread id, root frame) being run.
+        self.stacks = {}        # collapsed stack: sample count.
+        self.stats = dict.fromkeys(('samples', 'idleSamples'), 0)
+        self.outPath = None
+        self.callback = None
+        self.sampleThread = None
+        self.terminate = threading.Event()
+
+#--XAKAsampleProfiler----------------------------------------------------------
+    def start(self, window=PROF_WINDOW, outDir='.', callback=None):
+        """ Sample the sections for <window> sec then save the collapsed stacks
+            in <outDir>, the optional callback(outPath) is called in the sampler
+            thread after saving. Return False if already running.
+        """
+        if self.running: return False
+        self.stacks = {}
+        self.stats = dict.fromkeys(('samples', 'idleSamples'), 0)
+        self.outPath = os.path.join(outDir, 'xaka_%s.folded' % time.strftime('%Y%m%d_%H%M%S'))
+        self.callback = callback
+        self.terminate.clear()
+        self.running = True
+        self.sampleThread = threading.Thread(target=self._sampleLoop, args=(window,),
+                                             daemon=True, name='XAKAprofiler')
+        self.sampleThread.start()
+        return True
+
+    def stop(self, timeout=2):
+        """ Stop the window now (the samples are saved)."""
+        self.terminate.set()
+        if self.sampleThread and self.sampleThread is not threading.current_thread():
+            self.sampleThread.join(timeout)
+
+#--XAKAsampleProfiler----------------------------------------------------------
+    def enter(self, name, frame):
+        """ Mark the section start (called by the profiled() wrapper)."""
+        if self.active is None:
+            self.active = (name, threading.get_ident(), frame)
+            return True
+        return False    # nested section: sampled as a part of the outer one.
+
+    def leave(self):
+        self.active = None
+
+#--XAKAsampleProfiler----------------------------------------------------------
+    def _sampleLoop(self, window):
+        endTime = time.time() + window
+        while not self.terminate.wait(self.interval) and time.time() < endTime:
+            self._sample()
+        self.running = False
+        self.active = None
+        self.save()
+        if self.callback: self.callback(self.outPath)
+
+    def _sample(self):
+        """ Count the current stack of the active section."""
+        active = self.active
+        if active is None:
+            self.stats['idleSamples'] += 1
+            return
+        name, threadId, rootFrame = active
+        frame = sys._current_frames().get(threadId)
+        stack = []
+        while frame is not None and frame is not rootFrame and len(stack) < MAX_DEPTH:
+            stack.append(frameName(frame))
+            frame = frame.f_back
+        if frame is not rootFrame: return   # the section ended meanwhile.
+        key = ';'.join([name] + stack[::-1])
+        self.stacks[key] = self.stacks.get(key, 0) + 1
+        self.stats['samples'] += 1
+
+#--XAKAsampleProfiler----------------------------------------------------------
+    def dumpCollapsed(self):
+        """ Return the collapsed stacks text (one 'frame;frame;... count' line)."""
+        return ''.join('%s %d\n' %(key, num) for key, num in sorted(self.stacks.items()))
+
+    def save(self, filePath=None):
+        filePath = filePath or self.outPath
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(filePath)), exist_ok=True)
+            with open(filePath, 'w') as fh:
+                fh.write(self.dumpCollapsed())
+            print("Profiler: %d samples saved in %s" %(self.stats['samples'], filePath))
+        except OSError as err:
+            print("Profiler: save file %s error: %s" %(filePath, str(err)))
+
+    def getStats(self):
+        stats = dict(self.stats)
+        stats.update({'running': self.running, 'stacks': len(self.stacks)})
+        return stats
+
+# process wide profiler of the UI handlers.
+PROFILER = XAKAsampleProfiler()
+
+#-----------------------------------------------------------------------------
+def profiled(name):
+    """ Decorator to mark the function as a profiled section <name>."""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not PROFILER.running: return func(*args, **kwargs)
+            if not PROFILER.enter(name, sys._getframe()): return func(*args, **kwargs)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                PROFILER.leave()
+        return wrapper
+    return decorator
+
+#-----------------------------------------------------------------------------
+#-----------------------------------------------------------------------------
+def testCase(mode=0):
+    if mode == 0:
+        import tempfile
+        @profiled('periodic')
+        def periodic():
+            sum(i*i for i in range(200000))
+            sorted(str(i) for i in range(50000))
+        # overhead of the decorated call when the profiler is off.
+        def plain(): return None
+        wrapped = profiled('noop')(plain)
+        startTime = time.perf_counter()
+        for _ in range(100000): plain()
+        plainCost = time.perf_counter() - startTime
+        startTime = time.perf_counter()
+        for _ in range(100000): wrapped()
+        print("profiler off overhead: %.3f us per call" %(
+            (time.perf_counter() - startTime - plainCost) * 10))
+        PROFILER.start(1, tempfile.gettempdir())
+        endTime = time.time() + 1.2
+        while time.time() < endTime:
+            periodic()
+            time.sleep(0.01)
+        PROFILER.stop()
+        print(PROFILER.getStats())
+        print(''.join(PROFILER.dumpCollapsed().splitlines(True)[:5]))
+    else:
+        print("Put your test code here:")
+
+#-----------------------------------------------------------------------------
+if __name__ == '__main__':
+    testCase(mode=0)
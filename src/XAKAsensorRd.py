@@ -14,126 +14,347 @@
 # License:     YC @ NUS
 #-----------------------------------------------------------------------------
 
+import time
+START_TIME = time.perf_counter()    # start time used by the startup time mode.
+import sys
+import json
+import argparse
+import threading
 import wx # use wx to build the UI.
 
 #In this project we remove the firmware attestation part.
-#import firmwMsgMgr
-#import firmwTLSclient as SSLC
-import XAKAsensorComm as xcomm
+import XAKAsensorMgr as xmgr
+import XAKAsensorStats as xstats
+import XAKAsensorSched as xsched
+import XAKAsensorMetrics as xmetrics
+import XAKAsensorProf as xprof
 import XAKAsensorGlobal as gv
 import XAKAsensorPanel as xsp
 
-PERIODIC = 500 # how many ms the periodic call back
+MAP_BLINK_INTERVAL = 0.5 # sec between 2 refreshes (blinks) of the top view map.
+DIAG_INTERVAL = 1.0     # sec between 2 refreshes of the diagnostics page.
 SENSOR_TYPE = 'XKAK_PPL_COUNT' # defualt sensor type.
+STARTUP_TIMEOUT = 30 # max sec to wait the first sensor data in the startup time mode.
+CHART_PARAMS = (4, 9, 27) # frame indexes of the history chart lines.
 
 #-----------------------------------------------------------------------------
 #-----------------------------------------------------------------------------
 class SensorReaderFrame(wx.Frame):
     """ XAKA people counting sensor reader with sensor registration function. """
-    def __init__(self, parent, id, title):
-        """ Init the UI and all parameters """
+    def __init__(self, parent, id, title, startupTimes=None):
+        """ Init the UI and all parameters. If the <startupTimes> dict is given,
+            the startup steps' time (ms) are filled in and the app exits when the
+            first sensor data is shown.
+        """
         wx.Frame.__init__(self, parent, id, title, size=(500, 360))
+        self.startupTimes = startupTimes
         self.SetIcon(wx.Icon(gv.ICON_PATH))
         self.SetBackgroundColour(wx.Colour(200, 210, 200))
         gv.iMainFrame = self
+        # Init the sensors acquisition manager (one reader thread per sensor).
+        self.sensorMgr = xmgr.XAKAsensorMgr(gv.SENSOR_COMMS, simuMd=gv.gSimulationMode,
+                                            recDir=gv.REC_DIR if gv.gRecordFlag else None,
+                                            replayPath=gv.gReplayPath,
+                                            replaySpeed=gv.gReplaySpeed)
         # Init parameters.
+        self.sensorNum = self.sensorMgr.getSensorNum()
+        # rolling stats of the sensors' parameters shown by the UI/reported to the hub.
+        self.statsEngine = xstats.XAKAstatsEngine(self.sensorNum)
         self.activeFlag = True     # whether we active the sensor data reading.
         self.senId = self.version = ''
+        self.regFuture = None   # sensor registration request waiting the hub reply.
+        self.regSeq = 0         # registration number, the late replies are ignored.
         self.signature = '44c88023c0a6da30e78e1e699d01436cbf987f06213d15b64e0a972952fbd0a3ec578d33a67d34024e8851b776d7af7999f5f175c896c363ed4a93f6cd104a454eb8a48ab32da07489c1daee6614a45561c8823e462e72ce458a78e3f35f68ae157a027d165eb7dec9c8910af34723a9e14132943a9788bfbdc2c904d2207c6a36e92e647c3b450d14697856c2906f94b122a3a01966d48f72f3b29f8472a24813f471be288522ee68ad7de57ec9551722aa9dafdba991516535e618c8a3a94907ca7a46ff11e27bb254497a306685066a86c34eaa572cbf4ab44eaef0829ff1d6f0490ab8d0dece01cf031eda5a1f2690e8579b4cad5cf650846ed6bd4085db' 
         # Init the UI.
         self.SetSizer(self.buildUISizer())
         self.statusbar = self.CreateStatusBar(1)
-        self.statusbar.SetStatusText('Register the connected sensor first.')
-        # Init the SSL client to TLS connection.
-        #self.sslClient = SSLC.TLS_sslClient(self)  # ssl client to send the sensor signature.
-        # Init the message manager.
-        #self.msgMgr = firmwMsgMgr.msgMgr(self)  # create the message manager.
-        # Init the serial reader
-        self.serComm = xcomm.XAKAsensorComm(gv.DE_COMM, simuMd=gv.gSimulationMode) # serial comm handler used to read the sensor data. 
-        self.serComm.setSerialComm(searchFlag=True)
-        # Init the recall future.
+        self.statusbar.SetStatusText('Connecting to the sensors ...')
+        self.dataLists = [[] for _ in range(self.sensorNum)] # last frame of each sensor.
+        self.onlineStates = [False] * self.sensorNum
+        self.hubSessions = {}   # server name: persistent hub session.
+        self.uplink = None  # sensor data uplink to the hub.
+        if gv.gUplinkFlag: self.setUplink(list(gv.RG_SERVER_CHOICE.keys())[0], True)
+        # Search and connect the sensors in the background, the window is shown
+        # without waiting the ports scan.
+        threading.Thread(target=self.connectSensors, daemon=True).start()
+        # Init the recall future: the frames are drained at the poll rate and the
+        # widgets refreshed at the scheduler's rate.
+        self.dirtySensors = set()   # index of the sensors with new data to display.
+        self.mapRefreshTime = 0
+        self.diagRefreshTime = 0
+        self.scheduler = xsched.XAKArefreshScheduler()
+        # UI thread metrics shown on the Diagnostics page.
+        self.pollHist = xmetrics.REGISTRY.histogram(
+            'ui_poll_seconds', 'Sensor frames poll and history update time.')
+        self.uiUpdateHist = xmetrics.REGISTRY.histogram(
+            'ui_update_seconds', 'Widgets update time of a UI refresh.')
+        self.uiFpsGauge = xmetrics.REGISTRY.gauge('ui_refresh_fps', 'UI refresh rate target.')
         self.timer = wx.Timer(self)
-        self.Bind(wx.EVT_TIMER, self.periodic)
-        self.timer.Start(PERIODIC)  # every 500 ms
+        self.Bind(wx.EVT_TIMER, self.periodic, self.timer)
+        self.timer.Start(int(xsched.POLL_INTERVAL*1000))
+        self.refreshTimer = wx.Timer(self)
+        self.Bind(wx.EVT_TIMER, self.onRefresh, self.refreshTimer)
+        self.refreshTimer.StartOnce(int(self.scheduler.nextDelay()*1000))
         # Add Close event here.
         self.Bind(wx.EVT_CLOSE, self.OnClose)
+        # Profile the UI handlers at start if set by the environment variable.
+        profWindow = xprof.envWindow()
+        if profWindow: self.startProfiling(profWindow)
 
 #--SensorReaderFrame-----------------------------------------------------------
     def buildUISizer(self):
         """ Init the frame user interface and return the sizer."""
         sizer = wx.BoxSizer(wx.HORIZONTAL)    
         nb = wx.Notebook(self)
-        # Set the NoteBook page 1(sensor 1)
-        ntbgPage1 = wx.Panel(nb)
-        hboxPg1= wx.BoxSizer(wx.HORIZONTAL)
-        self.linechart = xsp.PanelChart(ntbgPage1, recNum=60)
-        gv.iChartPanel = self.linechart
-        hboxPg1.Add(self.linechart, 1)
-        hboxPg1.AddSpacer(5)
-        self.infoPanel = xsp.PanelBaseInfo(ntbgPage1)
-        hboxPg1.Add(self.infoPanel,1)
-        ntbgPage1.SetSizer(hboxPg1)
-        nb.AddPage(ntbgPage1, "Sensor-1")
-        # Set the NoteBook page 2(sensor N)
-        ntbgPage2 = xsp.PanelPlaceHolder(nb)
-        nb.AddPage(ntbgPage2, "Sensor-2")
-        # Set the NoteBook page 3(All sensor information.)
-        self.multiInfoPg =xsp.PanelMultInfo(nb)
-        nb.AddPage(self.multiInfoPg, "Multi-Info")
-        # Set the NoteBook sage 4(Setting)
-        self.setupPanel = xsp.PanelSetup(nb)
-        nb.AddPage(self.setupPanel, "Setting")
+        # Set the NoteBook page 1~N (one page per sensor)
+        self.chartList, self.infoList = [], []
+        for idx in range(self.sensorNum):
+            ntbgPage = wx.Panel(nb)
+            hboxPg = wx.BoxSizer(wx.HORIZONTAL)
+            linechart = xsp.PanelChart(ntbgPage, metricLabel='chart%d' %(idx+1))
+            hboxPg.Add(linechart, 1)
+            hboxPg.AddSpacer(5)
+            infoPanel = xsp.PanelBaseInfo(ntbgPage, senIdx=idx, chartPanel=linechart)
+            hboxPg.Add(infoPanel, 1)
+            ntbgPage.SetSizer(hboxPg)
+            nb.AddPage(ntbgPage, "Sensor-%d" %(idx+1))
+            self.chartList.append(linechart)
+            self.infoList.append(infoPanel)
+        if self.chartList: gv.iChartPanel = self.chartList[0]
+        # Set the NoteBook page N+1(place holder to add more sensors)
+        if self.sensorNum < xmgr.MAX_SENSOR_NUM:
+            nb.AddPage(xsp.PanelPlaceHolder(nb), "Sensor-%d" %(self.sensorNum+1))
+        # Set the NoteBook page (All sensor information.) built when first shown.
+        self.multiInfoPage = xsp.PanelLazyPage(nb, self.buildMultiInfoPanel)
+        nb.AddPage(self.multiInfoPage, "Multi-Info")
+        # Set the NoteBook sage 4(Setting) built when first shown.
+        self.setupPage = xsp.PanelLazyPage(nb, lambda parent: xsp.PanelSetup(
+            parent, replayFlag=self.sensorMgr.isReplay()))
+        nb.AddPage(self.setupPage, "Setting")
+        # Set the NoteBook page (performance metrics) built when first shown.
+        self.diagPage = xsp.PanelLazyPage(nb, xsp.PanelDiagnostics)
+        nb.AddPage(self.diagPage, "Diagnostics")
+        nb.Bind(wx.EVT_NOTEBOOK_PAGE_CHANGED, self.OnPageChanged)
         sizer.Add(nb, 1, wx.EXPAND)
         return sizer
 
+#--SensorReaderFrame-----------------------------------------------------------
+    def buildMultiInfoPanel(self, parent):
+        """ Build the Multi-Info panel and fill in the current sensors' state."""
+        multiInfoPg = xsp.PanelMultInfo(parent, sensorCount=self.sensorNum)
+        for idx, dataList in enumerate(self.dataLists):
+            multiInfoPg.updateSensorIndicator(idx, self.onlineStates[idx])
+            if not dataList: continue
+            self.fillSensorGrid(multiInfoPg, idx)
+            gv.iMapPanel.updatePPLNum(dataList[27], idx=idx)
+        multiInfoPg.refreshGrid()
+        return multiInfoPg
+
+#--SensorReaderFrame-----------------------------------------------------------
+    def fillSensorGrid(self, multiInfoPg, idx):
+        """ Fill the sensor's row (ID, people count, final people count rolling
+            mean) and the total row (all the sensors' aggregate) of the grid.
+        """
+        engine, aggIdx = self.statsEngine, xstats.AGG_IDX
+        multiInfoPg.updateSensorGrid(
+            idx, (self.dataLists[idx][0], engine.getLatest(idx, 4), engine.getMean(idx, 27)),
+            (self.sensorNum, engine.getLatest(aggIdx, 4), engine.getMean(aggIdx, 27)))
+
+#--SensorReaderFrame-----------------------------------------------------------
+    def OnPageChanged(self, event):
+        """ Build the lazy notebook page the first time it is shown and update the
+            widgets of the shown page (not updated while hidden).
+        """
+        pageIdx = event.GetSelection()
+        page = event.GetEventObject().GetPage(pageIdx)
+        if isinstance(page, xsp.PanelLazyPage): page.buildPanel()
+        if pageIdx < self.sensorNum:
+            self.refreshSensorPage(pageIdx)
+        elif page is self.multiInfoPage:
+            self.refreshMultiInfo()
+        elif page is self.diagPage:
+            self.refreshDiagnostics()
+        event.Skip()
+
+#--SensorReaderFrame-----------------------------------------------------------
+    def refreshSensorPage(self, idx):
+        """ Update the sensor[idx] page's info labels and history chart."""
+        dataList = self.dataLists[idx]
+        if not dataList: return
+        infoList = (dataList[0], self.sensorMgr.getPort(idx), dataList[3],
+                    dataList[4], dataList[9], dataList[27])
+        self.infoList[idx].updateData(infoList)
+        self.chartList[idx].updateDisplay()
+
+    def refreshMultiInfo(self):
+        """ Update the Multi-Info page's grid (only the changed cells) and map."""
+        multiInfoPg = self.multiInfoPage.panel
+        if multiInfoPg is None: return
+        for idx, dataList in enumerate(self.dataLists):
+            if dataList: self.fillSensorGrid(multiInfoPg, idx)
+        multiInfoPg.refreshGrid()
+        gv.iMapPanel.updateDisplay()
+
+    def refreshDiagnostics(self):
+        """ Update the Diagnostics page's metrics."""
+        self.diagRefreshTime = time.time()
+        self.uiFpsGauge.set(round(self.scheduler.getFps(), 2))
+        if self.diagPage.panel: self.diagPage.panel.updateDisplay()
+
+#--SensorReaderFrame-----------------------------------------------------------
+    def connectSensors(self):
+        """ Background thread: search the sensor ports and start the readers."""
+        self.sensorMgr.start(searchFlag=True)
+        wx.CallAfter(self.onSensorsConnected)
+
+    def onSensorsConnected(self):
+        if not self: return # frame closed during the connection.
+        self.markStartup('sensorsConnected')
+        self.statusbar.SetStatusText('Replay the recorded sensor data.' if self.sensorMgr.isReplay()
+                                     else 'Register the connected sensor first.')
+
+#--SensorReaderFrame-----------------------------------------------------------
+    def markStartup(self, step):
+        """ Record the ms from the program start to the startup <step>."""
+        if self.startupTimes is None or step in self.startupTimes: return
+        self.startupTimes[step] = round((time.perf_counter() - START_TIME)*1000, 1)
+        if step == 'firstData': self.Close()
+
+#--SensorReaderFrame-----------------------------------------------------------
+    def getHubSession(self, ServerName):
+        """ Return the persistent session to the server (connected in the
+            background at the first use).
+        """
+        if ServerName not in self.hubSessions:
+            import XAKAsensorHubClient as xclient # loaded at the first hub use.
+            session = xclient.XAKAhubSession(gv.RG_SERVER_CHOICE[ServerName], room=gv.HUB_ROOM)
+            session.start()
+            self.hubSessions[ServerName] = session
+        return self.hubSessions[ServerName]
+
 #--SensorReaderFrame-----------------------------------------------------------
     def logtoServer(self, ServerName):
-        """ Login to the server and register the sensor."""
-        try:
-            # Connect to the selected server. 
-            ip, port = gv.RG_SERVER_CHOICE[ServerName]
-            self.sslClient.connect((ip, port))
-            # Send SSL connection request cmd and get response.
-            self.sslClient.send(self.msgMgr.dumpMsg(action='CR'))
-            dataDict = self.msgMgr.loadMsg(self.sslClient.recv(gv.BUFFER_SIZE))
-            if dataDict['act'] == 'HB' and dataDict['lAct'] == 'CR' and dataDict['state']:
-                print("SConnetion: Connect to the server succesfully.")
-            else:
-                print("SConnetion: Connection request denied by server.")
-                return
-            print("SConnetion: start register to server")
-            # Register the sensor.(Temporary hard code the sigature for test.)
-            data = (self.senId, SENSOR_TYPE, self.version, self.signature)
-            self.sslClient.send(self.msgMgr.dumpMsg(action='RG', dataArgs=data))
-            dataDict = self.msgMgr.loadMsg(self.sslClient.recv(gv.BUFFER_SIZE))
-            if dataDict['act'] == 'HB' and dataDict['lAct'] == 'RG' and dataDict['state']:
-                self.statusbar.SetStatusText("Sensor registration success.")
-                self.activeFlag = True
-            else:
-                self.statusbar.SetStatusText("Sensor registration fail.")
-                wx.MessageBox('Sensor registration Fail', 'Caution',
-                    wx.OK | wx.ICON_ERROR)
-            # Logout after resigtered.
-            datab = self.msgMgr.dumpMsg(action='LO')
-            self.sslClient.send(datab)
-            self.sslClient.close()
-        except:
-            print("Connect to server fail.")
+        """ Register the sensor to the server, the registration is sent by the
+            hub session's thread and re-sent after every reconnection.
+        """
+        self.statusbar.SetStatusText("Registering the sensor to %s ..." % ServerName)
+        self.regSeq += 1
+        regSeq = self.regSeq
+        # (Temporary hard code the sigature for test.)
+        self.regFuture = self.getHubSession(ServerName).request(
+            'RG', sticky=True, senId=self.senId, senType=SENSOR_TYPE,
+            version=self.version, signature=self.signature, room=gv.HUB_ROOM,
+            callback=lambda reply, err: wx.CallAfter(self.onRegistered, reply, err, regSeq))
+        wx.CallLater(gv.HUB_REG_TIMEOUT*1000, self.checkRegistered, regSeq)
+
+    def checkRegistered(self, regSeq):
+        """ Report the registration fail if the hub did not reply in time, the
+            registration not sent yet is cancelled (reported by its callback).
+        """
+        if regSeq != self.regSeq or self.regFuture.done() or self.regFuture.cancel(): return
+        self.regSeq += 1    # the timeout is reported: ignore the late reply.
+        self.onRegistered(None, TimeoutError('no hub reply in %s sec' % gv.HUB_REG_TIMEOUT),
+                          self.regSeq)
+
+    def onRegistered(self, reply, err, regSeq):
+        """ Show the sensor registration <regSeq> result (called in the UI thread)."""
+        if regSeq != self.regSeq: return    # timed out or replaced by a new one.
+        if reply and reply.get('state'):
+            self.statusbar.SetStatusText("Sensor registration success.")
+            self.activeFlag = True
+            return
+        print("SConnetion: sensor registration fail: %s" % str(err or reply.get('error')))
+        self.statusbar.SetStatusText("Sensor registration fail.")
+        wx.MessageBox('Sensor registration Fail', 'Caution', wx.OK | wx.ICON_ERROR)
+
+#--SensorReaderFrame-----------------------------------------------------------
+    def setRecording(self, recordFlag):
+        """ Start/stop recording all the sensors' frames in <REC_DIR>."""
+        if not self.sensorMgr.setRecording(gv.REC_DIR if recordFlag else None): return
+        gv.gRecordFlag = recordFlag
+        self.statusbar.SetStatusText("Recording the sensor frames in %s" % gv.REC_DIR
+                                     if recordFlag else "Sensor frames recording stopped.")
+
+#--SensorReaderFrame-----------------------------------------------------------
+    def setUplink(self, ServerName, uplinkFlag):
+        """ Start/stop reporting all the sensors' data to the server."""
+        if self.uplink:
+            # the last batches are sent in the background.
+            threading.Thread(target=self.uplink.close, daemon=True).start()
+            self.uplink = None
+        if not uplinkFlag: return
+        import XAKAsensorUplink as xuplink  # loaded at the first hub use.
+        self.uplink = xuplink.XAKAuplink(self.getHubSession(ServerName),
+                                         statsEngine=self.statsEngine,
+                                         batchSize=gv.UPLINK_BATCH_SIZE,
+                                         flushInterval=gv.UPLINK_FLUSH_INTERVAL,
+                                         spillDir=gv.UPLINK_SPILL_DIR)
+        self.uplink.start()
+        self.statusbar.SetStatusText("Reporting the sensor data to %s" % ServerName)
 
 #--SensorReaderFrame-----------------------------------------------------------
+    @xprof.profiled('periodic')
     def periodic(self, event):
-        """ Periodic call back: read the data one time and find the correct 
-            string can be used.
+        """ Poll timer call back: drain the frames queued by all the sensors' reader
+            threads (never block the GUI thread) and update the stats/history,
+            the widgets are updated by onRefresh() at the scheduler's rate.
         """
-        self.serComm.fetchSensorData()
-        self.dataList = self.serComm.getData()
+        startTime = time.perf_counter()
+        frameLists = self.sensorMgr.poll()
+        for idx in self.sensorMgr.popRewound():
+            # replay seek back/loop: restart the history and stats in time order.
+            self.chartList[idx].clearData()
+            self.statsEngine.resetSensor(idx)
+        multiInfoPg = self.multiInfoPage.panel
+        chartCols = [self.statsEngine.params.index(p) for p in CHART_PARAMS]
+        for idx, frameList in enumerate(frameLists):
+            # Update the sensor connection indicator if the state changed.
+            state = self.sensorMgr.isOnline(idx)
+            if state != self.onlineStates[idx]:
+                self.onlineStates[idx] = state
+                if multiInfoPg: multiInfoPg.updateSensorIndicator(idx, state)
+                if not state: self.statsEngine.removeSensor(idx)
+            if not frameList: continue
+            self.dataLists[idx] = frameList[-1][1]
+            paramValues = self.statsEngine.addFrames(idx, frameList)
+            # Add the new frames in the sensor history line chart.
+            linechart = self.chartList[idx]
+            for (timestamp, _), values in zip(frameList, paramValues[:, chartCols].tolist()):
+                linechart.appendData(values, timestamp)
+            if multiInfoPg: gv.iMapPanel.updatePPLNum(self.dataLists[idx][27], idx=idx)
+            if self.uplink:
+                self.uplink.reportFrames(idx, self.sensorMgr.getPort(idx), frameList)
+            self.dirtySensors.add(idx)
         # Set sensor ID and version for resigter
-        if not (self.senId and self.version):
-            self.senId, self.version = self.dataList[0], self.dataList[8]
-        if not self.activeFlag: return
-        # Update the UI if the sensor registed successfully.
-        self.updateUIPanels()
+        dataList = self.dataLists[0] if self.dataLists else []
+        if dataList and not (self.senId and self.version):
+            self.senId, self.version = dataList[0], dataList[8]
+        if any(frameLists): self.markStartup('firstData')
+        self.pollHist.observe(time.perf_counter() - startTime)
+
+#--SensorReaderFrame-----------------------------------------------------------
+    @xprof.profiled('onRefresh')
+    def onRefresh(self, event):
+        """ Refresh timer call back: update the widgets and schedule the next
+            refresh (capped FPS, backoff if minimized or over the time budget).
+        """
+        visible = self.IsShown() and not self.IsIconized()
+        cost = None
+        if visible:
+            startTime = time.perf_counter()
+            self.updateUIPanels()
+            updateTime = time.perf_counter() - startTime
+            self.uiUpdateHist.observe(updateTime)
+            cost = updateTime + self.getPaintTime()
+        delay = self.scheduler.nextDelay(cost, visible=visible)
+        self.refreshTimer.StartOnce(max(1, int(delay*1000)))
 
+    def getPaintTime(self):
+        """ Return and reset the sec spent in the charts/map paints."""
+        panels = self.chartList + ([gv.iMapPanel] if gv.iMapPanel else [])
+        paintTime = sum(panel.paintTime for panel in panels)
+        for panel in panels: panel.paintTime = 0.0
+        return paintTime
 
  #--SensorReaderFrame-----------------------------------------------------------
     def sigaSimuInput(self, event):
@@ -145,43 +366,109 @@ class SensorReaderFrame(wx.Frame):
 
 #--SensorReaderFrame-----------------------------------------------------------
     def updateUIPanels(self):
-        """ Update the UI of all the Panels"""
-        # Update the sensor detail information frame.
-        if gv.iDetailPanel: gv.iDetailPanel.updateDisplay(self.dataList)
-        # Update the sensor history line chart.
-        self.linechart.appendData(
-            list((self.dataList[4], self.dataList[9], self.dataList[27])))
-        self.linechart.updateDisplay()
-        # Update the basic information panel.
-        dataList = (self.dataList[0], gv.DE_COMM, self.dataList[3],
-                    self.dataList[4], self.dataList[9], self.dataList[27])
-        self.infoPanel.updateData(dataList)
-        # Update the multi-information panel Grid.
-        self.multiInfoPg.updateSensorGrid(
-            0, (self.dataList[0], self.dataList[4], self.dataList[27]))
-        # Update the top view map panel.
-        gv.iMapPanel.updatePPLNum(self.dataList[27])
-        gv.iMapPanel.updateDisplay()
+        """ Update the widgets with the new data of the sensors. Only the widgets
+            of the shown notebook page are updated, the hidden pages are updated
+            when shown (OnPageChanged()).
+        """
+        setupPanel = self.setupPage.panel
+        if setupPanel and self.sensorMgr.isReplay() and setupPanel.IsShownOnScreen():
+            setupPanel.updateReplayState(self.sensorMgr.getReplayTime(),
+                                         *self.sensorMgr.getReplayRange())
+        diagPanel = self.diagPage.panel
+        if diagPanel and diagPanel.IsShownOnScreen() and \
+                time.time() - self.diagRefreshTime >= DIAG_INTERVAL:
+            self.refreshDiagnostics()
+        # Update the UI if the sensor registed successfully.
+        if not self.activeFlag: return
+        dirtySensors, self.dirtySensors = self.dirtySensors, set()
+        multiInfoPg = self.multiInfoPage.panel
+        multiShown = multiInfoPg is not None and multiInfoPg.IsShownOnScreen()
+        detailPanel = gv.iDetailPanel
+        for idx in sorted(dirtySensors):
+            # Update the sensor detail information frame (if not minimized).
+            if detailPanel and detailPanel.senIdx == idx and detailPanel.IsShownOnScreen():
+                detailPanel.updateDisplay(self.dataLists[idx])
+            if self.chartList[idx].IsShownOnScreen(): self.refreshSensorPage(idx)
+            if multiShown: self.fillSensorGrid(multiInfoPg, idx)
+        if not multiShown: return
+        multiInfoPg.refreshGrid()   # all the sensors' changes in one repaint.
+        if time.time() - self.mapRefreshTime >= MAP_BLINK_INTERVAL:
+            self.mapRefreshTime = time.time()
+            gv.iMapPanel.updateDisplay()
+
+#--SensorReaderFrame-----------------------------------------------------------
+    def startProfiling(self, window):
+        """ Sample the timers' call backs and the paints for <window> sec, the
+            collapsed stacks file is saved in <PROF_DIR>.
+        """
+        if not xprof.PROFILER.start(window, gv.PROF_DIR,
+                                    callback=lambda path: wx.CallAfter(self.onProfiled, path)):
+            return False
+        self.statusbar.SetStatusText("Profiling the UI for %d sec ..." % window)
+        return True
+
+    def onProfiled(self, outPath):
+        """ Profiler call back (via wx.CallAfter): the profiling window is done."""
+        if not self: return     # the frame is already destroyed.
+        self.statusbar.SetStatusText("Profile saved in %s" % outPath)
+        if self.setupPage.panel: self.setupPage.panel.setProfilingState(False)
 
 #--SensorReaderFrame-----------------------------------------------------------
     def OnClose(self, event):
-        if not self.serComm is None:
-            try:
-                self.serComm.close()  # close the exists opened port.
-            except:
-                print("Error happend when close the serial port.")
-            self.serComm = None 
+        self.timer.Stop()
+        self.refreshTimer.Stop()
+        xprof.PROFILER.stop()
+        self.sensorMgr.stop()   # stop the reader threads and close the ports.
+        if self.uplink: self.uplink.close()
+        for session in self.hubSessions.values(): session.close()
         self.Destroy()
 
 #-----------------------------------------------------------------------------
 #-----------------------------------------------------------------------------
 class MyApp(wx.App):
     """ Init the frame and run the application"""
+    def __init__(self, redirect=False, startupTimes=None):
+        self.startupTimes = startupTimes
+        wx.App.__init__(self, redirect)
+
     def OnInit(self):
-        mainFrame = SensorReaderFrame(None, -1, gv.APP_NAME)
+        mainFrame = SensorReaderFrame(None, -1, gv.APP_NAME, startupTimes=self.startupTimes)
         mainFrame.Show(True)
+        if self.startupTimes is not None:
+            mainFrame.markStartup('frameBuilt')
+            # the first idle call back is done after the window is painted.
+            wx.CallAfter(mainFrame.markStartup, 'windowShown')
+            wx.CallLater(STARTUP_TIMEOUT*1000, mainFrame.Close)
         return True
 
 #-----------------------------------------------------------------------------
-app = MyApp(0)
-app.MainLoop()
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='XAKA people counting sensor reader.')
+    parser.add_argument('--startup-time', action='store_true',
+                        help='measure the startup time then exit.')
+    parser.add_argument('--out', help='JSON file to save the startup time.')
+    parser.add_argument('--replay', default=gv.gReplayPath,
+                        help='record folder/.xrec file/raw capture file to replay.')
+    parser.add_argument('--speed', type=float, default=gv.gReplaySpeed, help='replay speed.')
+    args = parser.parse_args(argv)
+    gv.gReplayPath, gv.gReplaySpeed = args.replay, args.speed
+    if not args.startup_time:
+        app = MyApp(0)
+        app.MainLoop()
+        return
+    startupTimes = {'imported': round((time.perf_counter() - START_TIME)*1000, 1)}
+    app = MyApp(0, startupTimes=startupTimes)
+    app.MainLoop()
+    result = {'time': time.strftime('%Y-%m-%d %H:%M:%S'), 'app': gv.APP_NAME,
+              'python': sys.version.split()[0], 'startupMs': startupTimes}
+    output = json.dumps(result, indent=2)
+    if args.out:
+        with open(args.out, 'w') as fh:
+            fh.write(output)
+        print("Startup time saved in %s" % args.out)
+    else:
+        print(output)
+
+#-----------------------------------------------------------------------------
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,263 @@
+#!/usr/bin/python
+#-----------------------------------------------------------------------------
+# Name:        XAKAsensorRecorder.py
+#
+# Purpose:     This module is used to record every sensor frame in a compact
+#              fixed-record binary file per sensor (rotated by size and day) and
+#              read the recorded files back by mmap as zero-copy numpy arrays.
+#
+#              File format: 16 bytes header <REC_MAGIC, version, record size>
+#              followed by the records: float64 timestamp + the 148 bytes frame
+#              payload (int32 sensor ID, int32 parameter count, 35 float32).
+#
+# Author:      Yuancheng Liu
+#
+# Created:     29/01/2022
+# version:     v_2.1
+# Copyright:   YC has not added.
+# License:     YC has not added.
+#-----------------------------------------------------------------------------
+
+import os
+import re
+import glob
+import mmap
+import time
+import threading
+from struct import Struct
+import numpy as np
+import XAKAsensorComm as xcomm
+
+REC_MAGIC = b'XAKAREC\x00'
+REC_VERSION = 1
+REC_EXT = '.xrec'
+HEADER_STRUCT = Struct('<8sII')     # magic, version, record size.
+TS_STRUCT = Struct('<d')
+REC_DTYPE = np.dtype([('ts', '<f8')] + xcomm.FRAME_DTYPE.descr)
+REC_SIZE = REC_DTYPE.itemsize       # 156 bytes.
+REC_MAX_BYTES = 64*1024*1024        # rotate the file if it is bigger than 64MB.
+REC_KEEP_DAYS = 31                  # days of record files kept.
+FLUSH_INTERVAL = 1                  # sec between 2 file buffer flushes.
+
+#-----------------------------------------------------------------------------
+def getSensorName(commPort):
+    """ Convert the port name to a file name friendly sensor name, such as
+        '/dev/ttyUSB0' => 'ttyUSB0'.
+    """
+    name = re.sub(r'[^A-Za-z0-9]+', '_', str(commPort)).strip('_')
+    return name.replace('dev_', '', 1) if name.startswith('dev_') else name
+
+#-----------------------------------------------------------------------------
+#-----------------------------------------------------------------------------
+class XAKArecorder(object):
+    """ Append the timestamped raw frames of one sensor to the record files
+        <recDir>/XAKA_<sensorName>_<YYYYMMDD>_<NNN>.xrec, a new file is created
+        every day and when the file size reaches <maxBytes>.
+    """
+    def __init__(self, recDir, sensorName, maxBytes=REC_MAX_BYTES,
+                 keepDays=REC_KEEP_DAYS) -> None:
+        self.recDir = recDir
+        self.sensorName = getSensorName(sensorName)
+        self.maxBytes = maxBytes
+        self.keepDays = keepDays    # old files are deleted when rotated.
+        self.fh = None              # current record file handle.
+        self.filePath = None
+        self.fileDay = None         # 'YYYYMMDD' of the current file.
+        self.fileBytes = 0
+        self.lastFlush = 0
+        self.recCount = 0           # total number of frames recorded.
+        self.closed = False         # no more frame recorded after close().
+        self.lock = threading.Lock()
+        os.makedirs(recDir, exist_ok=True)
+
+#--XAKArecorder----------------------------------------------------------------
+    def recordFrames(self, payloads, timestamp=None):
+        """ Record the frames' payload bytes (XAKAframeDecoder.feedRaw() output)
+            received at <timestamp>.
+        """
+        if not payloads: return
+        if timestamp is None: timestamp = time.time()
+        tsBytes = TS_STRUCT.pack(timestamp)
+        data = b''.join(tsBytes + payload for payload in payloads)
+        with self.lock:
+            if self.closed: return  # a reader thread still had the recorder.
+            day = time.strftime('%Y%m%d', time.localtime(timestamp))
+            if self.fh is None or day != self.fileDay or self.fileBytes + len(data) > self.maxBytes:
+                self._rotate(day)
+            self.fh.write(data)
+            self.fileBytes += len(data)
+            self.recCount += len(payloads)
+            if timestamp - self.lastFlush > FLUSH_INTERVAL:
+                self.fh.flush()
+                self.lastFlush = timestamp
+
+#--XAKArecorder----------------------------------------------------------------
+    def _rotate(self, day):
+        """ Close the current file and open the next record file of the <day>."""
+        if self.fh: self.fh.close()
+        if day != self.fileDay: self._removeOldFiles()
+        prefix = os.path.join(self.recDir, 'XAKA_%s_%s_' %(self.sensorName, day))
+        idx = len(glob.glob(prefix + '*' + REC_EXT))
+        self.filePath = prefix + '%03d' % idx + REC_EXT
+        self.fh = open(self.filePath, 'wb')
+        self.fh.write(HEADER_STRUCT.pack(REC_MAGIC, REC_VERSION, REC_SIZE))
+        self.fileDay, self.fileBytes = day, HEADER_STRUCT.size
+
+#--XAKArecorder----------------------------------------------------------------
+    def _removeOldFiles(self):
+        """ Delete the sensor's record files older than <keepDays>."""
+        if not self.keepDays: return
+        limitDay = time.strftime('%Y%m%d', time.localtime(time.time() - self.keepDays*86400))
+        for filePath in listRecFiles(self.recDir, self.sensorName):
+            if parseRecFileName(filePath)[1] < limitDay:
+                try:
+                    os.remove(filePath)
+                except OSError as err:
+                    print("Recorder: remove old file error: %s" % str(err))
+
+#--XAKArecorder----------------------------------------------------------------
+    def close(self):
+        with self.lock:
+            if self.fh: self.fh.close()
+            self.fh = None
+            self.closed = True
+
+#-----------------------------------------------------------------------------
+def parseRecFileName(filePath):
+    """ Return the (sensorName, day, index) of the record file."""
+    name = os.path.basename(filePath)[len('XAKA_'):-len(REC_EXT)]
+    sensorName, day, idx = name.rsplit('_', 2)
+    return sensorName, day, int(idx)
+
+def listRecFiles(recDir, sensorName=None):
+    """ Return the record files (of the sensor) in time order."""
+    pattern = 'XAKA_%s_*' % (sensorName or '*') + REC_EXT
+    fileList = glob.glob(os.path.join(recDir, pattern))
+    return sorted(fileList, key=lambda f: parseRecFileName(f)[1:])
+
+#-----------------------------------------------------------------------------
+#-----------------------------------------------------------------------------
+class XAKArecReader(object):
+    """ mmap a record file and expose the records as a zero-copy numpy array
+        with <REC_DTYPE> fields (ts, senId, paramNum, params[35]).
+    """
+    def __init__(self, filePath) -> None:
+        self.filePath = filePath
+        self.mm = None
+        self.records = np.empty(0, dtype=REC_DTYPE)
+        with open(filePath, 'rb') as fh:
+            header = fh.read(HEADER_STRUCT.size)
+            if len(header) < HEADER_STRUCT.size: return # empty new file.
+            magic, _, recSize = HEADER_STRUCT.unpack(header)
+            if magic != REC_MAGIC or recSize != REC_SIZE:
+                raise ValueError('Record reader: %s is not a XAKA record file.' % filePath)
+            size = os.fstat(fh.fileno()).st_size
+            recNum = (size - HEADER_STRUCT.size) // REC_SIZE # ignore a partial record.
+            if recNum == 0: return
+            self.mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        self.records = np.frombuffer(self.mm, dtype=REC_DTYPE, count=recNum,
+                                     offset=HEADER_STRUCT.size)
+
+#--XAKArecReader---------------------------------------------------------------
+    def query(self, startTime=None, endTime=None):
+        """ Return the zero-copy view of the records in [startTime, endTime]."""
+        times = self.records['ts']
+        startIdx = 0 if startTime is None else np.searchsorted(times, startTime)
+        endIdx = len(times) if endTime is None else np.searchsorted(times, endTime, side='right')
+        return self.records[startIdx:endIdx]
+
+    def timeRange(self):
+        """ Return the (first, last) record timestamp or None if no records."""
+        if len(self.records) == 0: return None
+        return float(self.records['ts'][0]), float(self.records['ts'][-1])
+
+#--XAKArecReader---------------------------------------------------------------
+    def close(self):
+        """ Release the mmap, the arrays returned by query() become invalid."""
+        self.records = np.empty(0, dtype=REC_DTYPE)
+        if self.mm is not None:
+            try:
+                self.mm.close()
+            except BufferError:
+                pass    # a view is still used, the map is freed with the view.
+            self.mm = None
+
+#-----------------------------------------------------------------------------
+def listRecFilesInRange(recDir, sensorName=None, startTime=None, endTime=None):
+    """ Return the record files (of the sensor) which may have records in the 
+        time range: the files of the days out of the range are skipped.
+    """
+    firstDay = lastDay = None
+    if startTime is not None: firstDay = time.strftime('%Y%m%d', time.localtime(startTime))
+    if endTime is not None: lastDay = time.strftime('%Y%m%d', time.localtime(endTime))
+    fileList = []
+    for filePath in listRecFiles(recDir, sensorName and getSensorName(sensorName)):
+        day = parseRecFileName(filePath)[1]
+        if (firstDay and day < firstDay) or (lastDay and day > lastDay): continue
+        fileList.append(filePath)
+    return fileList
+
+def queryRecords(recDir, sensorName=None, startTime=None, endTime=None):
+    """ Return the list of zero-copy record arrays (one per file) of the sensor
+        in the time range, the files out of the range days are not opened.
+    """
+    result = []
+    for filePath in listRecFilesInRange(recDir, sensorName, startTime, endTime):
+        records = XAKArecReader(filePath).query(startTime, endTime)
+        if len(records): result.append(records)
+    return result
+
+#-----------------------------------------------------------------------------
+#-----------------------------------------------------------------------------
+def testCase(mode=0):
+    if mode == 0:
+        import tempfile
+        recDir = tempfile.mkdtemp()
+        sim = xcomm.XandarSimulator(seed=0)
+        sim.setChunk(xcomm.FRAME_HEADER, xcomm.FRAME_SIZE)
+        decoder = xcomm.XAKAframeDecoder()
+        recorder = XAKArecorder(recDir, '/dev/ttyUSB0', maxBytes=REC_SIZE*5000)
+        startT = time.time()
+        payloadList, timeList = [], []
+        for i in range(20000):
+            payloads = decoder.feedRaw(sim.read(xcomm.READ_SIZE))
+            recorder.recordFrames(payloads, startT + i)
+            payloadList += payloads
+            timeList += [startT + i] * len(payloads)
+        recorder.close()
+        recorder.recordFrames(payloadList[:1])  # ignored after close().
+        fileList = listRecFiles(recDir)
+        print(fileList)
+        # round trip: every frame is read back with its timestamp, in order.
+        assert len(fileList) > 1, 'the file is not rotated by the size'
+        assert all(parseRecFileName(f)[0] == 'ttyUSB0' for f in fileList)
+        records = np.concatenate([XAKArecReader(f).records for f in fileList])
+        expected = np.frombuffer(b''.join(payloadList), dtype=xcomm.FRAME_DTYPE)
+        assert recorder.recCount == len(records) == len(expected)
+        assert np.array_equal(records['ts'], np.array(timeList))
+        for field in xcomm.FRAME_DTYPE.names:
+            assert np.array_equal(records[field], expected[field]), field
+        # a partial record at the end of the file (crash while writing) is ignored.
+        recNum = len(XAKArecReader(fileList[-1]).records)
+        with open(fileList[-1], 'ab') as fh: fh.write(b'\x00' * (REC_SIZE // 2))
+        assert len(XAKArecReader(fileList[-1]).records) == recNum
+        badPath = os.path.join(recDir, 'XAKA_bad_20220129_000' + REC_EXT)
+        with open(badPath, 'wb') as fh: fh.write(b'NOTXAKA!' + bytes(8))
+        try:
+            XAKArecReader(badPath)
+            assert False, 'a bad file header is accepted'
+        except ValueError:
+            os.remove(badPath)
+        startT2 = time.perf_counter()
+        arrList = queryRecords(recDir, 'ttyUSB0', startT + 100, startT + 19000)
+        print("Loaded %d records in %.2f ms" %(sum(len(a) for a in arrList),
+              (time.perf_counter() - startT2)*1000))
+        queried = np.concatenate(arrList)['ts']
+        assert queried[0] == startT + 100 and queried[-1] == startT + 19000
+        print(arrList[0][:2])
+    else:
+        print("Put your test code here:")
+
+#-----------------------------------------------------------------------------
+if __name__ == '__main__':
+    testCase(mode=0)
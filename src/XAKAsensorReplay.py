@@ -0,0 +1,371 @@
+#!/usr/bin/python
+#-----------------------------------------------------------------------------
+# Name:        XAKAsensorReplay.py
+#
+# Purpose:     This module is used to replay the recorded sensor data (the .xrec
+#              frame record files of XAKAsensorRecorder or a captured raw serial
+#              bytes stream file) at 1x~100x speed with pause and seek. A replay
+#              source has the same read()/in_waiting/close() interface as the
+#              serial port (and the XandarSimulator), so it can be plugged in the
+#              XAKAsensorComm to drive the full UI. The data is streamed lazily
+#              from the files (one mmap-ed record file or one raw chunk at a time),
+#              so a multi-days capture is replayed without loading it in memory.
+#
+# Author:      Yuancheng Liu
+#
+# Created:     29/01/2022
+# version:     v_2.1
+# Copyright:   YC has not added.
+# License:     YC has not added.
+#-----------------------------------------------------------------------------
+
+import os
+import time
+import threading
+from bisect import bisect_right
+import numpy as np
+import XAKAsensorComm as xcomm
+import XAKAsensorRecorder as xrec
+
+REPLAY_SPEEDS = (1, 2, 5, 10, 20, 50, 100) # replay speed choices.
+MIN_SPEED, MAX_SPEED = REPLAY_SPEEDS[0], REPLAY_SPEEDS[-1]
+PAUSE_POLL = 0.05       # sec between 2 checks of a paused source.
+FRAME_LEN = len(xcomm.FRAME_HEADER) + xcomm.FRAME_SIZE
+
+#-----------------------------------------------------------------------------
+def findReplaySources(replayPath):
+    """ Return the dict {sensorName: file list} of the replay path. A record
+        folder gives one file list per recorded sensor, a file gives one list.
+    """
+    if os.path.isdir(replayPath):
+        sources = {}
+        for filePath in xrec.listRecFiles(replayPath):
+            sources.setdefault(xrec.parseRecFileName(filePath)[0], []).append(filePath)
+        return dict(sorted(sources.items()))
+    name = os.path.splitext(os.path.basename(replayPath))[0]
+    return {name: [replayPath]}
+
+#-----------------------------------------------------------------------------
+def openReplaySource(fileList, speed=MIN_SPEED, **kwargs):
+    """ Create the replay source of the record files or the raw capture file."""
+    if all(f.endswith(xrec.REC_EXT) for f in fileList):
+        return XAKArecReplay(fileList, speed=speed, **kwargs)
+    if len(fileList) > 1:
+        print("Replay: only the first raw capture file %s is replayed." % fileList[0])
+    return XAKArawReplay(fileList[0], speed=speed, **kwargs)
+
+#-----------------------------------------------------------------------------
+#-----------------------------------------------------------------------------
+class XAKAreplaySource(object):
+    """ Base of the replay sources: a replay clock (the recorded time replayed
+        now) runs <speed> times faster than the wall clock from the first read,
+        read() returns the data recorded before the replay clock and blocks at
+        most <timeout> sec like a serial port. The sub class implements the data
+        access: _readDue(), _nextTime(), _seekData() and _closeData().
+    """
+    def __init__(self, speed=MIN_SPEED, timeout=1, loop=False) -> None:
+        self.speed = clipSpeed(speed)
+        self.timeout = timeout      # max sec a read() call blocks.
+        self.loop = loop            # restart from the beginning at the end.
+        self.paused = False
+        self.startTime = self.endTime = 0.0 # recorded time range.
+        self.baseTime = 0.0         # replay clock time at <wallStart>.
+        self.wallStart = None       # wall time the clock (re)started.
+        self.stream = bytearray()   # due bytes not read yet.
+        self.readBytes = 0          # total bytes returned by read().
+        self.lock = threading.Lock()
+
+#--XAKAreplaySource------------------------------------------------------------
+    def replayTime(self):
+        """ Return the recorded time being replayed now."""
+        if self.paused or self.wallStart is None: return self.baseTime
+        return self.baseTime + (time.time() - self.wallStart) * self.speed
+
+    def _rebase(self):
+        self.baseTime = self.replayTime()
+        if self.wallStart is not None: self.wallStart = time.time()
+
+#--XAKAreplaySource------------------------------------------------------------
+    def setSpeed(self, speed):
+        with self.lock:
+            self._rebase()
+            self.speed = clipSpeed(speed)
+
+    def pause(self, pauseFlag=True):
+        with self.lock:
+            self._rebase()
+            self.paused = pauseFlag
+
+#--XAKAreplaySource------------------------------------------------------------
+    def seek(self, timestamp):
+        """ Move the replay clock to the recorded <timestamp>."""
+        with self.lock:
+            self._seekData(timestamp)
+            self.stream.clear()
+            self.baseTime = timestamp
+            if self.wallStart is not None: self.wallStart = time.time()
+
+#--XAKAreplaySource------------------------------------------------------------
+    def _fill(self, maxBytes):
+        """ Move the due data (max about <maxBytes>) in the stream buffer."""
+        if self.wallStart is None: self.wallStart = time.time()
+        if len(self.stream) < maxBytes:
+            self.stream += self._readDue(self.replayTime(), maxBytes - len(self.stream))
+
+    @property
+    def in_waiting(self):
+        """ Number of bytes can be read now (same as serial.Serial.in_waiting)."""
+        with self.lock:
+            self._fill(xcomm.READ_SIZE)
+            return len(self.stream)
+
+#--XAKAreplaySource------------------------------------------------------------
+    def read(self, byteNum):
+        """ Return max <byteNum> due bytes, wait until the next recorded data is
+            due or the timeout if nothing is due now.
+        """
+        def takeDue():
+            self._fill(byteNum)
+            if not self.stream: return None
+            dataByte = bytes(self.stream[:byteNum])
+            del self.stream[:byteNum]
+            self.readBytes += len(dataByte)
+            return dataByte
+        return self._waitDue(takeDue) or b''
+
+    def readFrames(self, maxNum):
+        """ Return the list of max <maxNum> due (recorded time, frame) like read()
+            (a frame is a list of 37 values), so the replayed frames keep their
+            record time. A source is read either by read() or by readFrames().
+        """
+        def takeDue():
+            if self.wallStart is None: self.wallStart = time.time()
+            return self._readDueFrames(self.replayTime(), maxNum)
+        return self._waitDue(takeDue) or []
+
+    def _waitDue(self, takeDue):
+        """ Return the data of takeDue() (called with the lock), wait until the
+            next recorded data is due or the timeout if nothing is due now.
+        """
+        deadline = time.time() + (self.timeout or 0)
+        while True:
+            with self.lock:
+                data = takeDue()
+                if data: return data
+                nextTime = self._nextTime()
+                if nextTime is None and self.loop:
+                    self.stream.clear()
+                    self._seekData(self.startTime)
+                    self.baseTime, self.wallStart = self.startTime, time.time()
+                    continue
+                crtTime, paused = self.replayTime(), self.paused
+            waitTime = deadline - time.time()
+            if waitTime <= 0: return None
+            if not (paused or nextTime is None):
+                waitTime = min(waitTime, max(0.001, (nextTime - crtTime) / self.speed))
+            time.sleep(min(waitTime, PAUSE_POLL) if paused else waitTime)
+
+#--XAKAreplaySource------------------------------------------------------------
+    def isEnd(self):
+        with self.lock:
+            return not self.stream and self._nextTime() is None
+
+    def setChunk(self, header, chunkSize):
+        pass    # the recorded frames already have the header.
+
+    def write(self, byteData):
+        pass    # nothing can be sent to a recorded sensor.
+
+    def close(self):
+        with self.lock:
+            self._closeData()
+            self.stream = bytearray()
+
+#-----------------------------------------------------------------------------
+#-----------------------------------------------------------------------------
+class XAKArecReplay(XAKAreplaySource):
+    """ Replay the .xrec record files (in time order) of one sensor. Only the
+        file being replayed is mmap-ed and the frames are converted back to the
+        raw frame bytes a due batch at a time.
+    """
+    def __init__(self, fileList, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self.fileList, self.fileStarts = [], []
+        for filePath in fileList:
+            reader = xrec.XAKArecReader(filePath)
+            timeRange = reader.timeRange()
+            reader.close()
+            if timeRange is None: continue  # no record.
+            if not self.fileList: self.startTime = timeRange[0]
+            self.fileList.append(filePath)
+            self.fileStarts.append(timeRange[0])
+            self.endTime = timeRange[1]
+        self.reader = None
+        self.fileIdx = self.recIdx = 0
+        self.baseTime = self.startTime
+        self._openFile(0)
+
+#--XAKArecReplay---------------------------------------------------------------
+    def _openFile(self, fileIdx):
+        """ Map the record file <fileIdx> (or the next one which has records)."""
+        if self.reader: self.reader.close()
+        self.reader, self.recIdx = None, 0
+        for idx in range(fileIdx, len(self.fileList)):
+            reader = xrec.XAKArecReader(self.fileList[idx])
+            if len(reader.records):
+                self.reader, self.fileIdx = reader, idx
+                return
+            reader.close()
+        self.fileIdx = len(self.fileList)
+
+    def _records(self):
+        """ Return the records of the current file, go to the next file if all
+            the records were replayed (None at the end of the replay).
+        """
+        while self.reader and self.recIdx >= len(self.reader.records):
+            self._openFile(self.fileIdx + 1)
+        return self.reader.records if self.reader else None
+
+#--XAKArecReplay---------------------------------------------------------------
+    def _dueRecords(self, crtTime, maxNum):
+        """ Return the list of the due records arrays (max <maxNum> records)."""
+        chunks = []
+        while maxNum > 0:
+            records = self._records()
+            if records is None: break
+            endIdx = int(np.searchsorted(records['ts'], crtTime, side='right'))
+            endIdx = min(endIdx, self.recIdx + maxNum)
+            if endIdx <= self.recIdx: break
+            chunks.append(records[self.recIdx:endIdx])
+            maxNum -= endIdx - self.recIdx
+            self.recIdx = endIdx
+        return chunks
+
+    def _readDue(self, crtTime, maxBytes):
+        chunks = self._dueRecords(crtTime, max(1, maxBytes // FRAME_LEN))
+        return b''.join(toRawFrames(records) for records in chunks)
+
+    def _readDueFrames(self, crtTime, maxNum):
+        frameList = []
+        for records in self._dueRecords(crtTime, max(1, maxNum)):
+            frameList += toFrameList(records)
+        return frameList
+
+    def _nextTime(self):
+        records = self._records()
+        return None if records is None else float(records['ts'][self.recIdx])
+
+#--XAKArecReplay---------------------------------------------------------------
+    def _seekData(self, timestamp):
+        fileIdx = max(0, bisect_right(self.fileStarts, timestamp) - 1)
+        self._openFile(fileIdx)
+        if self.reader:
+            self.recIdx = int(np.searchsorted(self.reader.records['ts'], timestamp))
+
+    def _closeData(self):
+        if self.reader: self.reader.close()
+        self.reader = None
+        self.fileIdx = len(self.fileList)
+
+#-----------------------------------------------------------------------------
+#-----------------------------------------------------------------------------
+class XAKArawReplay(XAKAreplaySource):
+    """ Replay a captured raw serial bytes stream file. The capture has no time
+        information, the bytes are replayed at <fps> sensor frames per second
+        and the replay time is the sec from the beginning of the capture.
+    """
+    def __init__(self, filePath, fps=xcomm.SIMU_FPS, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self.filePath = filePath
+        self.byteRate = FRAME_LEN * fps  # bytes per sec of the recorded time.
+        self.fileSize = os.path.getsize(filePath)
+        self.endTime = self.fileSize / self.byteRate
+        self.fh = open(filePath, 'rb')
+        self.pos = 0            # file position of the next byte to replay.
+        self.decoder = xcomm.XAKAframeDecoder()     # used by readFrames().
+
+#--XAKArawReplay---------------------------------------------------------------
+    def _readDue(self, crtTime, maxBytes):
+        dueBytes = min(self.fileSize, int(crtTime * self.byteRate)) - self.pos
+        if self.fh is None or dueBytes <= 0: return b''
+        data = self.fh.read(min(maxBytes, dueBytes))
+        self.pos += len(data)
+        return data
+
+    def _readDueFrames(self, crtTime, maxNum):
+        """ The frames are timed by their end position in the capture."""
+        payloads = self.decoder.feedRaw(self._readDue(crtTime, max(1, maxNum) * FRAME_LEN))
+        endTime, step = self.pos / self.byteRate, FRAME_LEN / self.byteRate
+        return [(endTime - (len(payloads) - 1 - idx) * step, list(xcomm.FRAME_STRUCT.unpack(item)))
+                for idx, item in enumerate(payloads)]
+
+    def _nextTime(self):
+        if self.fh is None or self.pos >= self.fileSize: return None
+        return (self.pos + 1) / self.byteRate
+
+#--XAKArawReplay---------------------------------------------------------------
+    def _seekData(self, timestamp):
+        if self.fh is None: return
+        self.pos = max(0, min(self.fileSize, int(timestamp * self.byteRate)))
+        self.fh.seek(self.pos)
+        self.decoder.reset()
+
+    def _closeData(self):
+        if self.fh: self.fh.close()
+        self.fh = None
+
+#-----------------------------------------------------------------------------
+def clipSpeed(speed):
+    return max(MIN_SPEED, min(MAX_SPEED, speed))
+
+def toRawFrames(records):
+    """ Convert the records (REC_DTYPE array) to the raw sensor frames bytes."""
+    frames = np.empty(len(records), dtype=xcomm.RAW_FRAME_DTYPE)
+    frames['header'] = xcomm.FRAME_HEADER
+    for field in ('senId', 'paramNum', 'params'):
+        frames[field] = records[field]
+    return frames.tobytes()
+
+def toFrameList(records):
+    """ Convert the records (REC_DTYPE array) to the list of (ts, frame)."""
+    heads = np.column_stack((records['senId'], records['paramNum'])).tolist()
+    return [(ts, head + params) for ts, head, params in
+            zip(records['ts'].tolist(), heads, records['params'].tolist())]
+
+#-----------------------------------------------------------------------------
+#-----------------------------------------------------------------------------
+def testCase(mode=0):
+    if mode == 0:
+        import tempfile
+        recDir = tempfile.mkdtemp()
+        sim = xcomm.XandarSimulator(seed=0)
+        sim.setChunk(xcomm.FRAME_HEADER, xcomm.FRAME_SIZE)
+        decoder = xcomm.XAKAframeDecoder()
+        recorder = xrec.XAKArecorder(recDir, 'SIMU0', maxBytes=xrec.REC_SIZE*200)
+        startT = time.time() - 3600
+        for i in range(1000): # 1 frame per sec.
+            recorder.recordFrames(decoder.feedRaw(sim.read(FRAME_LEN)), startT + i)
+        recorder.close()
+        sources = findReplaySources(recDir)
+        print(sources)
+        replay = openReplaySource(sources['SIMU0'], speed=100)
+        replay.seek(startT + 500)
+        decoder.reset()
+        frames = []
+        crtT = time.time()
+        while len(frames) < 200 and not replay.isEnd():
+            frames += decoder.feed(replay.read(xcomm.READ_SIZE))
+        print("Replayed %d frames in %.2f sec, sequence %d~%d" %(
+            len(frames), time.time() - crtT, frames[0][3], frames[-1][3]))
+        items = []
+        while len(items) < 50 and not replay.isEnd():
+            items += replay.readFrames(20)
+        print("Replayed %d timed frames, record time %.1f~%.1f sec from the start" %(
+            len(items), items[0][0] - startT, items[-1][0] - startT))
+        replay.close()
+    else:
+        print("Put your test code here:")
+
+#-----------------------------------------------------------------------------
+if __name__ == '__main__':
+    testCase(mode=0)
@@ -0,0 +1,101 @@
+#!/usr/bin/python
+#-----------------------------------------------------------------------------
+# Name:        XAKAsensorSched.py
+#
+# Purpose:     This module is the adaptive UI refresh scheduler: the sensors'
+#              frames are drained at the <POLL_INTERVAL> (the acquisition runs at
+#              the sensors' rate in the reader threads) and the widgets are
+#              repainted at most <targetFps> times per second. The refresh backs
+#              off when the window is minimized or when the refreshes take more
+#              than their time budget, and recovers when they fit again.
+#
+# Author:      Yuancheng Liu
+#
+# Created:     29/01/2022
+# version:     v_2.1
+# Copyright:   YC has not added.
+# License:     YC has not added.
+#-----------------------------------------------------------------------------
+
+import time
+
+POLL_INTERVAL = 0.1     # sec between 2 drains of the sensors' frame queues.
+TARGET_FPS = 10         # max UI refreshes per sec.
+MIN_FPS = 0.5           # min UI refreshes per sec when backing off.
+IDLE_INTERVAL = 2.0     # sec between 2 refresh checks when the window is minimized.
+BUDGET_RATIO = 0.3      # max share of the refresh interval spent in the refresh.
+BACKOFF_FACTOR = 2.0    # interval multiplier when the refresh is over budget.
+RECOVER_FACTOR = 0.8    # interval multiplier when the refresh fits the budget.
+COST_ALPHA = 0.3        # weight of the latest refresh in the cost EWMA.
+
+#-----------------------------------------------------------------------------
+#-----------------------------------------------------------------------------
+class XAKArefreshScheduler(object):
+    """ Decide the delay before the next UI refresh, usage example:
+            delay = scheduler.nextDelay()       # first refresh.
+            ... refresh, measure its cost (sec) ...
+            delay = scheduler.nextDelay(cost, visible=not frame.IsIconized())
+    """
+    def __init__(self, targetFps=TARGET_FPS, minFps=MIN_FPS, budgetRatio=BUDGET_RATIO,
+                 idleInterval=IDLE_INTERVAL) -> None:
+        self.baseInterval = 1.0 / targetFps
+        self.maxInterval = 1.0 / minFps
+        self.budgetRatio = budgetRatio
+        self.idleInterval = idleInterval
+        self.interval = self.baseInterval   # current refresh interval.
+        self.cost = None        # EWMA of the refresh cost (sec).
+        self.startTime = time.time()
+        self.stats = dict.fromkeys(('refreshes', 'idleTicks', 'backoffs'), 0)
+
+#--XAKArefreshScheduler--------------------------------------------------------
+    def nextDelay(self, cost=None, visible=True):
+        """ Feed the cost (sec) of the refresh just done (None if no refresh) and
+            return the sec to wait before the next refresh.
+        """
+        if not visible:
+            self.stats['idleTicks'] += 1
+            return max(self.interval, self.idleInterval)
+        if cost is None: return self.interval
+        self.stats['refreshes'] += 1
+        self.cost = cost if self.cost is None else self.cost + COST_ALPHA*(cost - self.cost)
+        budget = self.interval * self.budgetRatio
+        if self.cost > budget:
+            # over budget: refresh less often (at least enough to fit the budget).
+            self.interval = min(self.maxInterval, max(self.interval * BACKOFF_FACTOR,
+                                                      self.cost / self.budgetRatio))
+            self.stats['backoffs'] += 1
+        elif self.cost < budget * RECOVER_FACTOR and self.interval > self.baseInterval:
+            # recover only if the cost still fits the budget of the shorter interval.
+            self.interval = max(self.baseInterval, self.interval * RECOVER_FACTOR)
+        return self.interval
+
+#--XAKArefreshScheduler--------------------------------------------------------
+    def getFps(self):
+        """ Return the current refresh rate target (refreshes per sec)."""
+        return 1.0 / self.interval
+
+    def getStats(self):
+        stats = dict(self.stats)
+        stats.update({'fps': round(self.getFps(), 2),
+                      'costMs': round(self.cost*1000, 2) if self.cost is not None else None,
+                      'avgFps': round(self.stats['refreshes'] / max(1e-6, time.time()-self.startTime), 2)})
+        return stats
+
+#-----------------------------------------------------------------------------
+#-----------------------------------------------------------------------------
+def testCase(mode=0):
+    if mode == 0:
+        scheduler = XAKArefreshScheduler()
+        # refresh cost jumps to 60ms then comes back to 5ms.
+        for step, cost in enumerate([0.005]*5 + [0.06]*10 + [0.005]*30):
+            delay = scheduler.nextDelay(cost)
+            if step % 5 == 4: print("step %d cost %.0fms -> next refresh in %.3f sec" %(
+                step, cost*1000, delay))
+        print("minimized -> %.1f sec" % scheduler.nextDelay(visible=False))
+        print(scheduler.getStats())
+    else:
+        print("Put your test code here:")
+
+#-----------------------------------------------------------------------------
+if __name__ == '__main__':
+    testCase(mode=0)
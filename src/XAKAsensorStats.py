@@ -0,0 +1,267 @@
+#!/usr/bin/python
+#-----------------------------------------------------------------------------
+# Name:        XAKAsensorStats.py
+#
+# Purpose:     This module is the streaming statistics engine of the sensors'
+#              parameters: every tracked parameter (frame index, such as 4: people
+#              count, 9: ShortTerm avg, 27: final people count) of every sensor
+#              and of the cross-sensor aggregate (sum of the sensors' latest
+#              values, sampled on a fixed time tick) has a rolling mean/min/max/
+#              EWMA/percentiles over each of the configured time windows, updated
+#              in O(1) per sample. The UI
+#              grid/chart and the hub uplink read the values from the engine.
+#
+# Author:      Yuancheng Liu
+#
+# Created:     29/01/2022
+# version:     v_2.1
+# Copyright:   YC has not added.
+# License:     YC has not added.
+#-----------------------------------------------------------------------------
+
+import time
+import threading
+from collections import deque
+import numpy as np
+
+STATS_PARAMS = (4, 9, 27)   # default tracked frame indexes.
+STATS_WINDOWS = (60, 300)   # default rolling windows in sec.
+EWMA_ALPHA = 0.1            # weight of the newest sample in the EWMA.
+PERCENTILES = (50, 95)      # percentiles in the summary.
+AGG_IDX = -1                # sensor index of the cross-sensor aggregate.
+AGG_TICK = 1.0              # sec between 2 samples of the aggregate.
+
+#-----------------------------------------------------------------------------
+#-----------------------------------------------------------------------------
+class XAKArollingStat(object):
+    """ Rolling statistics of one value stream over the last <window> sec of the
+        samples' timestamps, the samples must be added in time order and every
+        sample has the same weight. add() is amortized O(1): running sum for the
+        mean and monotonic deques for the min/max, the percentiles are computed
+        at query time (O(window samples)) and cached until the next sample.
+    """
+    def __init__(self, window=STATS_WINDOWS[0], alpha=EWMA_ALPHA) -> None:
+        self.window = window
+        self.alpha = alpha
+        self.samples = deque()  # (timestamp, value) in the window.
+        self.minQ = deque()     # (timestamp, value) increasing values.
+        self.maxQ = deque()     # (timestamp, value) decreasing values.
+        self.total = 0.0        # sum of the values in the window.
+        self.ewma = None
+        self.last = None
+        self.sortedVals = None  # cached sorted values for the percentiles.
+
+#--XAKArollingStat-------------------------------------------------------------
+    def add(self, value, timestamp=None):
+        if timestamp is None: timestamp = time.time()
+        value = float(value)
+        self.samples.append((timestamp, value))
+        self.total += value
+        while self.minQ and self.minQ[-1][1] >= value: self.minQ.pop()
+        self.minQ.append((timestamp, value))
+        while self.maxQ and self.maxQ[-1][1] <= value: self.maxQ.pop()
+        self.maxQ.append((timestamp, value))
+        self.ewma = value if self.ewma is None else self.ewma + self.alpha*(value - self.ewma)
+        self.last = value
+        self.sortedVals = None
+        self._expire(timestamp - self.window)
+
+    def _expire(self, startTime):
+        """ Remove the samples older than the <startTime>."""
+        while self.samples[0][0] <= startTime:
+            self.total -= self.samples.popleft()[1]
+        if len(self.samples) == 1: self.total = self.samples[0][1] # no float drift.
+        while self.minQ[0][0] <= startTime: self.minQ.popleft()
+        while self.maxQ[0][0] <= startTime: self.maxQ.popleft()
+
+    def reset(self):
+        """ Remove all the samples."""
+        self.samples.clear()
+        self.minQ.clear()
+        self.maxQ.clear()
+        self.total = 0.0
+        self.ewma = self.last = self.sortedVals = None
+
+#--XAKArollingStat-------------------------------------------------------------
+    def count(self):
+        return len(self.samples)
+
+    def mean(self):
+        return self.total / len(self.samples) if self.samples else None
+
+    def min(self):
+        return self.minQ[0][1] if self.minQ else None
+
+    def max(self):
+        return self.maxQ[0][1] if self.maxQ else None
+
+    def percentile(self, q):
+        """ Return the <q>th (0~100) percentile of the values in the window."""
+        if not self.samples: return None
+        if self.sortedVals is None:
+            self.sortedVals = np.sort(np.fromiter((v for _, v in self.samples),
+                                                  dtype=np.float64, count=len(self.samples)))
+        return float(np.percentile(self.sortedVals, q))
+
+#--XAKArollingStat-------------------------------------------------------------
+    def summary(self, digits=3):
+        """ Return the stats dict (None values if no sample in the window)."""
+        if not self.samples: return {'count': 0}
+        result = {'count': len(self.samples), 'last': self.last, 'mean': self.mean(),
+                  'min': self.min(), 'max': self.max(), 'ewma': self.ewma}
+        for q in PERCENTILES: result['p%d' % q] = self.percentile(q)
+        return {key: round(val, digits) if isinstance(val, float) else val
+                for key, val in result.items()}
+
+#-----------------------------------------------------------------------------
+#-----------------------------------------------------------------------------
+class XAKAstatsEngine(object):
+    """ Rolling statistics of the tracked parameters of all the sensors, usage:
+            engine = XAKAstatsEngine(sensorNum=2)
+            engine.addFrames(0, [(timestamp, frame), ...])
+            engine.getStat(0, 27, window=60).mean()
+            engine.getStat(AGG_IDX, 27).max()   # all sensors' total people.
+        A sensor's stats are weighted per frame. The aggregate total is sampled
+        every <aggTick> sec of the engine clock (the newest frame timestamp of
+        all the sensors), so it is time weighted and in time order whatever the
+        sensors' frame rates and the order their frames are added in.
+        The engine is thread safe (the UI/daemon thread adds the frames and the
+        uplink thread reads the summary) and can be used as a XAKAsensorDaemon
+        reporter.
+    """
+    def __init__(self, sensorNum, params=STATS_PARAMS, windows=STATS_WINDOWS,
+                 alpha=EWMA_ALPHA, aggTick=AGG_TICK) -> None:
+        self.sensorNum = sensorNum
+        self.params = list(params)
+        self.windows = list(windows)
+        self.alpha = alpha
+        self.stats = {}     # (sensor idx, frame idx, window): XAKArollingStat
+        self.latest = [dict() for _ in range(sensorNum)]    # frame idx: latest value.
+        self.totals = {}    # frame idx: sum of the sensors' latest values.
+        self.aggTick = aggTick
+        self.nextTick = None    # engine clock time of the next aggregate sample.
+        self.lock = threading.Lock()
+        for paramIdx in self.params: self._addStats(paramIdx)
+
+#--XAKAstatsEngine-------------------------------------------------------------
+    def _addStats(self, paramIdx):
+        for idx in list(range(self.sensorNum)) + [AGG_IDX]:
+            for window in self.windows:
+                self.stats[(idx, paramIdx, window)] = XAKArollingStat(window, self.alpha)
+
+    def track(self, paramIdx, window=None):
+        """ Track the frame index <paramIdx> (0~36) and add the <window> (sec)
+            to all the tracked parameters. The stats start from the next frame.
+        """
+        with self.lock:
+            if window is not None and window not in self.windows:
+                self.windows.append(window)
+                for param in self.params:
+                    for idx in list(range(self.sensorNum)) + [AGG_IDX]:
+                        self.stats[(idx, param, window)] = XAKArollingStat(window, self.alpha)
+            if paramIdx not in self.params:
+                self.params.append(paramIdx)
+                self._addStats(paramIdx)
+
+#--XAKAstatsEngine-------------------------------------------------------------
+    def addFrames(self, idx, frameList):
+        """ Add the sensor's [(timestamp, frame)], return the tracked parameters'
+            values as a (frames number, params number) array (columns in the
+            <params> order) for the caller to display them.
+        """
+        if not frameList: return np.empty((0, len(self.params)))
+        values = np.array([[frame[p] for p in self.params] for _, frame in frameList],
+                          dtype=np.float64)
+        with self.lock:
+            latest = self.latest[idx]
+            for row, (timestamp, _) in zip(values.tolist(), frameList):
+                self._tickAggregate(timestamp)
+                for paramIdx, value in zip(self.params, row):
+                    for window in self.windows:
+                        self.stats[(idx, paramIdx, window)].add(value, timestamp)
+                    # the aggregate total changes by the sensor's value change.
+                    self.totals[paramIdx] = self.totals.get(paramIdx, 0.0) + value - latest.get(paramIdx, 0.0)
+                    latest[paramIdx] = value
+        return values
+
+    def _tickAggregate(self, timestamp):
+        """ Add the aggregate totals to its stats at every tick passed by the
+            engine clock moved to <timestamp> (the older timestamps do not move
+            it). Only the ticks in the largest window are added after a gap.
+        """
+        if self.nextTick is None: self.nextTick = timestamp
+        gap = timestamp - self.nextTick
+        if gap < 0: return
+        if gap > max(self.windows):
+            self.nextTick += (gap - max(self.windows)) // self.aggTick * self.aggTick
+        while self.nextTick <= timestamp:
+            for paramIdx, total in self.totals.items():
+                for window in self.windows:
+                    self.stats[(AGG_IDX, paramIdx, window)].add(total, self.nextTick)
+            self.nextTick += self.aggTick
+
+    def reportFrames(self, idx, sensorName, frameList):
+        """ XAKAsensorDaemon reporter interface."""
+        self.addFrames(idx, frameList)
+
+#--XAKAstatsEngine-------------------------------------------------------------
+    def removeSensor(self, idx):
+        """ Remove the (offline) sensor's latest values from the aggregate."""
+        with self.lock:
+            for paramIdx, value in self.latest[idx].items():
+                self.totals[paramIdx] -= value
+            self.latest[idx] = {}
+
+    def resetSensor(self, idx):
+        """ Clear the sensor's stats and the aggregate stats (such as the replay
+            moved back in time), the sensor's latest values stay in the totals.
+        """
+        with self.lock:
+            for (statIdx, _, _), stat in self.stats.items():
+                if statIdx in (idx, AGG_IDX): stat.reset()
+            self.nextTick = None
+
+#--XAKAstatsEngine-------------------------------------------------------------
+    def getStat(self, idx, paramIdx, window=None):
+        """ Return the XAKArollingStat of the sensor <idx> (AGG_IDX: aggregate),
+            the frame index <paramIdx> and the <window> (default: the first one).
+        """
+        return self.stats[(idx, paramIdx, self.windows[0] if window is None else window)]
+
+    def getLatest(self, idx, paramIdx):
+        """ Return the sensor's latest value (the aggregate: sum of the sensors)."""
+        if idx == AGG_IDX: return self.totals.get(paramIdx)
+        return self.latest[idx].get(paramIdx)
+
+    def getMean(self, idx, paramIdx, window=None):
+        with self.lock:
+            return self.getStat(idx, paramIdx, window).mean()
+
+#--XAKAstatsEngine-------------------------------------------------------------
+    def summary(self, idx, window=None):
+        """ Return {frame idx: stats dict} of the sensor <idx> in the window."""
+        with self.lock:
+            return {paramIdx: self.getStat(idx, paramIdx, window).summary()
+                    for paramIdx in self.params}
+
+#-----------------------------------------------------------------------------
+#-----------------------------------------------------------------------------
+def testCase(mode=0):
+    if mode == 0:
+        import XAKAsensorComm as xcomm
+        sim = xcomm.XandarSimulator(seed=0)
+        sim.setChunk(xcomm.FRAME_HEADER, xcomm.FRAME_SIZE)
+        frames = xcomm.XAKAframeDecoder().feed(sim.read(2000*(xcomm.FRAME_SIZE+4)))
+        engine = XAKAstatsEngine(2, windows=(10, 60))
+        startTime = time.perf_counter()
+        for i in range(0, 2000, 10):
+            engine.addFrames(i//10 % 2, [(i/10 + j*0.1, f) for j, f in enumerate(frames[i:i+10])])
+        print("2000 frames added in %.1f ms" % ((time.perf_counter()-startTime)*1000))
+        print("last 60 sec sensor0 stats: %s" % str(engine.summary(0, 60)[27]))
+        print("aggregate: %s" % str(engine.summary(AGG_IDX, 10)[27]))
+    else:
+        print("Put your test code here:")
+
+#-----------------------------------------------------------------------------
+if __name__ == '__main__':
+    testCase(mode=0)
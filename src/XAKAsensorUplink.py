@@ -0,0 +1,326 @@
+#!/usr/bin/python
+#-----------------------------------------------------------------------------
+# Name:        XAKAsensorUplink.py
+#
+# Purpose:     This module is the continuous telemetry uplink to the control hub:
+#              the frames of all the attached sensors are batched (<batchSize>
+#              frames or <flushInterval> sec) into compressed length prefixed
+#              data messages (XAKAsensorHubMsg) and sent by a worker thread over
+#              the persistent hub session (XAKAsensorHubClient), every batch is
+#              acknowledged by the hub (at-least-once delivery).
+#              When the hub is unreachable or slower than the sensors, the
+#              batches are spilled to a disk queue and sent later in order.
+#              If a stats engine (XAKAsensorStats) is set, every batch also
+#              carries the sensors' rolling stats summary.
+#
+# Author:      Yuancheng Liu
+#
+# Created:     29/01/2022
+# version:     v_2.1
+# Copyright:   YC has not added.
+# License:     YC has not added.
+#-----------------------------------------------------------------------------
+
+import os
+import glob
+import time
+import threading
+from collections import deque
+from concurrent import futures
+import numpy as np
+import XAKAsensorHubMsg as xmsg
+
+UPLINK_BATCH = 256      # max frames in one data message.
+FLUSH_INTERVAL = 2.0    # max sec a frame waits in the batch before sent.
+SEND_QUEUE_SIZE = 32    # max batches waiting in memory to be sent.
+SPILL_MAX_BYTES = 256*1024*1024 # max size of the disk spill queue.
+SPILL_PREFIX, SPILL_EXT = 'uplink_', '.msg'
+ACK_TIMEOUT = 10        # sec to wait the hub acknowledgement of a batch.
+RETRY_DELAY = 0.5       # sec to wait before resending a batch not acknowledged.
+
+#-----------------------------------------------------------------------------
+#-----------------------------------------------------------------------------
+class XAKAuplink(object):
+    """ Sensor data uplink, usage example:
+            session = XAKAhubSession(('127.0.0.1', 5006), 'app0')
+            session.start()
+            uplink = XAKAuplink(session, spillDir='spill')
+            uplink.start()
+            uplink.reportFrames(0, '/dev/ttyUSB0', [(timestamp, frame), ...])
+            uplink.close()
+        reportFrames() never blocks the caller (it can be a XAKAsensorDaemon
+        reporter). Without <spillDir>, the oldest batch is dropped when the send
+        queue is full.
+    """
+    def __init__(self, hubSession, batchSize=UPLINK_BATCH, flushInterval=FLUSH_INTERVAL,
+                 queueSize=SEND_QUEUE_SIZE, spillDir=None, spillMaxBytes=SPILL_MAX_BYTES,
+                 statsEngine=None) -> None:
+        self.session = hubSession   # XAKAhubSession the batches are sent through.
+        self.appId = hubSession.appId
+        self.statsEngine = statsEngine  # XAKAstatsEngine of the reported sensors.
+        self.flushInterval = flushInterval
+        self.queueSize = queueSize
+        self.spillDir = spillDir
+        self.spillMaxBytes = spillMaxBytes
+        # Current batch.
+        self.batch = np.zeros(batchSize, dtype=xmsg.DATA_DTYPE)
+        self.batchNum = 0
+        self.batchTime = None   # time the first frame was added to the batch.
+        self.sensorNames = []   # names of the 'sensor' index in the batch.
+        self.sensorIdxs = {}    # sensor name: index in the stats engine.
+        self.batchLock = threading.Lock()
+        # Send queues: the memory queue items are older than the spilled ones.
+        self.sendQueue = deque()    # (seq, message bytes)
+        self.spillQueue = deque()   # (seq, file path, file size)
+        self.spillBytes = 0
+        self.queueLock = threading.Lock()
+        self.seq = 0            # sequence number of the next batch.
+        if spillDir: self._loadSpill()
+        self.sendThread = None
+        self.terminate = threading.Event()
+        self.stats = dict.fromkeys(('framesSent', 'batchesSent', 'bytesSent', 'rawBytes',
+                                    'batchesSpilled', 'batchesDropped', 'sendErrors'), 0)
+
+#--XAKAuplink------------------------------------------------------------------
+    def _loadSpill(self):
+        """ Reload the batches spilled (and not sent) by the previous run."""
+        os.makedirs(self.spillDir, exist_ok=True)
+        for filePath in sorted(glob.glob(os.path.join(self.spillDir, SPILL_PREFIX+'*'+SPILL_EXT))):
+            seq = int(os.path.basename(filePath)[len(SPILL_PREFIX):-len(SPILL_EXT)])
+            size = os.path.getsize(filePath)
+            self.spillQueue.append((seq, filePath, size))
+            self.spillBytes += size
+            self.seq = seq + 1
+
+#--XAKAuplink------------------------------------------------------------------
+    def start(self):
+        if self.sendThread and self.sendThread.is_alive(): return
+        self.terminate.clear()
+        self.sendThread = threading.Thread(target=self._sendLoop, daemon=True,
+                                           name='XAKAuplink')
+        self.sendThread.start()
+
+#--XAKAuplink------------------------------------------------------------------
+    def reportFrames(self, sensorIdx, sensorName, frameList):
+        """ Add the sensor's [(timestamp, frame)] to the batch."""
+        if not frameList: return
+        values = np.asarray([frame for _, frame in frameList], dtype=np.float64)
+        times = np.asarray([ts for ts, _ in frameList], dtype=np.float64)
+        with self.batchLock:
+            if sensorName not in self.sensorNames: self.sensorNames.append(sensorName)
+            self.sensorIdxs[sensorName] = sensorIdx
+            nameIdx = self.sensorNames.index(sensorName)
+            start = 0
+            while start < len(values):
+                if self.batchNum == 0: self.batchTime = time.time()
+                num = min(len(values) - start, len(self.batch) - self.batchNum)
+                rows = self.batch[self.batchNum:self.batchNum+num]
+                rows['sensor'] = nameIdx
+                rows['ts'] = times[start:start+num]
+                rows['senId'] = values[start:start+num, 0]
+                rows['paramNum'] = values[start:start+num, 1]
+                rows['params'] = values[start:start+num, 2:]
+                self.batchNum += num
+                start += num
+                if self.batchNum == len(self.batch): self._flushBatch()
+
+#--XAKAuplink------------------------------------------------------------------
+    def _flushBatch(self):
+        """ Pack the current batch in a data message and queue it (batchLock held)."""
+        if self.batchNum == 0: return
+        records = self.batch[:self.batchNum]
+        with self.queueLock:
+            seq = self.seq
+            self.seq += 1
+        extra = {}
+        if self.statsEngine:
+            extra['stats'] = {name: self.statsEngine.summary(self.sensorIdxs[name])
+                              for name in self.sensorNames}
+        msgByte = xmsg.dumpDataMsg(self.appId, seq, self.sensorNames, records, **extra)
+        self.stats['rawBytes'] += records.nbytes
+        self.batchNum, self.batchTime = 0, None
+        self._enqueue(seq, msgByte)
+
+    def flush(self):
+        with self.batchLock:
+            self._flushBatch()
+
+#--XAKAuplink------------------------------------------------------------------
+    def _enqueue(self, seq, msgByte):
+        """ Queue the batch in memory, or spill it to disk (drop the oldest batch
+            if no spill dir) when the hub is not keeping up.
+        """
+        with self.queueLock:
+            if not self.spillQueue and len(self.sendQueue) < self.queueSize:
+                self.sendQueue.append((seq, msgByte))
+                return
+            if not self.spillDir:
+                self.sendQueue.popleft()
+                self.stats['batchesDropped'] += 1
+                self.sendQueue.append((seq, msgByte))
+                return
+            self._spill(seq, msgByte)
+
+#--XAKAuplink------------------------------------------------------------------
+    def _spill(self, seq, msgByte):
+        """ Write the batch in the disk spill queue (queueLock held)."""
+        filePath = os.path.join(self.spillDir, SPILL_PREFIX + '%012d' % seq + SPILL_EXT)
+        try:
+            with open(filePath, 'wb') as fh:
+                fh.write(msgByte)
+        except OSError as err:
+            print("Uplink: spill batch error: %s" % str(err))
+            self.stats['batchesDropped'] += 1
+            return
+        self.spillQueue.append((seq, filePath, len(msgByte)))
+        self.spillBytes += len(msgByte)
+        self.stats['batchesSpilled'] += 1
+        while self.spillBytes > self.spillMaxBytes and len(self.spillQueue) > 1:
+            self._removeSpill()
+            self.stats['batchesDropped'] += 1
+
+    def _removeSpill(self):
+        _, filePath, size = self.spillQueue.popleft()
+        self.spillBytes -= size
+        try:
+            os.remove(filePath)
+        except OSError as err:
+            print("Uplink: remove spill file error: %s" % str(err))
+
+#--XAKAuplink------------------------------------------------------------------
+    def _nextMsg(self):
+        """ Return the oldest (seq, message bytes, fromSpill) to send or None."""
+        with self.queueLock:
+            if self.sendQueue: return self.sendQueue[0] + (False,)
+            if not self.spillQueue: return None
+            seq, filePath, _ = self.spillQueue[0]
+        try:
+            with open(filePath, 'rb') as fh:
+                return seq, fh.read(), True
+        except OSError as err:
+            print("Uplink: read spill file error: %s" % str(err))
+            with self.queueLock: self._removeSpill()
+            return None
+
+    def _msgSent(self, seq, fromSpill):
+        """ Remove the sent batch (if it was not dropped meanwhile)."""
+        with self.queueLock:
+            queue = self.spillQueue if fromSpill else self.sendQueue
+            if not (queue and queue[0][0] == seq): return
+            if fromSpill:
+                self._removeSpill()
+            else:
+                self.sendQueue.popleft()
+
+#--XAKAuplink------------------------------------------------------------------
+    def _sendLoop(self):
+        """ Worker thread: send the queued batches one by one (the next batch is
+            sent after the hub acknowledged the previous one).
+        """
+        while not self.terminate.is_set():
+            with self.batchLock:
+                if self.batchTime and time.time() - self.batchTime > self.flushInterval:
+                    self._flushBatch()
+            item = self._nextMsg() if self.session.isConnected() else None
+            if item is None:
+                self.terminate.wait(0.1)
+                continue
+            seq, msgByte, fromSpill = item
+            try:
+                reply = self.session.sendMsg(msgByte, 'DT').result(timeout=ACK_TIMEOUT)
+                if reply.get('seq') != seq:
+                    raise ValueError('unexpected ack of batch %s' % str(reply.get('seq')))
+            except (OSError, ValueError, futures.TimeoutError) as err:
+                print("Uplink: send batch %d error: %s" %(seq, str(err)))
+                self.stats['sendErrors'] += 1
+                self.terminate.wait(RETRY_DELAY)
+                continue
+            self._msgSent(seq, fromSpill)
+            self.stats['batchesSent'] += 1
+            self.stats['bytesSent'] += len(msgByte)
+            self.stats['framesSent'] += reply.get('count', 0)
+
+#--XAKAuplink------------------------------------------------------------------
+    def getStats(self):
+        """ Return the uplink counters and the queues' state."""
+        stats = dict(self.stats)
+        with self.queueLock:
+            stats.update({'queued': len(self.sendQueue), 'spilled': len(self.spillQueue),
+                          'spillBytes': self.spillBytes, 'connected': self.session.isConnected()})
+        stats['compressRatio'] = round(stats['rawBytes'] / stats['bytesSent'], 2) \
+            if stats['bytesSent'] else 0.0
+        return stats
+
+#--XAKAuplink------------------------------------------------------------------
+    def close(self, timeout=2):
+        """ Flush the batch, stop the worker thread and spill the batches not
+            sent (if the spill dir is set) so they are sent by the next run.
+        """
+        self.flush()
+        if self.sendThread:
+            deadline = time.time() + timeout
+            while self.session.isConnected() and self._nextMsg() and time.time() < deadline:
+                time.sleep(0.05)    # give some time to send the last batches.
+            self.terminate.set()
+            self.sendThread.join(timeout)
+            self.sendThread = None
+        with self.queueLock:
+            while self.sendQueue and self.spillDir:
+                seq, msgByte = self.sendQueue.pop()
+                self._spill(seq, msgByte)   # spill queue is sorted at reload.
+
+#-----------------------------------------------------------------------------
+#-----------------------------------------------------------------------------
+def testCase(mode=0):
+    if mode == 0:
+        import tempfile
+        import XAKAsensorComm as xcomm
+        import XAKAsensorHubClient as xclient
+        # the hub is not running: all the batches are spilled.
+        session = xclient.XAKAhubSession(('127.0.0.1', 1), 'app0')
+        session.start()
+        spillDir = tempfile.mkdtemp()
+        uplink = XAKAuplink(session, batchSize=64, queueSize=2, spillDir=spillDir)
+        uplink.start()
+        sim = xcomm.XandarSimulator(seed=0)
+        sim.setChunk(xcomm.FRAME_HEADER, xcomm.FRAME_SIZE)
+        frames = xcomm.XAKAframeDecoder().feed(sim.read(1100*(xcomm.FRAME_SIZE+4)))
+        startT = time.time()
+        uplink.reportFrames(0, 'SIMU0', [(startT + i, f) for i, f in enumerate(frames[:1000])])
+        time.sleep(0.5)
+        uplink.close()
+        session.close()
+        print(uplink.getStats())
+        batchNum = -(-1000 // 64)
+        assert uplink.getStats()['spilled'] == batchNum
+        # the next run reloads the spill queue in the batches' order and sends
+        # it before the new batches (stand-in session acknowledging every batch).
+        class AckSession(object):
+            appId = 'app0'
+            def __init__(self): self.msgList = []
+            def isConnected(self): return True
+            def sendMsg(self, msgByte, action):
+                msgDict, binData = xmsg.XAKAmsgDecoder().feed(msgByte)[0]
+                self.msgList.append((msgDict, xmsg.loadDataRecords(binData)))
+                future = futures.Future()
+                future.set_result({'seq': msgDict['seq'], 'count': msgDict['count']})
+                return future
+        ackSession = AckSession()
+        uplink = XAKAuplink(ackSession, batchSize=64, spillDir=spillDir)
+        assert [item[0] for item in uplink.spillQueue] == list(range(batchNum))
+        assert uplink.seq == batchNum
+        uplink.start()
+        uplink.reportFrames(0, 'SIMU0', [(startT + 1000 + i, f) for i, f in enumerate(frames[1000:])])
+        uplink.close()
+        seqList = [msgDict['seq'] for msgDict, _ in ackSession.msgList]
+        times = np.concatenate([records['ts'] for _, records in ackSession.msgList])
+        print("Resent %d batches, seq %s~%s" %(len(seqList), seqList[0], seqList[-1]))
+        assert seqList == list(range(batchNum + 2))
+        assert np.array_equal(times, startT + np.arange(len(frames)))
+        assert not glob.glob(os.path.join(spillDir, '*' + SPILL_EXT))
+    else:
+        print("Put your test code here:")
+
+#-----------------------------------------------------------------------------
+if __name__ == '__main__':
+    testCase(mode=0)